@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks de las rutas calientes del bot.
+
+Cubre guards de seguridad, sanitizadores, lectura/escritura de configuración
+en SQLite (incluidas ráfagas de alta de usuarios), codificación de imágenes y
+el escape de MarkdownV2 y la búsqueda en el índice de documentos.
+
+Uso:
+    python benchmarks/micro.py                          # mide e imprime
+    python benchmarks/micro.py --save                   # actualiza baseline.json
+    python benchmarks/micro.py --compare                # falla si hay regresiones
+    python benchmarks/micro.py --compare --threshold 0.3 --filter guard
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import sqlite3
+import string
+import sys
+import tempfile
+import timeit
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+# Antes de importar bot.*: el nivel por defecto del bot es ERROR
+os.environ.setdefault("LOGGER_LEVEL", "ERROR")
+
+from loguru import logger  # noqa: E402
+
+from bot import database as db  # noqa: E402
+from bot.handlers.commands import escape_markdown  # noqa: E402
+from bot.security import (  # noqa: E402
+    CommandSpamGuard,
+    CompositeGuard,
+    CompositeSanitizer,
+    ControlCharsSanitizer,
+    ImageSizeGuard,
+    MessageLengthGuard,
+    ProfanityGuard,
+    RateLimitGuard,
+    TrimSanitizer,
+)
+from core.llm_clients import _prepare_image_content  # noqa: E402
+from core.retrieval import VectorFile  # noqa: E402
+
+BASELINE_PATH = Path(__file__).resolve().parent / "baseline.json"
+DEFAULT_DB_SIZES = (10_000, 100_000, 1_000_000)
+IMAGE_SIZES_MB = (0.5, 1, 2, 5)
+RETRIEVAL_ROWS = 100_000
+RETRIEVAL_DIMENSIONS = 256
+DEFAULT_ONBOARDING_BURST = 1000
+ONBOARDING_FIELDS = {
+    "api_key": "sk-bench",
+    "base_url": "https://api.test/v1",
+    "model_name": "gpt-4o",
+    "system_prompt": "hola",
+}
+
+Case = Tuple[str, Callable[[], object]]
+
+
+def _random_text(rng: random.Random, length: int) -> str:
+    alphabet = string.ascii_letters + string.digits + " áéíóúñ¿?¡!.,*_`[]()"
+    return "".join(rng.choice(alphabet) for _ in range(length))
+
+
+def _message_corpus(rng: random.Random, size: int = 512) -> List[str]:
+    """
+    Distribución aproximada del tráfico real: mayoría de mensajes cortos,
+    algunos párrafos medianos y pocos textos cerca del límite de 4000.
+    """
+    messages = []
+    for _ in range(size):
+        roll = rng.random()
+        if roll < 0.7:
+            length = rng.randint(5, 120)
+        elif roll < 0.95:
+            length = rng.randint(120, 1000)
+        else:
+            length = rng.randint(1000, 4000)
+        text = _random_text(rng, length)
+        if rng.random() < 0.1:
+            text = f"  \x07{text}\x1b\n  "
+        messages.append(text)
+    return messages
+
+
+def _cycle(items: List) -> Callable[[], object]:
+    """Devuelve una función que recorre ``items`` cíclicamente para variar la entrada."""
+    state = {"i": 0}
+
+    def _next():
+        item = items[state["i"] % len(items)]
+        state["i"] += 1
+        return item
+
+    return _next
+
+
+def guard_cases(rng: random.Random) -> List[Case]:
+    messages = _message_corpus(rng)
+    contexts = [
+        {
+            "user_id": rng.randint(1, 50_000),
+            "text": text,
+            "image_size_bytes": rng.choice([None, 200_000, 6_000_000]),
+            "is_command": rng.random() < 0.2,
+        }
+        for text in messages
+    ]
+    next_ctx = _cycle(contexts)
+
+    guards = {
+        "rate_limit": RateLimitGuard(max_requests=6, window_seconds=10),
+        "message_length": MessageLengthGuard(max_chars=4000),
+        "image_size": ImageSizeGuard(max_bytes=5 * 1024 * 1024),
+        "profanity": ProfanityGuard(),
+        "command_spam": CommandSpamGuard(cooldown_seconds=2),
+    }
+    cases: List[Case] = []
+    for name, guard in guards.items():
+        composite = CompositeGuard(guard)
+        cases.append((f"guard.{name}", lambda c=composite: c.check(next_ctx())))
+
+    full = CompositeGuard(
+        RateLimitGuard(max_requests=6, window_seconds=10),
+        MessageLengthGuard(max_chars=4000),
+        ImageSizeGuard(max_bytes=5 * 1024 * 1024),
+    )
+    cases.append(("guard.composite_handlers", lambda: full.check(next_ctx())))
+    return cases
+
+
+def sanitizer_cases(rng: random.Random) -> List[Case]:
+    next_msg = _cycle(_message_corpus(rng))
+    sanitizer = CompositeSanitizer(TrimSanitizer(), ControlCharsSanitizer())
+    return [("sanitizer.composite_handlers", lambda: sanitizer.sanitize(next_msg()))]
+
+
+def escape_cases(rng: random.Random) -> List[Case]:
+    next_msg = _cycle(_message_corpus(rng))
+    return [("commands.escape_markdown", lambda: escape_markdown(next_msg()))]
+
+
+def _populate_users(db_path: Path, users: int) -> None:
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.executemany(
+            "INSERT INTO user_config (user_id, api_key, base_url, model_name, system_prompt) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (
+                (uid, f"sk-{uid:010d}", "https://api.test/v1", "gpt-4o", "hola")
+                for uid in range(1, users + 1)
+            ),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def database_cases(rng: random.Random, tmp_dir: Path, sizes) -> List[Case]:
+    cases: List[Case] = []
+    for users in sizes:
+        db_path = tmp_dir / f"bench_{users}.db"
+        db.DB_PATH = db_path
+        db.init_db()
+        _populate_users(db_path, users)
+        user_ids = [rng.randint(1, users) for _ in range(1024)]
+        next_uid = _cycle(user_ids)
+
+        def _get(path=db_path, next_uid=next_uid):
+            # Lectura en frío: la caché se vacía en cada llamada
+            db.DB_PATH = path
+            db.clear_config_cache()
+            return db.get_user_config(next_uid())
+
+        def _get_cached(path=db_path, next_uid=next_uid):
+            db.DB_PATH = path
+            return db.get_user_config(next_uid())
+
+        def _set(path=db_path, next_uid=next_uid):
+            db.DB_PATH = path
+            return db.set_user_config(next_uid(), "model_name", "gpt-4-turbo")
+
+        cases.append((f"database.get_user_config[{users}]", _get))
+        cases.append((f"database.get_user_config_cached[{users}]", _get_cached))
+        cases.append((f"database.set_user_config[{users}]", _set))
+    return cases
+
+
+def onboarding_cases(rng: random.Random, tmp_dir: Path, burst: int) -> List[Case]:
+    """
+    Alta de ``burst`` usuarios nuevos por llamada: cuatro comandos ``/set_*``
+    por usuario frente a un único ``/setup``.
+    """
+    existing = DEFAULT_DB_SIZES[0]
+    db_path = tmp_dir / "bench_onboarding.db"
+    db.DB_PATH = db_path
+    db.init_db()
+    _populate_users(db_path, existing)
+    new_ids = itertools.count(existing + 1)
+
+    def _per_field(path=db_path):
+        db.DB_PATH = path
+        for user_id in itertools.islice(new_ids, burst):
+            for key, value in ONBOARDING_FIELDS.items():
+                db.set_user_config(user_id, key, value)
+
+    def _many(path=db_path):
+        db.DB_PATH = path
+        for user_id in itertools.islice(new_ids, burst):
+            db.set_user_config_many(user_id, ONBOARDING_FIELDS)
+
+    return [
+        (f"database.onboarding.set_user_config_x4[{burst}]", _per_field),
+        (f"database.onboarding.set_user_config_many[{burst}]", _many),
+    ]
+
+
+def image_cases(rng: random.Random, tmp_dir: Path) -> List[Case]:
+    cases: List[Case] = []
+    for size_mb in IMAGE_SIZES_MB:
+        path = tmp_dir / f"bench_{size_mb}mb.jpg"
+        path.write_bytes(rng.randbytes(int(size_mb * 1024 * 1024)))
+        cases.append(
+            (
+                f"llm_clients._prepare_image_content[{size_mb}MB]",
+                lambda p=path: _prepare_image_content(image_path=p),
+            )
+        )
+    return cases
+
+
+def retrieval_cases(rng: random.Random, tmp_dir: Path) -> List[Case]:
+    """Top-k sobre un índice de ``RETRIEVAL_ROWS`` fragmentos mapeado en disco."""
+    import numpy as np
+
+    generator = np.random.default_rng(rng.randrange(2**32))
+    cases: List[Case] = []
+    for dtype in ("float32", "float16"):
+        directory = tmp_dir / f"index_{dtype}"
+        directory.mkdir()
+        index = VectorFile(directory, RETRIEVAL_DIMENSIONS, "bench", dtype)
+        vectors = generator.standard_normal((RETRIEVAL_ROWS, RETRIEVAL_DIMENSIONS), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        index.append(vectors.astype(dtype))
+        query = vectors[rng.randrange(RETRIEVAL_ROWS)]
+        cases.append(
+            (
+                f"retrieval.search[{RETRIEVAL_ROWS}x{RETRIEVAL_DIMENSIONS},{dtype}]",
+                lambda index=index, query=query: index.search(query, 4),
+            )
+        )
+    return cases
+
+
+def measure(func: Callable[[], object], repeat: int, min_time: float) -> float:
+    """Retorna el mejor tiempo por llamada (segundos) entre ``repeat`` rondas."""
+    timer = timeit.Timer(func)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= min_time:
+            break
+        number *= 2
+    best = elapsed / number
+    for _ in range(repeat - 1):
+        best = min(best, timer.timeit(number) / number)
+    return best
+
+
+def run(
+    name_filter: str,
+    db_sizes,
+    repeat: int,
+    min_time: float,
+    burst: int = DEFAULT_ONBOARDING_BURST,
+) -> Dict[str, float]:
+    results: Dict[str, float] = {}
+    with tempfile.TemporaryDirectory(prefix="bot_bench_") as tmp:
+        tmp_dir = Path(tmp)
+        groups = {
+            "guard": guard_cases,
+            "sanitizer": sanitizer_cases,
+            "commands": escape_cases,
+            "database": lambda rng: database_cases(rng, tmp_dir, db_sizes),
+            "database_onboarding": lambda rng: onboarding_cases(rng, tmp_dir, burst),
+            "llm_clients": lambda rng: image_cases(rng, tmp_dir),
+            "retrieval": lambda rng: retrieval_cases(rng, tmp_dir),
+        }
+        original_db_path = db.DB_PATH
+        try:
+            for group, build in groups.items():
+                if name_filter and name_filter not in group:
+                    continue
+                # Semilla fija por grupo: --filter no altera las entradas de los demás
+                for name, func in build(random.Random(1234)):
+                    results[name] = measure(func, repeat, min_time)
+                    print(f"{name:<50} {results[name] * 1e6:12.2f} µs")
+        finally:
+            db.DB_PATH = original_db_path
+    return results
+
+
+def compare(
+    results: Dict[str, float], baseline: Dict[str, float], threshold: float
+) -> List[str]:
+    """Lista los benchmarks cuyo tiempo supera el baseline en más de ``threshold``."""
+    regressions = []
+    for name, current in results.items():
+        reference = baseline.get(name)
+        if not reference:
+            continue
+        ratio = current / reference
+        if ratio > 1 + threshold:
+            regressions.append(
+                f"{name}: {reference * 1e6:.2f} µs -> {current * 1e6:.2f} µs (x{ratio:.2f})"
+            )
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--filter", default="", help="Solo grupos que contengan este texto")
+    parser.add_argument(
+        "--db-sizes",
+        default=",".join(str(s) for s in DEFAULT_DB_SIZES),
+        help="Número de usuarios a poblar, separados por comas",
+    )
+    parser.add_argument(
+        "--burst",
+        type=int,
+        default=DEFAULT_ONBOARDING_BURST,
+        help="Usuarios nuevos por llamada en los benchmarks de alta",
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.05)
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--save", action="store_true", help="Guarda los resultados como baseline")
+    parser.add_argument("--compare", action="store_true", help="Compara contra el baseline")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="Regresión tolerada (0.25 = 25%% más lento que el baseline)",
+    )
+    args = parser.parse_args(argv)
+
+    # El nivel por defecto del bot es ERROR; evitamos medir la escritura a stderr
+    logger.remove()
+
+    db_sizes = [int(s) for s in args.db_sizes.split(",") if s.strip()]
+    results = run(args.filter, db_sizes, args.repeat, args.min_time, args.burst)
+
+    if args.save:
+        baseline = {}
+        if args.baseline.exists():
+            baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        baseline.update(results)
+        args.baseline.write_text(
+            json.dumps(dict(sorted(baseline.items())), indent=2) + "\n", encoding="utf-8"
+        )
+        print(f"Baseline guardado en {args.baseline}")
+
+    if args.compare:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("\n❌ Regresiones detectadas:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("\n✅ Sin regresiones respecto al baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+"""
+Agrupación de mensajes por clave con ventana de silencio.
+
+``KeyedDebouncer`` acumula elementos por clave (``media_group_id``, chat, ...)
+y llama a ``on_flush`` una sola vez cuando pasa ``quiet_seconds`` sin
+elementos nuevos, o al cumplirse ``max_seconds`` desde el primero.
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+from loguru import logger
+
+FlushCallback = Callable[[Hashable, List[Any]], Awaitable[None]]
+
+
+@dataclass
+class _Batch:
+    first_at: float
+    items: List[Any] = field(default_factory=list)
+    timer: Optional[asyncio.Task] = None
+
+
+class KeyedDebouncer:
+    """
+    Args:
+        quiet_seconds: Silencio necesario para cerrar el lote
+        max_seconds: Tope desde el primer elemento; un flujo continuo no
+            retrasa la respuesta indefinidamente
+        on_flush: Corutina que recibe ``(clave, elementos)`` en orden de llegada
+    """
+
+    def __init__(self, quiet_seconds: float, max_seconds: float, on_flush: FlushCallback) -> None:
+        self.quiet_seconds = quiet_seconds
+        self.max_seconds = max(max_seconds, quiet_seconds)
+        self._on_flush = on_flush
+        self._batches: Dict[Hashable, _Batch] = {}
+
+    def __len__(self) -> int:
+        return len(self._batches)
+
+    def add(self, key: Hashable, item: Any) -> None:
+        """Añade un elemento y reprograma el cierre del lote."""
+        now = time.monotonic()
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = self._batches[key] = _Batch(first_at=now)
+        batch.items.append(item)
+        if batch.timer:
+            batch.timer.cancel()
+        delay = min(self.quiet_seconds, batch.first_at + self.max_seconds - now)
+        batch.timer = asyncio.create_task(self._flush_later(key, max(delay, 0.0)))
+
+    async def _flush_later(self, key: Hashable, delay: float) -> None:
+        await asyncio.sleep(delay)
+        await self.flush(key)
+
+    async def flush(self, key: Hashable) -> None:
+        batch = self._batches.pop(key, None)
+        if batch is None:
+            return
+        try:
+            await self._on_flush(key, batch.items)
+        except Exception as e:
+            logger.error("Error al procesar lote {}: {}", key, str(e), exc_info=True)
+
+    async def flush_all(self) -> None:
+        """Cierra todos los lotes abiertos (p. ej. al apagar)."""
+        for key in list(self._batches):
+            batch = self._batches.get(key)
+            if batch and batch.timer and batch.timer is not asyncio.current_task():
+                batch.timer.cancel()
+            await self.flush(key)
@@ -1,26 +1,214 @@
-from loguru import logger
-import sys
+"""
+Configuración del bot desde variables de entorno (y ``.env``).
+
+Importar este módulo no lee el entorno ni configura logs: ``load_config()``
+lo hace de forma explícita al arrancar el bot. El resto del código usa
+``get_config()``, que devuelve la configuración ya cargada (o los valores
+del entorno sin validar, útil para tests y herramientas).
+"""
+
 import os
-from dotenv import load_dotenv
-
-load_dotenv(".env")
-
-TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
-LOGGER_LEVEL = os.getenv("LOGGER_LEVEL", "ERROR").upper()
-if not TELEGRAM_TOKEN:
-    raise ValueError("❌ TELEGRAM_TOKEN no definido en .env.")
-
-
-logger.remove()  # Elimina cualquier configuración previa
-logger.add(
-    sys.stderr,
-    level=LOGGER_LEVEL,
-    format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>",
-)
-logger.add(
-    "bot.log",
-    level=LOGGER_LEVEL,
-    rotation="10 MB",
-    retention="10 days",
-    encoding="utf-8",
-)
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+# Use relative imports when running as module, absolute when running directly
+try:
+    from bot.logs import configure_logging, parse_levels
+except ImportError:
+    # Fallback to relative imports when running as module
+    from .logs import configure_logging, parse_levels
+
+
+def _env_float(name: str, default: str) -> float:
+    return float(os.getenv(name, default))
+
+
+def _env_int(name: str, default: str) -> int:
+    return int(os.getenv(name, default))
+
+
+@dataclass(frozen=True)
+class Settings:
+    telegram_token: Optional[str]
+    # Bots adicionales en el mismo proceso (ver bot/tenancy.py), separados por
+    # comas, y trabajos simultáneos máximos por bot (0 = reparto automático)
+    telegram_tokens: Tuple[str, ...]
+    bot_job_quota: int
+    logger_level: str
+    # Sink JSON opcional, niveles por módulo ("bot.jobs=DEBUG,httpx=WARNING") y
+    # máximo de mensajes por minuto desde una misma línea (0 = sin límite)
+    log_json_path: Optional[str]
+    log_levels: Optional[str]
+    log_rate_limit: int
+    # Grabación opt-in de tráfico anonimizado (ver bot/traffic.py)
+    traffic_record_path: Optional[str]
+    traffic_record_salt: Optional[str]
+    # Cola persistente de solicitudes al LLM (ver bot/jobs.py)
+    job_workers: int
+    job_drain_timeout: float
+    # Ventana para agrupar las fotos de un álbum (media_group_id)
+    album_window_seconds: float
+    album_max_window_seconds: float
+    # Fusión opcional de mensajes rápidos por chat (0 = desactivada)
+    coalesce_window_seconds: float
+    coalesce_max_seconds: float
+    # Historial por chat: presupuesto del prompt y umbral de compactación (tokens)
+    context_max_tokens: int
+    context_compact_tokens: int
+    context_keep_turns: int
+    # Intervalo de volcado de los contadores de uso a SQLite (ver bot/usage.py)
+    usage_flush_seconds: float
+    # Retención y compactación de data/bot.db (ver bot/maintenance.py)
+    retention_jobs_days: float
+    retention_turns_days: float
+    retention_turns_max_rows: int
+    retention_usage_days: float
+    maintenance_interval_seconds: float
+    # Franja UTC de poca actividad para vacuum/optimize, "inicio-fin"
+    maintenance_hours: str
+    # Instantánea de usuarios/endpoints activos para el arranque en caliente
+    # (ver bot/warmstart.py); vacío la desactiva
+    warmstart_path: Optional[str]
+    warmstart_users: int
+    # Espera máxima antes de empezar a atender; el resto sigue en segundo plano
+    warmstart_timeout: float
+    # Segundos entre volcados de user_data/chat_data a SQLite (ver bot/persistence.py)
+    persistence_interval: float
+    # Documentos: tamaño máximo (la Bot API no descarga más de 20 MB), tokens
+    # por fragmento, llamadas simultáneas al modelo y fragmentos máximos
+    document_max_bytes: int
+    document_chunk_tokens: int
+    document_concurrency: int
+    document_max_chunks: int
+    # Memoria de documentos (/remember): directorio de índices (vacío la
+    # desactiva), modelo y dimensión de embeddings (0 = la del modelo),
+    # tipo de la matriz (float32 o float16) y tokens por fragmento
+    knowledge_path: Optional[str]
+    embedding_model: str
+    embedding_dimensions: int
+    embedding_dtype: str
+    knowledge_chunk_tokens: int
+    retrieval_top_k: int
+    retrieval_min_score: float
+    # Caché semántica de respuestas (ver core/semantic_cache.py): similitud
+    # mínima (0 = desactivada), capacidad, TTL, desalojo lru/lfu y fracción
+    # de aciertos auditados. Con historial de conversación solo se comparte
+    # dentro del mismo chat; entre usuarios, solo las preguntas sin historial
+    semantic_cache_threshold: float
+    semantic_cache_capacity: int
+    semantic_cache_ttl_seconds: float
+    semantic_cache_eviction: str
+    semantic_cache_audit_rate: float
+    # Modo inline (ver bot/handlers/inline.py): silencio tras la última
+    # pulsación, espera máxima de una ráfaga y cache_time de las respuestas
+    inline_debounce_seconds: float
+    inline_max_wait_seconds: float
+    inline_cache_time: int
+    # Herramientas del modelo (ver core/tools.py): desactivadas por defecto
+    # porque no todos los endpoints admiten ``tools``; llamadas máximas al
+    # modelo y tiempo total por solicitud
+    tools_enabled: bool
+    tool_max_steps: int
+    tool_deadline_seconds: float
+    # IDs de Telegram con acceso a comandos de diagnóstico (/profile),
+    # separados por comas
+    admin_ids: Tuple[int, ...]
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        return cls(
+            telegram_token=os.getenv("TELEGRAM_TOKEN"),
+            telegram_tokens=tuple(
+                token.strip() for token in os.getenv("TELEGRAM_TOKENS", "").split(",") if token.strip()
+            ),
+            bot_job_quota=_env_int("BOT_JOB_QUOTA", "0"),
+            logger_level=os.getenv("LOGGER_LEVEL", "ERROR").upper(),
+            log_json_path=os.getenv("LOG_JSON_PATH"),
+            log_levels=os.getenv("LOG_LEVELS"),
+            log_rate_limit=_env_int("LOG_RATE_LIMIT", "30"),
+            traffic_record_path=os.getenv("TRAFFIC_RECORD_PATH"),
+            traffic_record_salt=os.getenv("TRAFFIC_RECORD_SALT"),
+            job_workers=_env_int("JOB_WORKERS", "4"),
+            job_drain_timeout=_env_float("JOB_DRAIN_TIMEOUT", "20"),
+            album_window_seconds=_env_float("ALBUM_WINDOW_SECONDS", "1.0"),
+            album_max_window_seconds=_env_float("ALBUM_MAX_WINDOW_SECONDS", "3.0"),
+            coalesce_window_seconds=_env_float("COALESCE_WINDOW_SECONDS", "0"),
+            coalesce_max_seconds=_env_float("COALESCE_MAX_SECONDS", "6.0"),
+            context_max_tokens=_env_int("CONTEXT_MAX_TOKENS", "2000"),
+            context_compact_tokens=_env_int("CONTEXT_COMPACT_TOKENS", "1500"),
+            context_keep_turns=_env_int("CONTEXT_KEEP_TURNS", "4"),
+            usage_flush_seconds=_env_float("USAGE_FLUSH_SECONDS", "5"),
+            retention_jobs_days=_env_float("RETENTION_JOBS_DAYS", "7"),
+            retention_turns_days=_env_float("RETENTION_TURNS_DAYS", "30"),
+            retention_turns_max_rows=_env_int("RETENTION_TURNS_MAX_ROWS", "200000"),
+            retention_usage_days=_env_float("RETENTION_USAGE_DAYS", "400"),
+            maintenance_interval_seconds=_env_float("MAINTENANCE_INTERVAL_SECONDS", "900"),
+            maintenance_hours=os.getenv("MAINTENANCE_HOURS", "3-5"),
+            warmstart_path=os.getenv("WARMSTART_PATH", "data/warmstart.json") or None,
+            warmstart_users=_env_int("WARMSTART_USERS", "500"),
+            warmstart_timeout=_env_float("WARMSTART_TIMEOUT", "3"),
+            persistence_interval=_env_float("PERSISTENCE_INTERVAL", "60"),
+            document_max_bytes=_env_int("DOCUMENT_MAX_BYTES", str(20 * 1024 * 1024)),
+            document_chunk_tokens=_env_int("DOCUMENT_CHUNK_TOKENS", "2000"),
+            document_concurrency=_env_int("DOCUMENT_CONCURRENCY", "4"),
+            document_max_chunks=_env_int("DOCUMENT_MAX_CHUNKS", "60"),
+            knowledge_path=os.getenv("KNOWLEDGE_PATH", "data/index") or None,
+            embedding_model=os.getenv("EMBEDDING_MODEL", "text-embedding-3-small"),
+            embedding_dimensions=_env_int("EMBEDDING_DIMENSIONS", "256"),
+            embedding_dtype=os.getenv("EMBEDDING_DTYPE", "float32"),
+            knowledge_chunk_tokens=_env_int("KNOWLEDGE_CHUNK_TOKENS", "400"),
+            retrieval_top_k=_env_int("RETRIEVAL_TOP_K", "4"),
+            retrieval_min_score=_env_float("RETRIEVAL_MIN_SCORE", "0.25"),
+            semantic_cache_threshold=_env_float("SEMANTIC_CACHE_THRESHOLD", "0"),
+            semantic_cache_capacity=_env_int("SEMANTIC_CACHE_CAPACITY", "5000"),
+            semantic_cache_ttl_seconds=_env_float("SEMANTIC_CACHE_TTL_SECONDS", "86400"),
+            semantic_cache_eviction=os.getenv("SEMANTIC_CACHE_EVICTION", "lru").lower(),
+            semantic_cache_audit_rate=_env_float("SEMANTIC_CACHE_AUDIT_RATE", "0.02"),
+            inline_debounce_seconds=_env_float("INLINE_DEBOUNCE_SECONDS", "0.8"),
+            inline_max_wait_seconds=_env_float("INLINE_MAX_WAIT_SECONDS", "3"),
+            inline_cache_time=_env_int("INLINE_CACHE_TIME", "300"),
+            tools_enabled=os.getenv("TOOLS_ENABLED", "false").lower() in ("1", "true", "yes"),
+            tool_max_steps=_env_int("TOOL_MAX_STEPS", "4"),
+            tool_deadline_seconds=_env_float("TOOL_DEADLINE_SECONDS", "30"),
+            admin_ids=tuple(
+                int(value) for value in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if value
+            ),
+        )
+
+
+_settings: Optional[Settings] = None
+
+
+def load_config(env_file: str = ".env", require_token: bool = True) -> Settings:
+    """
+    Lee ``.env`` y el entorno, valida y configura los logs.
+
+    Raises:
+        ValueError: Si no hay ``TELEGRAM_TOKEN`` ni ``TELEGRAM_TOKENS`` y
+            ``require_token`` es True
+    """
+    global _settings
+    from dotenv import load_dotenv
+
+    load_dotenv(env_file)
+    settings = Settings.from_env()
+    if require_token and not (settings.telegram_token or settings.telegram_tokens):
+        raise ValueError("❌ TELEGRAM_TOKEN no definido en .env.")
+
+    configure_logging(
+        level=settings.logger_level,
+        log_file="bot.log",
+        json_path=settings.log_json_path,
+        module_levels=parse_levels(settings.log_levels),
+        rate_limit=settings.log_rate_limit,
+    )
+    _settings = settings
+    return settings
+
+
+def get_config() -> Settings:
+    """Configuración cargada por ``load_config``; si no se llamó, la del entorno sin validar."""
+    global _settings
+    if _settings is None:
+        _settings = Settings.from_env()
+    return _settings
@@ -1,13 +1,64 @@
 import sqlite3
+import threading
+from collections import OrderedDict
 from pathlib import Path
-from typing import Dict, Optional, Any
+from typing import Dict, Iterable, List, Optional, Any
 from loguru import logger
 
+# Use relative imports when running as module, absolute when running directly
+try:
+    from bot.tenancy import current_bot
+except ImportError:
+    # Fallback to relative imports when running as module
+    from .tenancy import current_bot
+
 # Configuración
 DB_PATH = Path("data/bot.db")
 DB_PATH.parent.mkdir(parents=True, exist_ok=True)
 # El logger se importa desde config.py y ya está configurado con loguru
 
+# Caché LRU de configuraciones: cada mensaje la consulta dos veces (al
+# aceptarlo y al procesarlo). Las escrituras pasan por set_user_config_many,
+# que invalida la entrada; la clave incluye DB_PATH por si cambia (tests) y
+# el bot actual (ver bot/tenancy.py).
+CONFIG_CACHE_SIZE = 10_000
+_config_cache: "OrderedDict[tuple, Dict[str, Optional[str]]]" = OrderedDict()
+_config_cache_lock = threading.Lock()
+
+
+USER_CONFIG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS {table} (
+    bot_id INTEGER NOT NULL DEFAULT 0,
+    user_id INTEGER NOT NULL,
+    api_key TEXT,
+    base_url TEXT,
+    model_name TEXT,
+    system_prompt TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (bot_id, user_id)
+)
+"""
+
+
+def _migrate_user_config(conn: sqlite3.Connection) -> None:
+    """
+    Bases anteriores a los espacios por bot: la clave pasa de ``user_id`` a
+    ``(bot_id, user_id)``. SQLite no cambia claves primarias, así que se
+    reconstruye la tabla; las filas existentes quedan en el bot principal.
+    """
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(user_config)")}
+    if "bot_id" in columns:
+        return
+    conn.execute(USER_CONFIG_SCHEMA.format(table="user_config_new"))
+    conn.execute(
+        "INSERT INTO user_config_new (bot_id, user_id, api_key, base_url, model_name, "
+        "system_prompt, created_at) SELECT 0, user_id, api_key, base_url, model_name, "
+        "system_prompt, created_at FROM user_config"
+    )
+    conn.execute("DROP TABLE user_config")
+    conn.execute("ALTER TABLE user_config_new RENAME TO user_config")
+    logger.info("Tabla user_config migrada a claves (bot_id, user_id)")
+
 
 def init_db():
     """Inicializa la base de datos con una tabla nueva si no existe."""
@@ -15,16 +66,12 @@ def init_db():
         conn = sqlite3.connect(DB_PATH)
         cursor = conn.cursor()
 
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS user_config (
-            user_id INTEGER PRIMARY KEY,
-            api_key TEXT,
-            base_url TEXT,
-            model_name TEXT,
-            system_prompt TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """)
+        # Solo tiene efecto en una base vacía; las existentes se convierten con
+        # "python -m bot.maintenance --convert" (ver bot/maintenance.py)
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
+        cursor.execute(USER_CONFIG_SCHEMA.format(table="user_config"))
+        _migrate_user_config(conn)
 
         conn.commit()
         logger.info("Base de datos inicializada correctamente")
@@ -35,49 +82,81 @@ def init_db():
         conn.close()
 
 
+VALID_KEYS = ("api_key", "base_url", "model_name", "system_prompt")
+
+
 def set_user_config(user_id: int, key: str, value: Any) -> bool:
     """
     Guarda una configuración de usuario.
     Retorna True si tuvo éxito, False si falló.
     """
-    valid_keys = {"api_key", "base_url", "model_name", "system_prompt"}
-    if key not in valid_keys:
-        logger.error(f"Intento de guardar clave inválida: {key}")
+    return set_user_config_many(user_id, {key: value})
+
+
+def set_user_config_many(user_id: int, values: Dict[str, Any]) -> bool:
+    """
+    Guarda varias claves de configuración de un usuario en una sola sentencia
+    (``INSERT ... ON CONFLICT DO UPDATE``), de forma atómica.
+    Retorna True si tuvo éxito, False si falló o alguna clave es inválida.
+    """
+    invalid = [key for key in values if key not in VALID_KEYS]
+    if invalid or not values:
+        logger.error(f"Intento de guardar claves inválidas: {invalid or 'ninguna'}")
         return False
 
+    # Orden fijo: la misma combinación de claves genera el mismo SQL (caché de sentencias)
+    keys = [key for key in VALID_KEYS if key in values]
+    columns = ", ".join(keys)
+    placeholders = ", ".join("?" for _ in keys)
+    updates = ", ".join(f"{key} = excluded.{key}" for key in keys)
+
+    bot_id = current_bot.get()
+    conn = None
     try:
         conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-
-        # Verificar si el usuario existe
-        cursor.execute("SELECT 1 FROM user_config WHERE user_id = ?", (user_id,))
-        exists = cursor.fetchone()
-
-        if exists:
-            # Actualizar
-            cursor.execute(
-                f"UPDATE user_config SET {key} = ? WHERE user_id = ?", (value, user_id)
+        with conn:
+            conn.execute(
+                f"INSERT INTO user_config (bot_id, user_id, {columns}) VALUES (?, ?, {placeholders}) "
+                f"ON CONFLICT(bot_id, user_id) DO UPDATE SET {updates}",
+                (bot_id, user_id, *(values[key] for key in keys)),
             )
-        else:
-            # Insertar nuevo
-            cursor.execute(
-                f"INSERT INTO user_config (user_id, {key}) VALUES (?, ?)",
-                (user_id, value),
-            )
-
-        conn.commit()
-        logger.info(f"Configuración guardada para usuario {user_id}: {key}")
+        with _config_cache_lock:
+            _config_cache.pop((DB_PATH, bot_id, user_id), None)
+        logger.info("Configuración guardada para usuario {}: {}", user_id, columns)
         return True
 
     except Exception as e:
         logger.error(f"Error al guardar configuración: {str(e)}")
         return False
     finally:
-        conn.close()
+        if conn:
+            conn.close()
+
+
+def _cache_put(user_id: int, config: Dict[str, Optional[str]]) -> None:
+    key = (DB_PATH, current_bot.get(), user_id)
+    with _config_cache_lock:
+        _config_cache[key] = config
+        _config_cache.move_to_end(key)
+        while len(_config_cache) > CONFIG_CACHE_SIZE:
+            _config_cache.popitem(last=False)
+
+
+def clear_config_cache() -> None:
+    with _config_cache_lock:
+        _config_cache.clear()
 
 
 def get_user_config(user_id: int) -> Dict[str, Optional[str]]:
-    """Obtiene la configuración de un usuario."""
+    """Obtiene la configuración de un usuario del bot actual (desde la caché si ya se leyó)."""
+    bot_id = current_bot.get()
+    with _config_cache_lock:
+        cached = _config_cache.get((DB_PATH, bot_id, user_id))
+        if cached is not None:
+            _config_cache.move_to_end((DB_PATH, bot_id, user_id))
+            return dict(cached)
+
+    conn = None
     try:
         conn = sqlite3.connect(DB_PATH)
         conn.row_factory = sqlite3.Row  # Para acceso como diccionario
@@ -86,29 +165,66 @@ def get_user_config(user_id: int) -> Dict[str, Optional[str]]:
         # Verificar que la tabla existe
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='user_config'")
         if not cursor.fetchone():
-            logger.warning(f"Tabla user_config no existe en {DB_PATH}")
+            logger.warning("Tabla user_config no existe en {}", DB_PATH)
             return {}
 
         cursor.execute(
             "SELECT api_key, base_url, model_name, system_prompt "
-            "FROM user_config WHERE user_id = ?",
-            (user_id,),
+            "FROM user_config WHERE bot_id = ? AND user_id = ?",
+            (bot_id, user_id),
         )
 
         row = cursor.fetchone()
+        config = dict(row) if row else {}
         if row:
-            config = dict(row)
-            logger.info(f"Configuración obtenida para usuario {user_id}: {config}")
-            return config
+            # Sin volcar la configuración: incluye la API key
+            logger.debug("Configuración obtenida para usuario {}", user_id)
         else:
-            logger.info(f"No se encontró configuración para usuario {user_id}")
-            return {}
+            logger.debug("No se encontró configuración para usuario {}", user_id)
+        _cache_put(user_id, config)
+        return dict(config)
 
     except Exception as e:
         logger.error(f"Error al obtener configuración para usuario {user_id}: {str(e)}", exc_info=True)
         return {}
+    finally:
+        if conn:
+            conn.close()
+
+
+def prefetch_user_configs(user_ids: Iterable[int], chunk_size: int = 500) -> int:
+    """
+    Carga en la caché la configuración de varios usuarios con consultas
+    ``IN (...)`` por bloques (arranque en caliente).
+
+    Returns:
+        Número de usuarios con configuración encontrados
+    """
+    ids: List[int] = list(dict.fromkeys(user_ids))
+    found = 0
+    conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = sqlite3.Row
+    try:
+        for start in range(0, len(ids), chunk_size):
+            chunk = ids[start : start + chunk_size]
+            rows = conn.execute(
+                "SELECT user_id, api_key, base_url, model_name, system_prompt FROM user_config "
+                f"WHERE bot_id = ? AND user_id IN ({', '.join('?' for _ in chunk)})",
+                [current_bot.get(), *chunk],
+            ).fetchall()
+            missing = set(chunk)
+            for row in rows:
+                config = dict(row)
+                user_id = config.pop("user_id")
+                missing.discard(user_id)
+                _cache_put(user_id, config)
+            # Como en get_user_config, la ausencia de configuración también se cachea
+            for user_id in missing:
+                _cache_put(user_id, {})
+            found += len(rows)
     finally:
         conn.close()
+    return found
 
 
 def close_db():
@@ -1,8 +1,33 @@
+from typing import TYPE_CHECKING
+
 from telegram import Update
-from telegram.ext import ContextTypes
 
+if TYPE_CHECKING:
+    # Solo para anotaciones: telegram.ext no se importa al cargar el bot
+    from telegram.ext import ContextTypes
+
+# Use relative imports when running as module, absolute when running directly
+try:
+    from bot.database import get_user_config
+except ImportError:
+    # Fallback to relative imports when running as module
+    from ..database import get_user_config
+
+
+def _format_config(config: dict) -> str:
+    """Resumen de la configuración sin mostrar la API key."""
+    if not config:
+        return "⚠️ No hay configuración guardada"
+    return (
+        "⚙️ Config actual:\n"
+        f"• API Key: {'✅' if config.get('api_key') else '❌'}\n"
+        f"• Base URL: {config.get('base_url') or 'No configurada'}\n"
+        f"• Modelo: {config.get('model_name') or 'No configurado'}\n"
+        f"• System Prompt: {config.get('system_prompt') or 'No configurado'}"
+    )
 
-async def handle_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+async def handle_button(update: Update, context: "ContextTypes.DEFAULT_TYPE"):
     query = update.callback_query
     await query.answer()
     data = query.data
@@ -24,9 +49,8 @@ async def handle_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "📝 Usa: `/set_system_prompt TU_PROMPT`", parse_mode="Markdown"
         )
     elif data == "show_config":
-        config = context.user_data.get("config", {})
-        await query.edit_message_text(
-            f"⚙️ Config actual:\n`{config}`", parse_mode="Markdown"
-        )
+        # La configuración vive en SQLite, no en context.user_data
+        config = get_user_config(update.effective_user.id)
+        await query.edit_message_text(_format_config(config))
     else:
         await query.edit_message_text("❌ Opción desconocida.")
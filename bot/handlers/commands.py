@@ -1,14 +1,42 @@
 from telegram import Update
-from telegram.ext import ContextTypes
 from loguru import logger
+import asyncio
+import difflib
+import html
 import re
+import time
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    # Solo para anotaciones: telegram.ext no se importa al cargar el bot
+    from telegram.ext import ContextTypes
 
 # Use relative imports when running as module, absolute when running directly
 try:
-    from bot.database import set_user_config, get_user_config
+    from bot import profiler
+    from bot.config import get_config
+    from bot.database import set_user_config, set_user_config_many, get_user_config
+    from core.capabilities import registry
+    from bot.usage import UsageCounters, accountant, today
+    from bot.jobs import enqueue_job, llm_jobs
+    from bot.outbox import outbox, PROGRESS
+    from bot.tenancy import scoped_id
+    from core.chunking import is_supported, pdf_available
+    from core.context import conversations
+    from core.retrieval import knowledge
 except ImportError:
     # Fallback to relative imports when running as module
-    from ..database import set_user_config, get_user_config
+    from .. import profiler
+    from ..config import get_config
+    from ..database import set_user_config, set_user_config_many, get_user_config
+    from ...core.capabilities import registry
+    from ..usage import UsageCounters, accountant, today
+    from ..jobs import enqueue_job, llm_jobs
+    from ..outbox import outbox, PROGRESS
+    from ..tenancy import scoped_id
+    from ...core.chunking import is_supported, pdf_available
+    from ...core.context import conversations
+    from ...core.retrieval import knowledge
 
 # El logger se importa desde config.py y ya está configurado con loguru
 
@@ -20,7 +48,7 @@ def escape_markdown(text: str) -> str:
 
 
 async def handle_error(
-    update: Update, context: ContextTypes.DEFAULT_TYPE, error_msg: str
+    update: Update, context: "ContextTypes.DEFAULT_TYPE", error_msg: str
 ):
     """Maneja errores enviando un mensaje al usuario."""
     logger.error(error_msg)
@@ -30,7 +58,7 @@ async def handle_error(
             parse_mode="MarkdownV2",
         )
 
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def start(update: Update, context: "ContextTypes.DEFAULT_TYPE"):
     try:
         text = (
             "👋 Bienvenido al Bot de LLM\n\n"
@@ -41,7 +69,11 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "• /set_base_url &lt;url&gt; - Configura la URL base de la API\n"
             "• /set_model &lt;modelo&gt; - Configura el modelo de IA\n"
             "• /set_system_prompt &lt;texto&gt; - Configura el prompt del sistema\n"
-            "• /config_status - Muestra la configuración actual\n\n"
+            "• /config_status - Muestra la configuración actual\n"
+            "• /setup - Configura todo en un solo mensaje (clave=valor por línea)\n"
+            "• /reset - Olvida el historial de la conversación\n"
+            "• /usage - Muestra tu consumo de solicitudes y tokens\n"
+            "• /compare &lt;modelos&gt; -- &lt;pregunta&gt; - Compara varios modelos\n\n"
             "Ejemplos:\n"
             "<pre>/set_api_key sk-tu_key</pre>\n"
             "<pre>/set_model gpt-4-turbo</pre>\n"
@@ -53,7 +85,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await handle_error(update, context, f"Error en start: {str(e)}")
 
 
-async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def help_command(update: Update, context: "ContextTypes.DEFAULT_TYPE"):
     try:
         help_text = escape_markdown(
             "🔧 **Ayuda del Bot de LLM**\n\n"
@@ -81,7 +113,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await handle_error(update, context, f"Error en help: {str(e)}")
 
 
-async def set_api_key(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def set_api_key(update: Update, context: "ContextTypes.DEFAULT_TYPE"):
     try:
         if not context.args:
             await update.message.reply_text(
@@ -110,7 +142,7 @@ async def set_api_key(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await handle_error(update, context, f"Error en set_api_key: {str(e)}")
 
 
-async def set_base_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def set_base_url(update: Update, context: "ContextTypes.DEFAULT_TYPE"):
     try:
         if not context.args:
             await update.message.reply_text(
@@ -138,7 +170,33 @@ async def set_base_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await handle_error(update, context, f"Error en set_base_url: {str(e)}")
 
 
-async def set_model(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def _check_model(
+    base_url: Optional[str], api_key: Optional[str], model_name: str
+) -> Tuple[Optional[str], str]:
+    """
+    Valida el modelo contra ``/models`` del endpoint sin bloquear el event loop.
+
+    Returns:
+        (error, aviso): ``error`` es None si el modelo se puede guardar
+    """
+    if not base_url:
+        return None, ""
+    available = await asyncio.to_thread(registry.refresh, base_url, api_key)
+    listed = registry.is_listed(base_url, model_name)
+    if available and listed is False:
+        suggestions = difflib.get_close_matches(model_name.lower(), registry.models(base_url), n=3)
+        hint = f" ¿Quisiste decir: {', '.join(suggestions)}?" if suggestions else ""
+        return f"❌ El modelo {model_name} no está disponible en {base_url}.{hint}", ""
+    notice = "" if available else "\n⚠️ No pude verificar el modelo con tu proveedor."
+    caps = registry.get(base_url, model_name)
+    notice += (
+        f"\n🖼️ Imágenes: {'sí' if caps.supports_vision else 'no'}"
+        f"\n📚 Contexto: {caps.context_tokens or 'desconocido'} tokens"
+    )
+    return None, notice
+
+
+async def set_model(update: Update, context: "ContextTypes.DEFAULT_TYPE"):
     try:
         if not context.args:
             await update.message.reply_text(
@@ -150,9 +208,15 @@ async def set_model(update: Update, context: ContextTypes.DEFAULT_TYPE):
         model_name = context.args[0].strip()
         user_id = update.effective_user.id
 
+        config = get_user_config(user_id)
+        error, notice = await _check_model(config.get("base_url"), config.get("api_key"), model_name)
+        if error:
+            await update.message.reply_text(escape_markdown(error), parse_mode="MarkdownV2")
+            return
+
         if set_user_config(user_id, "model_name", model_name):
             await update.message.reply_text(
-                escape_markdown(f"✅ Modelo {model_name} guardado correctamente"),
+                escape_markdown(f"✅ Modelo {model_name} guardado correctamente{notice}"),
                 parse_mode="MarkdownV2",
             )
             logger.info(f"Modelo actualizado para usuario {user_id}: {model_name}")
@@ -166,7 +230,7 @@ async def set_model(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await handle_error(update, context, f"Error en set_model: {str(e)}")
 
 
-async def set_system_prompt(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def set_system_prompt(update: Update, context: "ContextTypes.DEFAULT_TYPE"):
     try:
         if not context.args:
             await update.message.reply_text(
@@ -194,7 +258,7 @@ async def set_system_prompt(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await handle_error(update, context, f"Error en set_system_prompt: {str(e)}")
 
 
-async def config_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def config_status(update: Update, context: "ContextTypes.DEFAULT_TYPE"):
     try:
         user_id = update.effective_user.id
         config = get_user_config(user_id)
@@ -221,7 +285,7 @@ async def config_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await handle_error(update, context, f"Error en config_status: {str(e)}")
 
 
-async def test_config(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def test_config(update: Update, context: "ContextTypes.DEFAULT_TYPE"):
     """Comando para probar la configuración paso a paso."""
     try:
         user_id = update.effective_user.id
@@ -263,3 +327,326 @@ async def test_config(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         await update.message.reply_text(f"❌ Error en test_config: {str(e)}")
         logger.error(f"Error en test_config: {str(e)}", exc_info=True)
+
+
+async def reset_context(update: Update, context: "ContextTypes.DEFAULT_TYPE"):
+    """Borra el historial y el resumen de la conversación del chat."""
+    try:
+        await asyncio.to_thread(conversations.clear, scoped_id(update.effective_chat.id))
+        await update.message.reply_text("🧹 Historial borrado. Empezamos de cero.")
+    except Exception as e:
+        await handle_error(update, context, f"Error en reset: {str(e)}")
+
+
+REMEMBER_USAGE = (
+    "📚 Para guardar un documento en tu memoria:\n"
+    "• Responde a un documento (texto, Markdown, PDF o código) con /remember\n"
+    "• O envía /remember seguido del texto a recordar\n\n"
+    "Después, tus preguntas usarán los fragmentos relevantes. /forget lo borra todo."
+)
+
+
+async def remember_command(update: Update, context: "ContextTypes.DEFAULT_TYPE"):
+    """
+    Encola la indexación de un documento (respondiendo a él) o de un texto.
+    El trabajo lo procesa ``process_job`` como cualquier otra solicitud.
+    """
+    try:
+        if not knowledge.enabled:
+            await update.message.reply_text("⚠️ La memoria de documentos no está activada.")
+            return
+        config = get_user_config(update.effective_user.id)
+        if not config.get("api_key") or not config.get("base_url"):
+            await update.message.reply_text(
+                "⚠️ Configura primero tu API key y Base URL (/setup): se usan para los embeddings."
+            )
+            return
+
+        replied = update.message.reply_to_message
+        document = replied.document if replied else None
+        text = " ".join(context.args or []) or (replied.text if replied and not document else "")
+        if document and not is_supported(document.file_name, document.mime_type):
+            formats = "texto, Markdown, PDF" if pdf_available() else "texto, Markdown"
+            await update.message.reply_text(f"⚠️ Formato no soportado. Envía {formats} o código fuente.")
+            return
+        if not document and not text:
+            await update.message.reply_text(REMEMBER_USAGE)
+            return
+
+        processing_msg = await outbox.reply_text(
+            update.message, "⏳ Guardando en tu memoria...", priority=PROGRESS
+        )
+        await asyncio.to_thread(
+            enqueue_job,
+            update.update_id,
+            processing_msg.chat_id,
+            update.effective_user.id,
+            {
+                "remember": True,
+                "text": text,
+                "document": {
+                    "file_id": document.file_id,
+                    "file_name": document.file_name,
+                    "mime_type": document.mime_type,
+                }
+                if document
+                else None,
+                "processing_message_id": processing_msg.message_id,
+            },
+        )
+        llm_jobs.notify()
+    except Exception as e:
+        await handle_error(update, context, f"Error en remember: {str(e)}")
+
+
+async def forget_command(update: Update, context: "ContextTypes.DEFAULT_TYPE"):
+    """Borra los documentos recordados por el usuario."""
+    try:
+        removed = await asyncio.to_thread(knowledge.clear, scoped_id(update.effective_user.id))
+        await update.message.reply_text(f"🧹 Memoria borrada ({removed} fragmentos).")
+    except Exception as e:
+        await handle_error(update, context, f"Error en forget: {str(e)}")
+
+
+def _format_usage(label: str, counters) -> str:
+    average = counters.latency_ms_total / counters.requests if counters.requests else 0
+    return (
+        f"{label}\n"
+        f"• Solicitudes: {counters.requests} ({counters.errors} con error)\n"
+        f"• Tokens: {counters.prompt_tokens} entrada / {counters.completion_tokens} salida\n"
+        f"• Latencia: {average / 1000:.1f} s media, {counters.latency_ms_max / 1000:.1f} s máxima"
+    )
+
+
+async def usage_command(update: Update, context: "ContextTypes.DEFAULT_TYPE"):
+    """Muestra el consumo del usuario de hoy y de los últimos 7 días."""
+    try:
+        days = await accountant.daily(update.effective_user.id, days=7)
+        if not days:
+            await update.message.reply_text("📊 Aún no hay solicitudes registradas.")
+            return
+
+        week = UsageCounters()
+        for _, counters in days:
+            week.merge(counters)
+        last_day, last = days[-1]
+        today_counters = last if last_day == today() else UsageCounters()
+        await update.message.reply_text(
+            _format_usage("📊 Hoy (UTC)", today_counters)
+            + "\n\n"
+            + _format_usage("📈 Últimos 7 días", week)
+        )
+    except Exception as e:
+        await handle_error(update, context, f"Error en usage: {str(e)}")
+
+
+# Nombres aceptados en /setup para cada columna de user_config
+SETUP_KEYS = {
+    "api_key": "api_key",
+    "key": "api_key",
+    "base_url": "base_url",
+    "url": "base_url",
+    "model": "model_name",
+    "model_name": "model_name",
+    "system_prompt": "system_prompt",
+    "prompt": "system_prompt",
+}
+
+SETUP_USAGE = (
+    "Uso (una clave por línea):\n"
+    "<pre>/setup\n"
+    "api_key=sk-tu_key\n"
+    "base_url=https://api.openai.com/v1\n"
+    "model=gpt-4o\n"
+    "system_prompt=Eres un asistente conciso</pre>"
+)
+
+
+def parse_setup(text: str) -> Tuple[Dict[str, str], List[str]]:
+    """
+    Interpreta el cuerpo de ``/setup``: líneas ``clave=valor`` o ``clave: valor``.
+
+    Returns:
+        (valores por columna, líneas no reconocidas)
+    """
+    values: Dict[str, str] = {}
+    errors: List[str] = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        match = re.match(r"([A-Za-z_]+)\s*[=:]\s*(.*)$", line)
+        column = SETUP_KEYS.get(match.group(1).lower()) if match else None
+        if column is None or not match.group(2).strip():
+            errors.append(line)
+            continue
+        values[column] = match.group(2).strip()
+    return values, errors
+
+
+async def setup_command(update: Update, context: "ContextTypes.DEFAULT_TYPE"):
+    """Guarda todos los campos de configuración de un mensaje en una sola transacción."""
+    try:
+        # Todo lo que sigue al comando, en la misma línea o en las siguientes
+        parts = (update.message.text or "").split(None, 1)
+        values, errors = parse_setup(parts[1] if len(parts) > 1 else "")
+        if errors or not values:
+            invalid = "\n".join(f"• {html.escape(line[:40])}" for line in errors)
+            prefix = f"❌ Líneas no reconocidas:\n{invalid}\n\n" if errors else ""
+            await update.message.reply_text(prefix + SETUP_USAGE, parse_mode="HTML")
+            return
+
+        user_id = update.effective_user.id
+        notice = ""
+        if "model_name" in values:
+            config = {**get_user_config(user_id), **values}
+            error, notice = await _check_model(
+                config.get("base_url"), config.get("api_key"), values["model_name"]
+            )
+            if error:
+                await update.message.reply_text(error)
+                return
+
+        if await asyncio.to_thread(set_user_config_many, user_id, values):
+            labels = ", ".join(values)
+            await update.message.reply_text(f"✅ Configuración guardada: {labels}{notice}")
+            logger.info(f"Configuración inicial guardada para usuario {user_id}: {labels}")
+        else:
+            await update.message.reply_text("❌ Error al guardar la configuración")
+
+    except Exception as e:
+        await handle_error(update, context, f"Error en setup: {str(e)}")
+
+
+# Modelos por /compare: cada uno es una llamada completa al proveedor
+COMPARE_MAX_MODELS = 4
+
+COMPARE_USAGE = (
+    "⚖️ Compara varios modelos con la misma pregunta:\n"
+    "<pre>/compare gpt-4o gpt-4o-mini -- ¿Qué es un monad?</pre>\n"
+    "Separa los modelos de la pregunta con -- o |. Sin separador solo se "
+    "reconocen los modelos que lista tu endpoint.\n"
+    f"Hasta {COMPARE_MAX_MODELS} modelos del endpoint configurado; no se "
+    "comparan endpoints distintos."
+)
+
+
+def parse_compare(text: str, known_models: Iterable[str] = ()) -> Tuple[List[str], str]:
+    """
+    Separa los modelos de la pregunta en el cuerpo de ``/compare``.
+
+    Con ``--`` o ``|`` la separación es explícita. Si no, los primeros
+    términos que el endpoint lista como modelos son modelos y el resto es la
+    pregunta; una palabra como "3.5" al inicio de la pregunta no se toma por
+    un modelo.
+
+    Returns:
+        (modelos sin duplicados, pregunta)
+    """
+    match = re.match(r"\s*([^\n]*?)\s+(?:--|\|)\s+(.*)$", text, re.DOTALL)
+    if match:
+        names, prompt = match.group(1).split(), match.group(2).strip()
+    else:
+        known = {name.lower() for name in known_models}
+        names = []
+        rest = text.strip()
+        while rest:
+            token, _, remainder = rest.partition(" ")
+            token = token.strip()
+            if "\n" in token or token.lower() not in known:
+                break
+            names.append(token)
+            rest = remainder.strip()
+        prompt = rest
+    return list(dict.fromkeys(names)), prompt
+
+
+async def compare_command(update: Update, context: "ContextTypes.DEFAULT_TYPE"):
+    """
+    Encola una comparación: ``process_job`` ejecuta la pregunta con cada
+    modelo a la vez y publica cada respuesta en su propio mensaje.
+    """
+    try:
+        config = get_user_config(update.effective_user.id)
+        if not config.get("api_key") or not config.get("base_url"):
+            await update.message.reply_text("⚠️ Configura primero tu API key y Base URL (/setup).")
+            return
+
+        parts = (update.message.text or "").split(None, 1)
+        known = registry.models(config["base_url"])
+        models, prompt = parse_compare(parts[1] if len(parts) > 1 else "", known)
+        if len(models) < 2 or not prompt:
+            await update.message.reply_text(COMPARE_USAGE, parse_mode="HTML")
+            return
+        if len(models) > COMPARE_MAX_MODELS:
+            await update.message.reply_text(
+                f"⚠️ Como máximo {COMPARE_MAX_MODELS} modelos por comparación."
+            )
+            return
+
+        processing_msg = await outbox.reply_text(
+            update.message, f"⚖️ Comparando {', '.join(models)}...", priority=PROGRESS
+        )
+        await asyncio.to_thread(
+            enqueue_job,
+            update.update_id,
+            processing_msg.chat_id,
+            update.effective_user.id,
+            {
+                "compare": models,
+                "text": prompt,
+                "processing_message_id": processing_msg.message_id,
+            },
+        )
+        llm_jobs.notify()
+    except Exception as e:
+        await handle_error(update, context, f"Error en compare: {str(e)}")
+
+
+def parse_profile_seconds(args: Optional[List[str]]) -> float:
+    """Segundos de ``/profile [N]``, acotados a ``[1, MAX_SECONDS]``."""
+    try:
+        seconds = float(args[0]) if args else profiler.DEFAULT_SECONDS
+    except ValueError:
+        seconds = profiler.DEFAULT_SECONDS
+    return min(max(seconds, 1.0), profiler.MAX_SECONDS)
+
+
+async def profile_command(update: Update, context: "ContextTypes.DEFAULT_TYPE"):
+    """
+    Perfila el bot en marcha durante N segundos (solo ``ADMIN_IDS``) y envía
+    las pilas colapsadas para un flamegraph y las tareas de asyncio. Se
+    registra con ``block=False`` para no frenar los demás updates mientras
+    muestrea.
+    """
+    try:
+        if update.effective_user.id not in get_config().admin_ids:
+            await update.message.reply_text("⛔ Comando reservado a administradores.")
+            return
+
+        seconds = parse_profile_seconds(context.args)
+        try:
+            # El aviso sale solo si este /profile reservó el perfilador
+            report = await profiler.profile_running_bot(
+                seconds,
+                on_start=lambda: update.message.reply_text(f"🔥 Perfilando durante {seconds:g} s..."),
+            )
+        except RuntimeError:
+            # Uno a la vez por proceso; la comprobación la hace profile_running_bot
+            await update.message.reply_text("⏳ Ya hay un perfil en curso.")
+            return
+
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        # El caption de un documento admite hasta 1024 caracteres
+        await update.message.reply_document(
+            document=report.profile.collapsed().encode("utf-8"),
+            filename=f"profile-{stamp}.folded",
+            caption=report.summary()[:1024],
+        )
+        await update.message.reply_document(
+            document=report.tasks.encode("utf-8"),
+            filename=f"tasks-{stamp}.txt",
+        )
+        logger.info("Perfil de {} s enviado a {}", seconds, update.effective_user.id)
+    except Exception as e:
+        await handle_error(update, context, f"Error en profile: {str(e)}")
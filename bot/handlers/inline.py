@@ -0,0 +1,247 @@
+"""
+Modo inline (``@bot pregunta``).
+
+Telegram envía una consulta inline por cada pulsación, así que:
+
+- Debounce por usuario (``KeyedDebouncer``): solo se responde la última
+  consulta tras ``quiet_seconds`` sin escribir (o al cumplirse ``max_seconds``).
+- Una consulta nueva cancela la respuesta pendiente de la anterior; Telegram
+  ya no mostraría sus resultados. La llamada al modelo que ya estuviera en
+  curso no se puede interrumpir, pero su respuesta se guarda en la caché.
+- Caché por usuario y texto normalizado de la consulta, por coincidencia
+  exacta: repetir una pregunta ya respondida se responde al instante, sin
+  debounce. Las consultas intermedias de una ráfaga no llegan a la caché, y
+  no se responde con la de un prefijo: Telegram solo admite una respuesta
+  por consulta y la definitiva ya no se podría mostrar. ``cache_time`` deja
+  además que Telegram sirva la misma consulta desde sus servidores.
+- Consultas iguales en curso comparten una sola llamada al modelo.
+"""
+
+import asyncio
+import hashlib
+import html
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, Hashable, List, Optional, Tuple, Union
+
+from telegram import (
+    InlineQueryResultArticle,
+    InlineQueryResultsButton,
+    InputTextMessageContent,
+    Update,
+)
+from loguru import logger
+
+if TYPE_CHECKING:
+    # Solo para anotaciones: telegram.ext no se importa al cargar el bot
+    from telegram.ext import ContextTypes
+
+# Use relative imports when running as module, absolute when running directly
+try:
+    from bot.batching import KeyedDebouncer
+    from bot.config import get_config
+    from bot.database import get_user_config
+    from bot.rendering import html_to_plain, split_html
+    from bot.tenancy import scoped_id
+    from bot.usage import accountant
+    from core.pipeline import run_cached_pipeline
+    from core.semantic_cache import normalize_query, scope_for
+except ImportError:
+    # Fallback to relative imports when running as module
+    from ..batching import KeyedDebouncer
+    from ..config import get_config
+    from ..database import get_user_config
+    from ..rendering import html_to_plain, split_html
+    from ..tenancy import scoped_id
+    from ..usage import accountant
+    from ...core.pipeline import run_cached_pipeline
+    from ...core.semantic_cache import normalize_query, scope_for
+
+# El logger se importa desde config.py y ya está configurado con loguru
+
+# Usuario con espacio de bot (``scoped_id``), ámbito del modelo y consulta
+CacheKey = Tuple[Union[int, str], Tuple[str, str, str], str]
+
+SLOW_ANSWER = "⏳ La respuesta está tardando. Vuelve a escribir la pregunta en unos segundos."
+
+
+class InlineAnswers:
+    """
+    Args:
+        quiet_seconds: Silencio tras la última pulsación antes de llamar al modelo
+        max_seconds: Espera máxima desde la primera pulsación de una ráfaga
+        timeout: Segundos desde la consulta hasta responder; Telegram la
+            descarta a los ~10 s
+        cache_time: ``cache_time`` de las respuestas (segundos)
+        cache_size: Respuestas guardadas como máximo
+        min_chars: Longitud mínima de la consulta normalizada
+    """
+
+    def __init__(
+        self,
+        quiet_seconds: float = 0.8,
+        max_seconds: float = 3.0,
+        timeout: float = 8.0,
+        cache_time: int = 300,
+        cache_size: int = 1000,
+        min_chars: int = 3,
+    ) -> None:
+        self.timeout = timeout
+        self.cache_time = cache_time
+        self.cache_size = cache_size
+        self.min_chars = min_chars
+        self._debouncer = KeyedDebouncer(quiet_seconds, max_seconds, self._flush)
+        self._cache: "OrderedDict[CacheKey, Tuple[str, float]]" = OrderedDict()
+        self._computing: Dict[CacheKey, asyncio.Future] = {}
+        self._answering: Dict[Hashable, asyncio.Task] = {}
+
+    # ---------------------------------------------------------------- caché
+
+    def _cached(self, key: CacheKey) -> Optional[str]:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        answer, stored_at = entry
+        if time.monotonic() - stored_at > self.cache_time:
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return answer
+
+    def _store(self, key: CacheKey, answer: str) -> None:
+        self._cache[key] = (answer, time.monotonic())
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    # ------------------------------------------------------------ consultas
+
+    def _cancel(self, user_id: Hashable) -> None:
+        task = self._answering.pop(user_id, None)
+        if task and not task.done():
+            task.cancel()
+
+    async def handle(self, inline_query) -> None:
+        """Responde al instante desde la caché o programa la respuesta."""
+        user_id = scoped_id(inline_query.from_user.id)
+        # La consulta anterior del usuario ya no se mostrará
+        self._cancel(user_id)
+
+        config = get_user_config(inline_query.from_user.id)
+        if not config.get("api_key") or not config.get("base_url"):
+            await inline_query.answer(
+                [],
+                cache_time=0,
+                is_personal=True,
+                button=InlineQueryResultsButton(text="⚙️ Configura el bot", start_parameter="setup"),
+            )
+            return
+
+        text = normalize_query(inline_query.query)
+        if len(text) < self.min_chars:
+            return
+        key = (user_id, scope_for(config), text)
+        answer = self._cached(key)
+        if answer is not None:
+            await self._answer(inline_query, answer, cache_time=self.cache_time)
+            return
+        self._debouncer.add(user_id, (inline_query, config, key, time.monotonic()))
+
+    async def _flush(self, user_id: Hashable, items: List) -> None:
+        inline_query, config, key, received = items[-1]
+        self._cancel(user_id)
+        deadline = received + self.timeout
+        task = asyncio.create_task(self._respond(inline_query, config, key, deadline))
+        self._answering[user_id] = task
+
+        def _forget(done: asyncio.Task) -> None:
+            if self._answering.get(user_id) is done:
+                del self._answering[user_id]
+
+        task.add_done_callback(_forget)
+
+    def _compute(self, inline_query, config: Dict, key: CacheKey) -> asyncio.Future:
+        """Llamada al modelo, compartida por las consultas con la misma clave."""
+        future = self._computing.get(key)
+        if future is not None:
+            return future
+        user_id = key[0]
+        usage: Dict = {}
+        started = time.monotonic()
+        future = asyncio.ensure_future(
+            asyncio.to_thread(
+                run_cached_pipeline,
+                config,
+                inline_query.query,
+                on_usage=usage.update,
+                retrieval_user_id=user_id,
+            )
+        )
+        self._computing[key] = future
+
+        def _done(done: asyncio.Future) -> None:
+            self._computing.pop(key, None)
+            failed = done.cancelled() or done.exception() is not None
+            if not failed:
+                # Aunque la consulta ya no se muestre, la respuesta queda en caché
+                self._store(key, done.result())
+            accountant.record(inline_query.from_user.id, usage, time.monotonic() - started, error=failed)
+
+        future.add_done_callback(_done)
+        return future
+
+    async def _respond(self, inline_query, config: Dict, key: CacheKey, deadline: float) -> None:
+        answer = self._cached(key)
+        if answer is None:
+            try:
+                answer = await asyncio.wait_for(
+                    asyncio.shield(self._compute(inline_query, config, key)),
+                    max(deadline - time.monotonic(), 0.0),
+                )
+            except asyncio.TimeoutError:
+                # La llamada sigue y se guarda: repetir la consulta la mostrará
+                await self._answer(inline_query, SLOW_ANSWER, cache_time=0)
+                return
+            except Exception as e:
+                logger.warning("Error en consulta inline de {}: {}", inline_query.from_user.id, str(e))
+                await self._answer(inline_query, "⚠️ No pude obtener una respuesta.", cache_time=0)
+                return
+        await self._answer(inline_query, answer, cache_time=self.cache_time)
+
+    async def _answer(self, inline_query, answer: str, cache_time: int) -> None:
+        question = html.escape(inline_query.query.strip())
+        content = split_html(answer, prefix=f"❓ <b>{question}</b>\n")[0]
+        result = InlineQueryResultArticle(
+            id=hashlib.sha1(answer.encode("utf-8")).hexdigest(),
+            title=inline_query.query.strip()[:64],
+            description=html_to_plain(content).split("\n", 2)[-1][:120],
+            input_message_content=InputTextMessageContent(content, parse_mode="HTML"),
+        )
+        try:
+            await inline_query.answer([result], cache_time=cache_time, is_personal=True)
+        except Exception as e:
+            # Consulta caducada o ya respondida: no hay nada que reintentar
+            logger.debug("No se pudo responder la consulta inline: {}", str(e))
+
+
+_answers: Optional[InlineAnswers] = None
+
+
+def inline_answers() -> InlineAnswers:
+    """Instancia compartida, creada con la configuración cargada."""
+    global _answers
+    if _answers is None:
+        settings = get_config()
+        _answers = InlineAnswers(
+            quiet_seconds=settings.inline_debounce_seconds,
+            max_seconds=settings.inline_max_wait_seconds,
+            cache_time=settings.inline_cache_time,
+        )
+    return _answers
+
+
+async def handle_inline_query(update: Update, context: "ContextTypes.DEFAULT_TYPE"):
+    try:
+        await inline_answers().handle(update.inline_query)
+    except Exception as e:
+        logger.error("Error en consulta inline: {}", str(e), exc_info=True)
@@ -1,19 +1,46 @@
-from telegram import Update, PhotoSize
-from telegram.ext import ContextTypes
+from telegram import Update
 
 # Use relative imports when running as module, absolute when running directly
 try:
+    from bot.batching import KeyedDebouncer
+    from bot.config import get_config
     from bot.database import get_user_config
-    from core.pipeline import run_pipeline
+    from bot.jobs import Job, enqueue_job, job_exists, llm_jobs
+    from bot.outbox import outbox, FINAL, PROGRESS, OutboxStopped
+    from bot.rendering import send_rendered
+    from bot.tenancy import current_bot, scoped_id, use_bot
+    from bot.usage import accountant
+    from bot.warmstart import warm_users
+    from core.context import conversations
+    from core.chunking import chunk_segments, is_supported, pdf_available, iter_document_chunks
+    from core.retrieval import knowledge
+    from core.tools import default_tools
+    from core.pipeline import run_cached_pipeline, run_pipeline, compact_conversation, summarize_document
 except ImportError:
     # Fallback to relative imports when running as module
+    from ..batching import KeyedDebouncer
+    from ..config import get_config
     from ..database import get_user_config
-    from ...core.pipeline import run_pipeline
+    from ..jobs import Job, enqueue_job, job_exists, llm_jobs
+    from ..outbox import outbox, FINAL, PROGRESS, OutboxStopped
+    from ..rendering import send_rendered
+    from ..tenancy import current_bot, scoped_id, use_bot
+    from ..usage import accountant
+    from ..warmstart import warm_users
+    from ...core.context import conversations
+    from ...core.chunking import chunk_segments, is_supported, pdf_available, iter_document_chunks
+    from ...core.retrieval import knowledge
+    from ...core.tools import default_tools
+    from ...core.pipeline import run_cached_pipeline, run_pipeline, compact_conversation, summarize_document
 
 from loguru import logger
+import asyncio
+import html
 import os
 import tempfile
-from typing import Optional
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Set, Tuple, Union
 from bot.security import (
     CompositeGuard,
     RateLimitGuard,
@@ -22,6 +49,10 @@ from bot.security import (
 )
 from bot.security import CompositeSanitizer, MarkdownEscapeSanitizer, TrimSanitizer, ControlCharsSanitizer
 
+if TYPE_CHECKING:
+    # Solo para anotaciones: telegram.ext no se importa al cargar el bot
+    from telegram.ext import ContextTypes
+
 # El logger se importa desde config.py y ya está configurado con loguru
 
 
@@ -38,20 +69,19 @@ _sanitizer = CompositeSanitizer(
 )
 
 
-async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def handle_message(update: Update, context: "ContextTypes.DEFAULT_TYPE"):
     """
-    Maneja los mensajes de texto y fotos del usuario, procesándolos con el LLM adecuado.
+    Valida los mensajes de texto, fotos y documentos del usuario y los encola
+    para el LLM.
+
+    La llamada al modelo ocurre en ``process_job`` para que el trabajo
+    sobreviva a reinicios y no bloquee la recepción de updates. Las fotos de
+    un álbum se agrupan por ``media_group_id`` y generan un único trabajo.
 
     Args:
         update: Objeto Update de Telegram
         context: Contexto de la aplicación
-
-    Raises:
-        Exception: Propaga excepciones no manejadas con logging
     """
-    image_path = None
-    processing_msg = None
-
     try:
         # Validar que el mensaje tenga contenido
         if not update.message or not update.effective_user:
@@ -64,7 +94,8 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         # Validar configuración
         if not config or not config.get("api_key") or not config.get("model_name") or not config.get("base_url"):
-            await update.message.reply_text(
+            await outbox.reply_text(
+                update.message,
                 "⚠️ Configuración incompleta. Necesitas:\n"
                 "1. Establecer API key con `/set_api_key sk-1234567890abcdef`\n"
                 "2. Elegir modelo con /set_model\n"
@@ -72,113 +103,509 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
 
-        # Obtener texto de entrada (puede ser None si solo envía imagen)
-        user_input = update.message.text or ""
-        user_input = _sanitizer.sanitize(user_input)
-
-        # Manejar imagen si está presente
-        image_size_bytes = None
-        if update.message.photo:
-            # Validación de tamaño antes de descargar
-            last_photo = update.message.photo[-1]
-            try:
-                image_size_bytes = getattr(last_photo, "file_size", None)
-            except Exception:
-                image_size_bytes = None
-
-            # Pasar por guardias de seguridad
-            violation = _message_guard.check(
-                {
-                    "user_id": user_id,
-                    "text": user_input,
-                    "image_size_bytes": image_size_bytes,
-                    "is_command": False,
-                }
+        # Álbum: cada foto llega como un update distinto; se agrupan. Las
+        # claves llevan el bot: el lote puede cerrarse fuera de este update
+        albums, bursts = _batchers()
+        bot_id = current_bot.get()
+        if update.message.media_group_id and update.message.photo:
+            albums.add((bot_id, update.message.media_group_id), update)
+            return
+
+        # Ráfaga de mensajes de texto: se fusionan en una sola solicitud
+        if bursts and update.message.text:
+            bursts.add((bot_id, update.effective_chat.id, user_id), update)
+            return
+
+        await _accept([update], user_id)
+
+    except Exception as e:
+        logger.error("Error en handle_message: {}", str(e), exc_info=True)
+        if update.message:
+            await outbox.reply_text(
+                update.message,
+                "⚠️ Ocurrió un error al procesar tu solicitud. Intenta nuevamente.",
             )
-            if violation:
-                await update.message.reply_text(violation)
-                return
 
-            image_path = await download_photo(last_photo, context.bot)
-            if not image_path:
-                await update.message.reply_text("⚠️ No pude procesar la imagen adjunta")
-                return
 
-            if not user_input:
-                user_input = (
-                    "Describe la imagen"  # Texto por defecto si solo envía imagen
+async def _accept(updates: List[Update], user_id: int) -> None:
+    """
+    Aplica guardias y encola un trabajo para uno o varios updates del mismo
+    usuario (un mensaje suelto, las fotos de un álbum o una ráfaga de textos).
+
+    Args:
+        updates: Updates en orden de llegada; se responde al último
+        user_id: ID de Telegram del usuario
+    """
+    # Reentrega de Telegram tras un reinicio: ya está en cola o respondido
+    known = await asyncio.to_thread(lambda: [job_exists(u.update_id) for u in updates])
+    updates = [u for u, seen in zip(updates, known) if not seen]
+    if not updates:
+        logger.info("Updates ya registrados; se ignoran")
+        return
+    first = updates[0]
+    message = updates[-1].message
+
+    # Obtener texto de entrada (en fotos el texto llega como caption)
+    texts = [u.message.text or u.message.caption for u in updates]
+    user_input = "\n".join(_sanitizer.sanitize(text) for text in texts if text)
+
+    # Validación de tamaño de imagen antes de descargar
+    photos = [u.message.photo[-1] for u in updates if u.message.photo]
+    photo_file_ids = [photo.file_id for photo in photos]
+    image_size_bytes = max((photo.file_size or 0 for photo in photos), default=None)
+    if photos and not user_input:
+        user_input = "Describe la imagen" if len(photos) == 1 else "Describe las imágenes"
+
+    # Documentos: se validan aquí y se descargan y fragmentan en process_job
+    document = next((u.message.document for u in updates if u.message.document), None)
+    if document:
+        if not is_supported(document.file_name, document.mime_type):
+            formats = "texto, Markdown, PDF" if pdf_available() else "texto, Markdown"
+            await outbox.reply_text(message, f"⚠️ Formato no soportado. Envía {formats} o código fuente.")
+            return
+        max_bytes = get_config().document_max_bytes
+        if document.file_size and document.file_size > max_bytes:
+            await outbox.reply_text(
+                message, f"⚠️ El documento supera el máximo de {max_bytes // (1024 * 1024)} MB."
+            )
+            return
+        if not user_input:
+            user_input = "Resume el documento"
+
+    # Pasar por guardias de seguridad (una vez por trabajo, no por foto)
+    violation = _message_guard.check(
+        {
+            "user_id": user_id,
+            "text": user_input,
+            "image_size_bytes": image_size_bytes,
+            "is_command": False,
+        }
+    )
+    if violation:
+        await outbox.reply_text(message, violation)
+        return
+
+    # Notificar al usuario que se está procesando
+    processing_msg = await outbox.reply_text(
+        message, "⏳ Procesando tu solicitud...", priority=PROGRESS
+    )
+
+    # Persistir el trabajo; los workers de bot/jobs.py lo procesan
+    await asyncio.to_thread(
+        enqueue_job,
+        first.update_id,
+        processing_msg.chat_id,
+        user_id,
+        {
+            "text": user_input,
+            "photo_file_ids": photo_file_ids,
+            "document": {
+                "file_id": document.file_id,
+                "file_name": document.file_name,
+                "mime_type": document.mime_type,
+            }
+            if document
+            else None,
+            "processing_message_id": processing_msg.message_id,
+        },
+        [u.update_id for u in updates[1:]],
+    )
+    llm_jobs.notify()
+
+
+async def _flush_album(key: Tuple[int, str], updates: List[Update]) -> None:
+    updates.sort(key=lambda u: u.message.message_id)
+    with use_bot(key[0]):
+        await _accept(updates, updates[0].effective_user.id)
+
+
+async def _flush_burst(key: Tuple[int, int, int], updates: List[Update]) -> None:
+    with use_bot(key[0]):
+        await _accept(updates, key[2])
+
+
+_albums: Optional[KeyedDebouncer] = None
+_bursts: Optional[KeyedDebouncer] = None
+
+
+def _batchers() -> Tuple[KeyedDebouncer, Optional[KeyedDebouncer]]:
+    """Agrupadores de álbumes y ráfagas, creados con la configuración cargada."""
+    global _albums, _bursts
+    if _albums is None:
+        settings = get_config()
+        _albums = KeyedDebouncer(
+            settings.album_window_seconds, settings.album_max_window_seconds, _flush_album
+        )
+        # Opcional: sin ventana configurada cada mensaje genera su propia solicitud
+        if settings.coalesce_window_seconds > 0:
+            _bursts = KeyedDebouncer(
+                settings.coalesce_window_seconds, settings.coalesce_max_seconds, _flush_burst
+            )
+    return _albums, _bursts
+
+
+async def flush_pending_batches() -> None:
+    """Encola los álbumes y ráfagas que aún están en su ventana (al apagar)."""
+    albums, bursts = _batchers()
+    await albums.flush_all()
+    if bursts:
+        await bursts.flush_all()
+
+
+def _error_message(error: Exception) -> str:
+    """Traduce errores del proveedor a un mensaje para el usuario."""
+    text = str(error)
+    if "404" in text or "No endpoints found" in text:
+        return "⚠️ El modelo configurado no está disponible. Verifica tu configuración con /config_status y ajusta el modelo con /set_model."
+    if "401" in text or "Unauthorized" in text:
+        return "⚠️ Error de autenticación. Verifica tu API key con /set_api_key."
+    if any(hint in text for hint in ("no admite imágenes", "ventana de contexto", "documento", "pypdf")):
+        return f"⚠️ {text}"
+    if "rate limit" in text.lower() or "429" in text:
+        return "⚠️ Límite de velocidad excedido. Inténtalo de nuevo en unos minutos."
+    return "⚠️ Ocurrió un error al procesar tu solicitud. Intenta nuevamente."
+
+
+# Compactaciones en segundo plano: una por chat a la vez (clave con espacio de bot)
+_compacting: Set[Union[int, str]] = set()
+_background: Set[asyncio.Task] = set()
+
+
+async def _compact_in_background(chat_id: Union[int, str], config: Dict) -> None:
+    try:
+        await asyncio.to_thread(compact_conversation, config, chat_id)
+    finally:
+        _compacting.discard(chat_id)
+
+
+def _schedule_compaction(chat_id: Union[int, str], config: Dict) -> None:
+    """Lanza la compactación del historial sin retrasar la respuesta."""
+    if not conversations.enabled or chat_id in _compacting:
+        return
+    _compacting.add(chat_id)
+    task = asyncio.create_task(_compact_in_background(chat_id, config))
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
+async def process_job(job: Job, bot) -> Optional[Dict]:
+    """
+    Procesa un trabajo de la cola: descarga las imágenes si las hay, ejecuta
+    el pipeline en un hilo y publica la respuesta en el mensaje de progreso.
+
+    Args:
+        job: Trabajo reclamado de ``llm_jobs``
+        bot: Instancia del bot para descargar archivos y responder
+
+    Returns:
+        Uso de tokens de la solicitud, que se guarda con el trabajo
+
+    Raises:
+        Exception: Se propaga tras avisar al usuario para marcar el trabajo como fallido
+    """
+    payload = job.payload
+    message_id = payload["processing_message_id"]
+    image_paths: List[Optional[str]] = []
+    usage: Dict = {}
+    started = time.monotonic()
+    failed = True
+
+    try:
+        warm_users.touch(job.user_id)
+        config = get_user_config(job.user_id)
+
+        # /remember: indexa el documento o el texto, sin llamar al modelo de chat
+        if payload.get("remember"):
+            output = await remember_document(job, bot, config, payload.get("document"))
+            await outbox.edit_message_text(bot, job.chat_id, message_id, output, priority=FINAL)
+            failed = False
+            return usage
+
+        # /compare: una respuesta por modelo y la tabla de latencias al final
+        if payload.get("compare"):
+            table = await process_compare(job, bot, config, payload["compare"], usage)
+            await outbox.send_message(bot, job.chat_id, table, priority=FINAL, parse_mode="HTML")
+            failed = not usage.get("calls")
+            return usage
+
+        # Trabajos encolados por versiones anteriores guardan una sola foto
+        file_ids = payload.get("photo_file_ids") or (
+            [payload["photo_file_id"]] if payload.get("photo_file_id") else []
+        )
+        if file_ids:
+            # Descargas concurrentes: un álbum tarda lo que su foto más lenta
+            image_paths = await asyncio.gather(
+                *(download_photo(file_id, bot) for file_id in file_ids)
+            )
+            if not all(image_paths):
+                await outbox.edit_message_text(
+                    bot, job.chat_id, message_id, "⚠️ No pude procesar la imagen adjunta", priority=FINAL
                 )
+                return
 
-        # Pasar por guardias para mensajes solo de texto
-        if not update.message.photo:
-            violation = _message_guard.check(
+        document = payload.get("document")
+        if document:
+            output = await process_document(job, bot, config, document, usage)
+        else:
+            # Resumen y turnos recientes del chat, ya acotados en tokens
+            history = await asyncio.to_thread(conversations.history, scoped_id(job.chat_id))
+            settings = get_config()
+            tool_options = (
                 {
-                    "user_id": user_id,
-                    "text": user_input,
-                    "image_size_bytes": image_size_bytes,
-                    "is_command": False,
+                    "tools": default_tools,
+                    "max_steps": settings.tool_max_steps,
+                    "deadline_seconds": settings.tool_deadline_seconds,
                 }
+                if settings.tools_enabled and not image_paths
+                else {}
+            )
+
+            # El pipeline es bloqueante: se ejecuta fuera del event loop
+            output = await asyncio.to_thread(
+                run_cached_pipeline,
+                config=config,
+                user_input=payload["text"],
+                image_paths=image_paths,
+                on_usage=usage.update,
+                history=history,
+                retrieval_user_id=scoped_id(job.user_id),
+                cache_partition=scoped_id(job.chat_id),
+                **tool_options,
             )
-            if violation:
-                await update.message.reply_text(violation)
-                return
 
-        # Notificar al usuario que se está procesando
-        processing_msg = await update.message.reply_text(
-            "⏳ Procesando tu solicitud..."
+        # Editar el mensaje de progreso con la respuesta
+        await send_rendered(bot, job.chat_id, message_id, output)
+
+        user_turn = payload["text"]
+        if file_ids:
+            user_turn = f"[{len(file_ids)} imagen(es)] {user_turn}"
+        elif document:
+            user_turn = f"[documento: {document.get('file_name') or 'sin nombre'}] {user_turn}"
+        await asyncio.to_thread(
+            conversations.append,
+            scoped_id(job.chat_id),
+            [{"role": "user", "content": user_turn}, {"role": "assistant", "content": output}],
         )
+        _schedule_compaction(scoped_id(job.chat_id), config)
+        failed = False
+        return usage
 
-        # Ejecutar el pipeline
-        output = run_pipeline(
-            config=config, user_input=user_input, image_path=image_path
+    except OutboxStopped:
+        # Apagando: sin aviso al usuario, el trabajo vuelve a la cola
+        raise
+    except Exception as e:
+        logger.error("Error procesando trabajo {}: {}", job.update_id, str(e), exc_info=True)
+        await outbox.edit_message_text(
+            bot, job.chat_id, message_id, _error_message(e), priority=FINAL
         )
+        raise
+    finally:
+        # Contadores en memoria; bot/usage.py los vuelca por lotes
+        accountant.record(job.user_id, usage, time.monotonic() - started, error=failed)
+        for image_path in image_paths:
+            if image_path:
+                await cleanup_temp_file(image_path)
+
+
+_USAGE_TOTALS = ("prompt_tokens", "completion_tokens", "total_tokens", "estimated_prompt_tokens")
+
+
+def _usage_accumulator(usage: Dict) -> Callable[[Dict], None]:
+    """Suma el uso de varias llamadas (una por fragmento) en ``usage``."""
+    lock = threading.Lock()
+
+    def _add(call_usage: Dict) -> None:
+        with lock:
+            usage["calls"] = usage.get("calls", 0) + 1
+            for key, value in call_usage.items():
+                if key in _USAGE_TOTALS:
+                    usage[key] = usage.get(key, 0) + (value or 0)
+                else:
+                    usage.setdefault(key, value)
+
+    return _add
+
+
+async def process_document(job: Job, bot, config: Dict, document: Dict, usage: Dict) -> str:
+    """
+    Descarga el documento, lo fragmenta en streaming y lo resume con
+    map-reduce en paralelo, mostrando el avance en el mensaje de progreso.
 
-        # Limpiar archivo temporal si existe
-        if image_path:
-            await cleanup_temp_file(image_path)
+    Returns:
+        Respuesta final del modelo
+    """
+    settings = get_config()
+    message_id = job.payload["processing_message_id"]
+    path = await download_document(document["file_id"], bot)
+    if not path:
+        raise RuntimeError("No pude descargar el documento")
+
+    loop = asyncio.get_running_loop()
+
+    def _progress(done: int, read: int) -> None:
+        # Se llama desde los hilos del map; las ediciones se fusionan en el outbox
+        text = f"📄 Leyendo el documento: {done}/{read} fragmentos procesados..."
+        asyncio.run_coroutine_threadsafe(
+            outbox.edit_message_text(bot, job.chat_id, message_id, text, priority=PROGRESS), loop
+        )
 
-        # Editar el mensaje original con la respuesta
-        await context.bot.edit_message_text(
-            text=f"🤖 Respuesta:\n\n{output}",
-            chat_id=processing_msg.chat_id,
-            message_id=processing_msg.message_id,
+    try:
+        chunks = iter_document_chunks(
+            path,
+            settings.document_chunk_tokens,
+            file_name=document.get("file_name"),
+            mime_type=document.get("mime_type"),
+            model_name=config.get("model_name", ""),
+        )
+        return await asyncio.to_thread(
+            summarize_document,
+            config,
+            chunks,
+            job.payload["text"],
+            max_concurrency=settings.document_concurrency,
+            max_chunks=settings.document_max_chunks,
+            on_progress=_progress,
+            on_usage=_usage_accumulator(usage),
         )
+    finally:
+        await cleanup_temp_file(path)
+
+
+async def process_compare(job: Job, bot, config: Dict, models: List[str], usage: Dict) -> str:
+    """
+    Ejecuta la pregunta con cada modelo a la vez. Cada respuesta se publica
+    en su propio mensaje en cuanto termina; el error de un modelo solo
+    afecta a su mensaje.
+
+    Returns:
+        Tabla HTML con estado, latencia y tokens por modelo
+    """
+    prompt = job.payload["text"]
+    add_usage = _usage_accumulator(usage)
+
+    # Un mensaje por modelo, en el orden pedido, antes de lanzar las llamadas
+    placeholders = []
+    for model in models:
+        message = await outbox.send_message(bot, job.chat_id, f"⏳ {model}...", priority=FINAL)
+        placeholders.append(message.message_id)
+
+    async def _run(model: str, message_id: int) -> Tuple[str, str, float, Dict]:
+        model_usage: Dict = {}
+        started = time.monotonic()
+        try:
+            output = await asyncio.to_thread(
+                run_pipeline,
+                {**config, "model_name": model},
+                prompt,
+                on_usage=model_usage.update,
+                retrieval_user_id=scoped_id(job.user_id),
+            )
+        except Exception as e:
+            elapsed = time.monotonic() - started
+            logger.warning("Modelo {} falló en /compare: {}", model, str(e))
+            await outbox.edit_message_text(
+                bot, job.chat_id, message_id, f"❌ {model}\n{_error_message(e)}", priority=FINAL
+            )
+            return model, "error", elapsed, model_usage
+        elapsed = time.monotonic() - started
+        add_usage(model_usage)
+        await send_rendered(
+            bot, job.chat_id, message_id, output, prefix=f"🤖 <b>{html.escape(model)}</b>:\n"
+        )
+        return model, "ok", elapsed, model_usage
+
+    results = await asyncio.gather(*(_run(m, mid) for m, mid in zip(models, placeholders)))
+    return format_compare_table(results)
+
+
+def format_compare_table(results: List[Tuple[str, str, float, Dict]]) -> str:
+    """Tabla monoespaciada: modelo, estado, latencia y tokens entrada/salida."""
+    width = max(len("Modelo"), *(len(model) for model, *_ in results))
+    lines = [f"{'Modelo':<{width}}  Estado  Latencia  Tokens"]
+    for model, status, elapsed, model_usage in results:
+        prompt_tokens = model_usage.get("prompt_tokens") or model_usage.get("estimated_prompt_tokens")
+        completion_tokens = model_usage.get("completion_tokens")
+        tokens = f"{prompt_tokens or '?'}/{completion_tokens or '?'}" if status == "ok" else "-"
+        lines.append(f"{model:<{width}}  {status:<6}  {elapsed:>6.1f} s  {tokens}")
+    return "⚖️ Comparación\n<pre>" + html.escape("\n".join(lines)) + "</pre>"
 
-    except Exception as e:
-        # Fix logging error by using simple string formatting
-        logger.error("Error en handle_message: {}", str(e), exc_info=True)
 
-        # Limpieza en caso de error
-        if image_path and os.path.exists(image_path):
-            await cleanup_temp_file(image_path)
-
-        # Provide more specific error messages based on error type
-        if "404" in str(e) or "No endpoints found" in str(e):
-            error_msg = "⚠️ El modelo configurado no está disponible. Verifica tu configuración con /config_status y ajusta el modelo con /set_model."
-        elif "401" in str(e) or "Unauthorized" in str(e):
-            error_msg = "⚠️ Error de autenticación. Verifica tu API key con /set_api_key."
-        elif "rate limit" in str(e).lower() or "429" in str(e):
-            error_msg = "⚠️ Límite de velocidad excedido. Inténtalo de nuevo en unos minutos."
+async def remember_document(job: Job, bot, config: Dict, document: Optional[Dict]) -> str:
+    """
+    Guarda un documento (o el texto del comando) en el índice del usuario.
+
+    Returns:
+        Mensaje de confirmación para el usuario
+    """
+    chunk_tokens = get_config().knowledge_chunk_tokens
+    path = None
+    if document:
+        path = await download_document(document["file_id"], bot)
+        if not path:
+            raise RuntimeError("No pude descargar el documento")
+    try:
+        if path:
+            source = document.get("file_name") or "documento"
+            chunks = iter_document_chunks(
+                path, chunk_tokens, file_name=document.get("file_name"), mime_type=document.get("mime_type")
+            )
         else:
-            error_msg = "⚠️ Ocurrió un error al procesar tu solicitud. Intenta nuevamente."
-        
-        if update.message:
-            await update.message.reply_text(error_msg)
+            source = "nota"
+            chunks = chunk_segments(job.payload["text"].splitlines(keepends=True), chunk_tokens)
+        added = await asyncio.to_thread(knowledge.add_document, scoped_id(job.user_id), config, source, chunks)
+    finally:
+        if path:
+            await cleanup_temp_file(path)
+    if not added:
+        return "⚠️ El documento está vacío o no contiene texto legible."
+    return f"📚 Guardado en tu memoria: {source} ({added} fragmentos)."
+
+
+async def download_document(file_id: str, bot) -> Optional[str]:
+    """
+    Descarga un documento a un directorio temporal del sistema. La descarga
+    se escribe directamente a disco, sin pasar el archivo entero por memoria.
+    Cada descarga tiene su propio archivo: dos trabajos sobre el mismo
+    documento (un reenvío, o ``/remember`` y un resumen) no se borran la
+    entrada el uno al otro.
+
+    Returns:
+        str: Ruta local del archivo descargado o None si falla
+    """
+    try:
+        file = await bot.get_file(file_id)
+        temp_dir = os.path.join(tempfile.gettempdir(), "telegram_bot_documents")
+        os.makedirs(temp_dir, exist_ok=True)
+        _, ext = os.path.splitext(file.file_path or "")
+        fd, file_path = tempfile.mkstemp(
+            suffix=ext.lower(), prefix=f"{file.file_unique_id or file.file_id}_", dir=temp_dir
+        )
+        os.close(fd)
+        try:
+            await file.download_to_drive(custom_path=file_path)
+        except Exception:
+            os.remove(file_path)
+            raise
+        logger.info("Documento descargado en: {}", file_path)
+        return file_path
+    except Exception as e:
+        logger.error("Error al descargar documento: {}", str(e), exc_info=True)
+        return None
 
 
-async def download_photo(photo: PhotoSize, bot) -> Optional[str]:
+async def download_photo(file_id: str, bot) -> Optional[str]:
     """
     Descarga la foto enviada por el usuario a un directorio temporal del sistema.
 
     Args:
-        photo: Objeto PhotoSize de Telegram
+        file_id: ``file_id`` de la foto (PhotoSize) en Telegram
         bot: Instancia del bot para descargar el archivo
 
     Returns:
         str: Ruta local del archivo descargado o None si falla
     """
     try:
-        file = await bot.get_file(photo.file_id)
+        file = await bot.get_file(file_id)
 
         # Crear directorio temporal seguro
         temp_dir = os.path.join(tempfile.gettempdir(), "telegram_bot_images")
@@ -0,0 +1,446 @@
+"""
+Cola persistente de solicitudes al LLM sobre SQLite.
+
+Cada mensaje aceptado por ``handle_message`` se guarda como un trabajo
+identificado por el ``update_id`` de Telegram, lo que deduplica las
+reentregas tras un reinicio. Los workers reclaman trabajos con un lease que
+renuevan mientras procesan; si el proceso muere, el lease expira y otro
+worker (o el siguiente arranque) retoma el trabajo. Al apagar se deja de
+reclamar, se espera a los trabajos en curso hasta un timeout y los que no
+terminan se devuelven a la cola.
+"""
+
+import asyncio
+import json
+import sqlite3
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+from loguru import logger
+
+# Use relative imports when running as module, absolute when running directly
+try:
+    from bot import database
+    from bot.outbox import OutboxStopped
+    from bot.tenancy import PRIMARY_BOT, current_bot, use_bot
+except ImportError:
+    # Fallback to relative imports when running as module
+    from . import database
+    from .outbox import OutboxStopped
+    from .tenancy import PRIMARY_BOT, current_bot, use_bot
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+@dataclass
+class Job:
+    update_id: int
+    chat_id: int
+    user_id: int
+    payload: Dict[str, Any]
+    attempts: int
+    # Espacio de nombres del bot que recibió el update (ver bot/tenancy.py)
+    bot_id: int = PRIMARY_BOT
+
+
+def _connect() -> sqlite3.Connection:
+    # isolation_level=None: las transacciones se controlan con BEGIN explícito
+    conn = sqlite3.connect(database.DB_PATH, timeout=30, isolation_level=None)
+    return conn
+
+
+JOBS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS {table} (
+    bot_id INTEGER NOT NULL DEFAULT 0,
+    update_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_until REAL NOT NULL DEFAULT 0,
+    error TEXT,
+    usage TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at REAL,
+    PRIMARY KEY (bot_id, update_id)
+)
+"""
+
+# Updates absorbidos por un trabajo agrupado (álbum o ráfaga de mensajes)
+JOB_UPDATES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS {table} (
+    bot_id INTEGER NOT NULL DEFAULT 0,
+    update_id INTEGER NOT NULL,
+    job_update_id INTEGER NOT NULL,
+    PRIMARY KEY (bot_id, update_id)
+)
+"""
+
+
+def _rebuild_with_bot_id(conn: sqlite3.Connection, table: str, schema: str) -> None:
+    """
+    Los ``update_id`` solo son únicos dentro de un bot: las tablas anteriores
+    a los espacios por bot se reconstruyen con clave ``(bot_id, update_id)``
+    y sus filas quedan en el bot principal.
+    """
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+    if not columns or "bot_id" in columns:
+        return
+    conn.execute(schema.format(table=f"{table}_new"))
+    names = ", ".join(columns)
+    conn.execute(f"INSERT INTO {table}_new ({names}) SELECT {names} FROM {table}")
+    conn.execute(f"DROP TABLE {table}")
+    conn.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+    logger.info("Tabla {} migrada a claves (bot_id, update_id)", table)
+
+
+def init_jobs_table() -> None:
+    """Crea la tabla de trabajos si no existe."""
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        # Bases creadas antes de registrar el uso de tokens por solicitud
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(llm_jobs)")}
+        if columns and "usage" not in columns:
+            conn.execute("ALTER TABLE llm_jobs ADD COLUMN usage TEXT")
+        _rebuild_with_bot_id(conn, "llm_jobs", JOBS_SCHEMA)
+        _rebuild_with_bot_id(conn, "llm_job_updates", JOB_UPDATES_SCHEMA)
+        conn.execute(JOBS_SCHEMA.format(table="llm_jobs"))
+        conn.execute(JOB_UPDATES_SCHEMA.format(table="llm_job_updates"))
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_llm_jobs_status ON llm_jobs (status, lease_until)"
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def job_exists(update_id: int) -> bool:
+    """True si el update del bot actual ya generó un trabajo (propio o agrupado en otro)."""
+    bot_id = current_bot.get()
+    conn = _connect()
+    try:
+        row = conn.execute(
+            "SELECT 1 FROM llm_jobs WHERE bot_id = ? AND update_id = ? "
+            "UNION ALL SELECT 1 FROM llm_job_updates WHERE bot_id = ? AND update_id = ?",
+            (bot_id, update_id, bot_id, update_id),
+        ).fetchone()
+        return row is not None
+    finally:
+        conn.close()
+
+
+def enqueue_job(
+    update_id: int,
+    chat_id: int,
+    user_id: int,
+    payload: Dict[str, Any],
+    merged_update_ids: Iterable[int] = (),
+) -> bool:
+    """
+    Persiste un trabajo. Retorna False si el ``update_id`` ya estaba en cola
+    (reentrega de Telegram), en cuyo caso no se debe volver a responder.
+
+    ``merged_update_ids`` son los demás updates agrupados en este trabajo;
+    se registran para que sus reentregas también se ignoren.
+
+    El trabajo pertenece al bot actual (``current_bot``).
+    """
+    bot_id = current_bot.get()
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO llm_jobs (bot_id, update_id, chat_id, user_id, payload, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (bot_id, update_id, chat_id, user_id, json.dumps(payload), time.time()),
+        )
+        inserted = cursor.rowcount == 1
+        if inserted:
+            conn.executemany(
+                "INSERT OR IGNORE INTO llm_job_updates (bot_id, update_id, job_update_id) "
+                "VALUES (?, ?, ?)",
+                [(bot_id, merged, update_id) for merged in merged_update_ids if merged != update_id],
+            )
+        conn.execute("COMMIT")
+        return inserted
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def claim_job(
+    lease_seconds: float, max_attempts: int = 3, bot_ids: Optional[Iterable[int]] = None
+) -> Optional[Job]:
+    """
+    Reclama el trabajo pendiente más antiguo (o uno con lease vencido).
+
+    Args:
+        bot_ids: Solo trabajos de estos bots (None = de cualquiera)
+    """
+    allowed = [] if bot_ids is None else list(bot_ids)
+    if bot_ids is not None and not allowed:
+        return None
+    bot_filter = f"AND bot_id IN ({', '.join('?' for _ in allowed)}) " if allowed else ""
+    now = time.time()
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        # Trabajos abandonados demasiadas veces se dan por fallidos
+        conn.execute(
+            "UPDATE llm_jobs SET status = ?, error = 'max attempts', updated_at = ? "
+            "WHERE status = ? AND lease_until < ? AND attempts >= ?",
+            (FAILED, now, RUNNING, now, max_attempts),
+        )
+        # Orden de llegada: los update_id de bots distintos no son comparables
+        row = conn.execute(
+            "SELECT update_id, chat_id, user_id, payload, attempts, bot_id FROM llm_jobs "
+            "WHERE (status = ? OR (status = ? AND lease_until < ?)) "
+            f"{bot_filter}ORDER BY created_at, update_id LIMIT 1",
+            (PENDING, RUNNING, now, *allowed),
+        ).fetchone()
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+        conn.execute(
+            "UPDATE llm_jobs SET status = ?, lease_until = ?, attempts = attempts + 1, "
+            "updated_at = ? WHERE bot_id = ? AND update_id = ?",
+            (RUNNING, now + lease_seconds, now, row[5], row[0]),
+        )
+        conn.execute("COMMIT")
+        return Job(row[0], row[1], row[2], json.loads(row[3]), row[4] + 1, row[5])
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+# Las funciones que reciben un update_id actúan sobre el bot actual salvo que
+# se indique ``bot_id`` (los workers lo toman del propio trabajo)
+
+
+def _set_status(
+    update_id: int,
+    status: str,
+    lease_until: float = 0,
+    error: Optional[str] = None,
+    bot_id: Optional[int] = None,
+) -> None:
+    conn = _connect()
+    try:
+        conn.execute(
+            "UPDATE llm_jobs SET status = ?, lease_until = ?, error = ?, updated_at = ? "
+            "WHERE bot_id = ? AND update_id = ?",
+            (status, lease_until, error, time.time(), _bot(bot_id), update_id),
+        )
+    finally:
+        conn.close()
+
+
+def _bot(bot_id: Optional[int]) -> int:
+    return current_bot.get() if bot_id is None else bot_id
+
+
+def renew_lease(update_id: int, lease_seconds: float, bot_id: Optional[int] = None) -> None:
+    conn = _connect()
+    try:
+        conn.execute(
+            "UPDATE llm_jobs SET lease_until = ? WHERE bot_id = ? AND update_id = ? AND status = ?",
+            (time.time() + lease_seconds, _bot(bot_id), update_id, RUNNING),
+        )
+    finally:
+        conn.close()
+
+
+def complete_job(
+    update_id: int, usage: Optional[Dict[str, Any]] = None, bot_id: Optional[int] = None
+) -> None:
+    """Marca el trabajo como terminado y guarda el uso de tokens de la solicitud."""
+    conn = _connect()
+    try:
+        conn.execute(
+            "UPDATE llm_jobs SET status = ?, lease_until = 0, error = NULL, usage = ?, "
+            "updated_at = ? WHERE bot_id = ? AND update_id = ?",
+            (DONE, json.dumps(usage) if usage else None, time.time(), _bot(bot_id), update_id),
+        )
+    finally:
+        conn.close()
+
+
+def get_job_usage(update_id: int, bot_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    conn = _connect()
+    try:
+        row = conn.execute(
+            "SELECT usage FROM llm_jobs WHERE bot_id = ? AND update_id = ?", (_bot(bot_id), update_id)
+        ).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+    finally:
+        conn.close()
+
+
+def fail_job(update_id: int, error: str, bot_id: Optional[int] = None) -> None:
+    _set_status(update_id, FAILED, error=error[:500], bot_id=bot_id)
+
+
+def release_job(update_id: int, bot_id: Optional[int] = None) -> None:
+    """Devuelve un trabajo interrumpido a la cola para retomarlo cuanto antes."""
+    _set_status(update_id, PENDING, bot_id=bot_id)
+
+
+def count_jobs(status: str) -> int:
+    conn = _connect()
+    try:
+        return conn.execute("SELECT COUNT(*) FROM llm_jobs WHERE status = ?", (status,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+# El procesador puede devolver el uso de tokens para guardarlo con el trabajo
+Processor = Callable[[Job, Any], Awaitable[Optional[Dict[str, Any]]]]
+
+
+class LLMJobQueue:
+    """
+    Pool de workers asyncio que consumen ``llm_jobs``.
+
+    Los workers se comparten entre todos los bots del proceso. Con
+    ``per_bot_limit`` ningún bot ocupa más de esos workers a la vez: cuando
+    un bot llega a su cupo, los workers libres reclaman trabajos de los demás.
+
+    Args:
+        lease_seconds: Duración del lease; se renueva cada tercio mientras se procesa
+        poll_interval: Espera máxima entre sondeos cuando la cola está vacía
+    """
+
+    def __init__(self, lease_seconds: float = 60.0, poll_interval: float = 1.0) -> None:
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.per_bot_limit: Optional[int] = None
+        self._bots: Dict[int, Any] = {}
+        self._active: Counter = Counter()
+        self._workers: Set[asyncio.Task] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._claim_lock: Optional[asyncio.Lock] = None
+        self._stopping = False
+
+    @property
+    def running(self) -> bool:
+        return bool(self._workers)
+
+    def notify(self) -> None:
+        """Despierta a los workers tras encolar un trabajo."""
+        if self._wakeup:
+            self._wakeup.set()
+
+    async def start(
+        self,
+        bot,
+        processor: Processor,
+        workers: int = 4,
+        bots: Optional[Dict[int, Any]] = None,
+        per_bot_limit: Optional[int] = None,
+    ) -> None:
+        """
+        Args:
+            bot: Bot principal
+            bots: Otros bots por espacio de nombres (ver bot/tenancy.py)
+            per_bot_limit: Trabajos simultáneos máximos por bot (None = sin cupo)
+        """
+        if self.running:
+            return
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._claim_lock = asyncio.Lock()
+        self._bots = {PRIMARY_BOT: bot, **(bots or {})}
+        self.per_bot_limit = per_bot_limit
+        self._active.clear()
+        for index in range(workers):
+            task = asyncio.create_task(self._worker(processor), name=f"llm-worker-{index}")
+            self._workers.add(task)
+        logger.info("{} workers de LLM iniciados para {} bot(s)", workers, len(self._bots))
+
+    async def stop(self, timeout: float = 20.0) -> None:
+        """Deja de reclamar trabajos y espera a los que están en curso."""
+        if not self.running:
+            return
+        self._stopping = True
+        self.notify()
+        done, pending = await asyncio.wait(self._workers, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+            logger.warning("{} trabajos interrumpidos al apagar; se retomarán al reiniciar", len(pending))
+        self._workers.clear()
+
+    def _claimable(self) -> List[int]:
+        """Bots servidos por este proceso que aún no llegaron a su cupo."""
+        return [
+            bot_id
+            for bot_id in self._bots
+            if self.per_bot_limit is None or self._active[bot_id] < self.per_bot_limit
+        ]
+
+    async def _next_job(self) -> Optional[Job]:
+        while not self._stopping:
+            # Un reclamo a la vez: el cupo se cuenta antes de que otro worker
+            # consulte qué bots pueden reclamar
+            async with self._claim_lock:
+                job = await asyncio.to_thread(claim_job, self.lease_seconds, bot_ids=self._claimable())
+                if job:
+                    self._active[job.bot_id] += 1
+                    return job
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+        return None
+
+    async def _keep_lease(self, job: Job) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            await asyncio.to_thread(renew_lease, job.update_id, self.lease_seconds, job.bot_id)
+
+    async def _worker(self, processor: Processor) -> None:
+        while True:
+            job = await self._next_job()
+            if job is None:
+                return
+            bot = self._bots[job.bot_id]
+            keeper = asyncio.create_task(self._keep_lease(job))
+            try:
+                with use_bot(job.bot_id):
+                    usage = await processor(job, bot)
+                await asyncio.to_thread(complete_job, job.update_id, usage, job.bot_id)
+            except asyncio.CancelledError:
+                await asyncio.shield(asyncio.to_thread(release_job, job.update_id, job.bot_id))
+                raise
+            except OutboxStopped:
+                # La respuesta no llegó a enviarse: se reintenta al reiniciar
+                logger.warning("Trabajo {} sin respuesta enviada; vuelve a la cola", job.update_id)
+                await asyncio.to_thread(release_job, job.update_id, job.bot_id)
+            except Exception as e:
+                logger.error("Trabajo {} fallido: {}", job.update_id, str(e))
+                await asyncio.to_thread(fail_job, job.update_id, str(e), job.bot_id)
+            finally:
+                keeper.cancel()
+                self._active[job.bot_id] -= 1
+                # Un hueco en el cupo de este bot puede desbloquear sus trabajos
+                self.notify()
+
+
+# Instancia compartida; se inicia en post_init y se drena en post_stop
+llm_jobs = LLMJobQueue()
@@ -0,0 +1,236 @@
+"""
+Configuración de loguru para el bot.
+
+- Todos los sinks usan ``enqueue=True``: quien llama solo encola el registro y
+  un hilo aparte escribe en disco, así un disco lento nunca bloquea a los
+  handlers.
+- ``LogFilter`` aplica niveles por módulo (``bot.jobs=DEBUG,httpx=WARNING``)
+  y limita los mensajes repetidos por punto de llamada.
+- ``redact`` se instala como patcher: los secretos se ocultan antes de
+  cualquier sink, aunque quien llama los incluya en el mensaje, en
+  ``extra`` o en el texto de una excepción. Las trazas se formatean sin
+  valores de variables (``diagnose=False``): las locales pueden ser API keys.
+- Los módulos de ``core`` usan ``logging`` estándar; ``InterceptHandler`` los
+  redirige a loguru para que pasen por la misma cola y el mismo filtrado.
+"""
+
+import inspect
+import logging
+import re
+import sys
+import time
+import traceback
+from typing import Dict, Optional, Tuple
+
+from loguru import logger
+
+TEXT_FORMAT = (
+    "<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | "
+    "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>"
+)
+
+_SECRET_PATTERNS = [
+    # Claves estilo OpenAI/OpenRouter/Anthropic: sk-..., sk-or-..., sk-ant-...
+    (re.compile(r"\bsk-[A-Za-z0-9_\-]{8,}"), "sk-***"),
+    # Tokens de bots de Telegram: 123456789:AA...
+    (re.compile(r"\b\d{6,}:[A-Za-z0-9_\-]{30,}"), "***:***"),
+    (re.compile(r"(Bearer\s+)[A-Za-z0-9._\-]+", re.IGNORECASE), r"\1***"),
+    # api_key=..., "api_key": "...", 'api_key': '...'
+    (
+        re.compile(r"""(["']?(?:api_key|token|password|secret)["']?\s*[:=]\s*["']?)[^"',\s}]+""", re.IGNORECASE),
+        r"\1***",
+    ),
+]
+
+
+def redact_text(text: str) -> str:
+    for pattern, replacement in _SECRET_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def redact(record) -> None:
+    """
+    Patcher de loguru: oculta secretos del mensaje ya formateado, de los
+    valores de texto de ``extra`` y de la traza de la excepción.
+
+    La traza se formatea aquí y se guarda, ya redactada, en
+    ``extra["traceback"]``; la excepción original se quita del registro para
+    que ningún sink la vuelva a formatear.
+    """
+    record["message"] = redact_text(record["message"])
+    extra = record["extra"]
+    for key, value in extra.items():
+        if isinstance(value, str):
+            extra[key] = redact_text(value)
+    exception = record["exception"]
+    if exception is not None:
+        text = "".join(traceback.format_exception(exception.type, exception.value, exception.traceback))
+        extra["traceback"] = redact_text(text.rstrip("\n"))
+        record["exception"] = None
+
+
+def text_format(record) -> str:
+    """``TEXT_FORMAT`` seguido de la traza redactada, si la hay."""
+    if record["extra"].get("traceback"):
+        return TEXT_FORMAT + "\n{extra[traceback]}\n"
+    return TEXT_FORMAT + "\n"
+
+
+def parse_levels(value: Optional[str]) -> Dict[str, str]:
+    """``"bot.jobs=DEBUG, httpx=WARNING"`` -> ``{"bot.jobs": "DEBUG", "httpx": "WARNING"}``."""
+    levels: Dict[str, str] = {}
+    for item in (value or "").split(","):
+        module, sep, level = item.partition("=")
+        if sep and module.strip() and level.strip():
+            levels[module.strip()] = level.strip().upper()
+    return levels
+
+
+class LogFilter:
+    """
+    Filtro de un sink: nivel por módulo y límite de repeticiones.
+
+    Args:
+        default_level: Nivel para los módulos sin override
+        module_levels: Overrides por prefijo de módulo (gana el más específico)
+        max_per_window: Mensajes por punto de llamada (módulo, función, línea)
+            y ventana; 0 desactiva el límite
+        window_seconds: Duración de la ventana
+    """
+
+    def __init__(
+        self,
+        default_level: str = "INFO",
+        module_levels: Optional[Dict[str, str]] = None,
+        max_per_window: int = 0,
+        window_seconds: float = 60.0,
+    ) -> None:
+        self.default_no = logger.level(default_level).no
+        self.module_levels = {
+            module: logger.level(level).no for module, level in (module_levels or {}).items()
+        }
+        self.max_per_window = max_per_window
+        self.window_seconds = window_seconds
+        self._level_cache: Dict[str, int] = {}
+        # (módulo, función, línea) -> [inicio de ventana, emitidos, suprimidos]
+        self._windows: Dict[Tuple[str, str, int], list] = {}
+        self._last_record = None
+        self._last_decision = True
+
+    @property
+    def min_level(self) -> int:
+        return min([self.default_no, *self.module_levels.values()])
+
+    def _level_for(self, name: str) -> int:
+        level = self._level_cache.get(name)
+        if level is None:
+            level = self.default_no
+            best = -1
+            for module, module_level in self.module_levels.items():
+                if (name == module or name.startswith(module + ".")) and len(module) > best:
+                    level, best = module_level, len(module)
+            self._level_cache[name] = level
+        return level
+
+    def __call__(self, record) -> bool:
+        name = record["name"] or ""
+        if record["level"].no < self._level_for(name):
+            return False
+        if not self.max_per_window:
+            return True
+        # El mismo registro pasa por cada sink: se decide una sola vez
+        if record is self._last_record:
+            return self._last_decision
+        self._last_record = record
+        self._last_decision = self._allow(name, record)
+        return self._last_decision
+
+    def _allow(self, name: str, record) -> bool:
+        key = (name, record["function"], record["line"])
+        now = time.monotonic()
+        window = self._windows.get(key)
+        if window is None or now - window[0] >= self.window_seconds:
+            suppressed = window[2] if window else 0
+            self._windows[key] = [now, 1, 0]
+            if suppressed:
+                record["message"] += f" (+{suppressed} repetidos suprimidos)"
+            return True
+        if window[1] < self.max_per_window:
+            window[1] += 1
+            return True
+        window[2] += 1
+        return False
+
+
+class InterceptHandler(logging.Handler):
+    """Redirige ``logging`` estándar a loguru conservando el módulo de origen."""
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            level = logger.level(record.levelname).name
+        except ValueError:
+            level = record.levelno
+        # Sube hasta el primer frame fuera de logging para conservar módulo y línea
+        frame, depth = inspect.currentframe(), 0
+        while frame and (depth == 0 or frame.f_code.co_filename == logging.__file__):
+            frame = frame.f_back
+            depth += 1
+        logger.opt(depth=depth, exception=record.exc_info).log(level, record.getMessage())
+
+
+def configure_logging(
+    level: str = "ERROR",
+    log_file: Optional[str] = "bot.log",
+    json_path: Optional[str] = None,
+    module_levels: Optional[Dict[str, str]] = None,
+    rate_limit: int = 0,
+) -> None:
+    """
+    Reconfigura loguru: stderr, ``bot.log`` y, opcionalmente, un sink JSON.
+
+    Args:
+        level: Nivel por defecto
+        log_file: Archivo de texto rotado (None para desactivarlo)
+        json_path: Archivo JSON por línea (``serialize=True``) para ingesta
+        module_levels: Overrides por módulo (ver ``parse_levels``)
+        rate_limit: Máximo de mensajes por minuto y punto de llamada (0 = sin límite)
+    """
+
+    # Un único filtro: todos los sinks ven los mismos mensajes suprimidos
+    log_filter = LogFilter(level, module_levels, max_per_window=rate_limit)
+    sink_level = log_filter.min_level
+
+    logger.remove()  # Elimina cualquier configuración previa
+    logger.configure(patcher=redact)
+    # diagnose=False en todos los sinks: sin valores de variables en las trazas
+    logger.add(
+        sys.stderr, level=sink_level, filter=log_filter, format=text_format, diagnose=False, enqueue=True
+    )
+    if log_file:
+        logger.add(
+            log_file,
+            level=sink_level,
+            filter=log_filter,
+            format=text_format,
+            diagnose=False,
+            rotation="10 MB",
+            retention="10 days",
+            encoding="utf-8",
+            enqueue=True,
+        )
+    if json_path:
+        logger.add(
+            json_path,
+            level=sink_level,
+            filter=log_filter,
+            format=text_format,
+            serialize=True,
+            diagnose=False,
+            rotation="50 MB",
+            retention="10 days",
+            encoding="utf-8",
+            enqueue=True,
+        )
+    # Los módulos de core usan logging estándar; mismos números de nivel
+    logging.basicConfig(handlers=[InterceptHandler()], level=sink_level, force=True)
@@ -1,20 +1,15 @@
-from telegram.ext import (
-    ApplicationBuilder,
-    CommandHandler,
-    MessageHandler,
-    CallbackQueryHandler,
-    filters,
-    Application,
-)
-from telegram import BotCommand, Update
+from __future__ import annotations
+
 from loguru import logger
+from typing import TYPE_CHECKING, List, Optional
+import asyncio
 import signal
 import sys
 
 # Use relative imports when running as module, absolute when running directly
 try:
-    from bot.config import TELEGRAM_TOKEN
-    from bot.database import init_db, close_db
+    from bot.config import load_config, get_config
+    from bot.database import init_db, close_db, DB_PATH
     from bot.handlers.commands import (
         start,
         set_api_key,
@@ -24,13 +19,33 @@ try:
         config_status,
         help_command,
         test_config,
+        reset_context,
+        usage_command,
+        setup_command,
+        remember_command,
+        forget_command,
+        compare_command,
+        profile_command,
     )
-    from bot.handlers.messages import handle_message
+    from bot.handlers.messages import handle_message, process_job, flush_pending_batches
     from bot.handlers.callbacks import handle_button
+    from bot.handlers.inline import handle_inline_query
+    from bot.traffic import TrafficRecorder
+    from bot.outbox import outbox
+    from bot.jobs import init_jobs_table, llm_jobs
+    from bot.usage import init_usage_table, accountant
+    from bot.maintenance import MaintenanceTask, default_policies, parse_hours
+    from bot.warmstart import warm_start, save_snapshot, warm_users
+    from bot.tenancy import PRIMARY_BOT, hosted_bots, tenant_application_class
+    from core.capabilities import registry
+    from core.context import conversations
+    from core.retrieval import knowledge
+    from core.semantic_cache import semantic_cache
+    from core import llm_clients
 except ImportError:
     # Fallback to relative imports when running as module
-    from .config import TELEGRAM_TOKEN
-    from .database import init_db, close_db
+    from .config import load_config, get_config
+    from .database import init_db, close_db, DB_PATH
     from .handlers.commands import (
         start,
         set_api_key,
@@ -40,24 +55,136 @@ except ImportError:
         config_status,
         help_command,
         test_config,
+        reset_context,
+        usage_command,
+        setup_command,
+        remember_command,
+        forget_command,
+        compare_command,
+        profile_command,
     )
-    from .handlers.messages import handle_message
+    from .handlers.messages import handle_message, process_job, flush_pending_batches
     from .handlers.callbacks import handle_button
+    from .handlers.inline import handle_inline_query
+    from .traffic import TrafficRecorder
+    from .outbox import outbox
+    from .jobs import init_jobs_table, llm_jobs
+    from .usage import init_usage_table, accountant
+    from .maintenance import MaintenanceTask, default_policies, parse_hours
+    from .warmstart import warm_start, save_snapshot, warm_users
+    from .tenancy import PRIMARY_BOT, hosted_bots, tenant_application_class
+    from ..core.capabilities import registry
+    from ..core.context import conversations
+    from ..core.retrieval import knowledge
+    from ..core.semantic_cache import semantic_cache
+    from ..core import llm_clients
+
+if TYPE_CHECKING:
+    from telegram.ext import Application
 
-# El logger se importa desde config.py y ya está configurado con loguru
+# El logger se configura en load_config() (ver bot/logs.py)
 
-# Comandos del bot
+# Comandos del bot: (comando, descripción)
 BOT_COMMANDS = [
-    BotCommand("start", "Inicia el bot y muestra el menú"),
-    BotCommand("help", "Muestra la ayuda y los comandos disponibles"),
-    BotCommand("set_api_key", "Configura tu API Key de OpenAI"),
-    BotCommand("set_base_url", "Configura la URL base de la API"),
-    BotCommand("set_model", "Configura el modelo de IA a usar"),
-    BotCommand("set_system_prompt", "Configura el prompt del sistema"),
-    BotCommand("config_status", "Muestra la configuración actual"),
+    ("start", "Inicia el bot y muestra el menú"),
+    ("help", "Muestra la ayuda y los comandos disponibles"),
+    ("set_api_key", "Configura tu API Key de OpenAI"),
+    ("set_base_url", "Configura la URL base de la API"),
+    ("set_model", "Configura el modelo de IA a usar"),
+    ("set_system_prompt", "Configura el prompt del sistema"),
+    ("config_status", "Muestra la configuración actual"),
+    ("setup", "Configura API key, URL, modelo y prompt en un mensaje"),
+    ("reset", "Olvida el historial de la conversación"),
+    ("usage", "Muestra tu consumo de solicitudes y tokens"),
+    ("remember", "Guarda un documento o texto en tu memoria"),
+    ("forget", "Borra los documentos de tu memoria"),
+    ("compare", "Compara varios modelos con la misma pregunta"),
 ]
 
 
+def build_maintenance() -> MaintenanceTask:
+    """Retención de tablas y compactación de la base en horario valle."""
+    settings = get_config()
+    return MaintenanceTask(
+        default_policies(
+            jobs_days=settings.retention_jobs_days,
+            turns_days=settings.retention_turns_days,
+            turns_max_rows=settings.retention_turns_max_rows,
+            usage_days=settings.retention_usage_days,
+        ),
+        interval=settings.maintenance_interval_seconds,
+        offpeak_hours=parse_hours(settings.maintenance_hours),
+    )
+
+
+async def start_warmup(application: Application) -> None:
+    """
+    Precarga configuraciones y conexiones de los usuarios activos antes del
+    reinicio. Espera como mucho ``warmstart_timeout``; si tarda más, sigue en
+    segundo plano y el bot empieza a atender igualmente.
+    """
+    settings = get_config()
+    if not settings.warmstart_path:
+        return
+    warm_users.max_users = settings.warmstart_users
+    task = asyncio.create_task(warm_start(settings.warmstart_path, warm_users))
+    application.bot_data["warmstart"] = task
+    done, _ = await asyncio.wait({task}, timeout=settings.warmstart_timeout)
+    if not done:
+        logger.info("Arranque en caliente continúa en segundo plano")
+    elif task.exception():
+        logger.warning("Arranque en caliente fallido: {}", str(task.exception()))
+
+
+def job_quota(workers: int, bots: int) -> Optional[int]:
+    """
+    Cupo de trabajos simultáneos por bot: ``BOT_JOB_QUOTA`` si está definido;
+    si no, con varios bots, la mitad de los workers (al menos uno).
+    """
+    quota = get_config().bot_job_quota
+    if quota > 0:
+        return quota
+    return max(1, workers // 2) if bots > 1 else None
+
+
+async def start_services(applications: List[Application]) -> None:
+    """
+    Arranca los servicios compartidos por todos los bots del proceso: cola de
+    salida, contadores de uso, mantenimiento, arranque en caliente y workers
+    del LLM. ``applications[0]`` es el bot principal.
+    """
+    from telegram import BotCommand
+
+    settings = get_config()
+    primary = applications[0]
+    # El SDK de OpenAI se importa en segundo plano mientras llegan los primeros updates
+    primary.bot_data["preload"] = asyncio.create_task(asyncio.to_thread(llm_clients.preload))
+    await outbox.start()
+    await accountant.start(settings.usage_flush_seconds)
+    maintenance = primary.bot_data["maintenance"] = build_maintenance()
+    await maintenance.start()
+    await start_warmup(primary)
+    # Retoma también los trabajos que quedaron pendientes antes del reinicio
+    await llm_jobs.start(
+        primary.bot,
+        process_job,
+        workers=settings.job_workers,
+        bots={app.bot_data["bot_id"]: app.bot for app in applications[1:]},
+        per_bot_limit=job_quota(settings.job_workers, len(applications)),
+    )
+    for application in applications:
+        try:
+            await application.bot.set_my_commands(
+                [BotCommand(command, description) for command, description in BOT_COMMANDS]
+            )
+            logger.info("Comandos del bot configurados correctamente")
+            await application.bot.set_my_description(
+                "Bot para interactuar con modelos de IA"
+            )
+        except Exception as e:
+            logger.error(f"Error en post_init: {str(e)}", exc_info=True)
+
+
 async def post_init(application: Application) -> None:
     """
     Configuración posterior a la inicialización del bot.
@@ -65,14 +192,7 @@ async def post_init(application: Application) -> None:
     Args:
         application: Instancia de la aplicación del bot
     """
-    try:
-        await application.bot.set_my_commands(BOT_COMMANDS)
-        logger.info("Comandos del bot configurados correctamente")
-        await application.bot.set_my_description(
-            "Bot para interactuar con modelos de IA"
-        )
-    except Exception as e:
-        logger.error(f"Error en post_init: {str(e)}", exc_info=True)
+    await start_services([application])
 
 
 def register_handlers(application: Application) -> None:
@@ -82,6 +202,14 @@ def register_handlers(application: Application) -> None:
     Args:
         application: Instancia de la aplicación del bot
     """
+    from telegram.ext import (
+        CallbackQueryHandler,
+        CommandHandler,
+        InlineQueryHandler,
+        MessageHandler,
+        filters,
+    )
+
     handlers = [
         CommandHandler("start", start),
         CommandHandler("help", help_command),
@@ -90,10 +218,20 @@ def register_handlers(application: Application) -> None:
         CommandHandler("set_model", set_model),
         CommandHandler("set_system_prompt", set_system_prompt),
         CommandHandler("config_status", config_status),
+        CommandHandler("setup", setup_command),
         CommandHandler("test_config", test_config),
+        CommandHandler("reset", reset_context),
+        CommandHandler("usage", usage_command),
+        CommandHandler("remember", remember_command),
+        CommandHandler("forget", forget_command),
+        CommandHandler("compare", compare_command),
+        # Sin bloquear: muestrea durante segundos mientras el bot sigue atendiendo
+        CommandHandler("profile", profile_command, block=False),
         CallbackQueryHandler(handle_button),
+        InlineQueryHandler(handle_inline_query),
         MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message),
         MessageHandler(filters.PHOTO, handle_message),  # Manejo de imágenes
+        MessageHandler(filters.Document.ALL, handle_message),  # Texto, Markdown, PDF y código
     ]
 
     for handler in handlers:
@@ -102,13 +240,188 @@ def register_handlers(application: Application) -> None:
     logger.info(f"{len(handlers)} manejadores registrados")
 
 
-def handle_shutdown(signum, frame) -> None:
+def install_traffic_recorder(application: Application) -> None:
+    """
+    Registra el grabador de tráfico si ``TRAFFIC_RECORD_PATH`` está definido.
+
+    Se añade en el grupo -1 para ver cada Update antes que los handlers
+    normales, sin impedir que estos lo procesen.
+
+    Args:
+        application: Instancia de la aplicación del bot
+    """
+    from telegram import Update
+    from telegram.ext import TypeHandler
+
+    settings = get_config()
+    if not settings.traffic_record_path:
+        return
+    recorder = TrafficRecorder(settings.traffic_record_path, salt=settings.traffic_record_salt)
+    application.bot_data["traffic_recorder"] = recorder
+    application.add_handler(TypeHandler(Update, recorder.record), group=-1)
+    logger.info("Grabación de tráfico activa en {}", recorder.path)
+
+
+async def stop_services(applications: List[Application]) -> None:
+    """
+    Drena los trabajos en curso y la cola de salida mientras los bots aún
+    pueden enviar mensajes. Lo que no termine a tiempo queda en SQLite y se
+    retoma en el siguiente arranque.
+    """
+    maintenance = applications[0].bot_data.pop("maintenance", None)
+    if maintenance:
+        await maintenance.stop()
+    await flush_pending_batches()
+    await llm_jobs.stop(timeout=get_config().job_drain_timeout)
+    await accountant.stop()
+    await outbox.stop()
+    settings = get_config()
+    if settings.warmstart_path:
+        try:
+            await asyncio.to_thread(save_snapshot, settings.warmstart_path, warm_users)
+        except Exception as e:
+            logger.warning("No se pudo guardar la instantánea de arranque: {}", str(e))
+
+
+async def post_stop(application: Application) -> None:
+    """
+    Args:
+        application: Instancia de la aplicación del bot
+    """
+    await stop_services([application])
+
+
+async def post_shutdown(application: Application) -> None:
+    """
+    Libera recursos asociados a la aplicación al apagarse.
+
+    Args:
+        application: Instancia de la aplicación del bot
+    """
+    recorder = application.bot_data.get("traffic_recorder")
+    if recorder:
+        recorder.close()
+
+
+def init_storage() -> None:
+    """Crea las tablas y configura los registros que viven en ``data/bot.db``."""
+    from bot.persistence import init_persistence_table
+
+    settings = get_config()
+    init_db()
+    init_persistence_table()
+    init_jobs_table()
+    init_usage_table()
+    registry.configure(db_path=DB_PATH)
+    conversations.configure(
+        db_path=DB_PATH,
+        max_history_tokens=settings.context_max_tokens,
+        compact_threshold_tokens=settings.context_compact_tokens,
+        keep_recent_turns=settings.context_keep_turns,
+    )
+    knowledge.configure(
+        root=settings.knowledge_path,
+        db_path=DB_PATH,
+        model=settings.embedding_model,
+        dimensions=settings.embedding_dimensions or None,
+        dtype=settings.embedding_dtype,
+        top_k=settings.retrieval_top_k,
+        min_score=settings.retrieval_min_score,
+    )
+    semantic_cache.configure(
+        threshold=settings.semantic_cache_threshold,
+        capacity=settings.semantic_cache_capacity,
+        ttl_seconds=settings.semantic_cache_ttl_seconds,
+        eviction=settings.semantic_cache_eviction,
+        audit_rate=settings.semantic_cache_audit_rate,
+        model=settings.embedding_model,
+        dimensions=settings.embedding_dimensions or None,
+    )
+
+
+def build_application(
+    token: str, base_url: Optional[str] = None, bot_id: int = PRIMARY_BOT
+) -> Application:
+    """
+    Construye la aplicación con todos sus handlers registrados.
+
+    Args:
+        token: Token del bot de Telegram
+        base_url: Base URL alternativa de la Bot API (p. ej. un servidor local)
+        bot_id: Espacio de nombres del bot (ver bot/tenancy.py)
+
+    Returns:
+        Application lista para iniciar
     """
-    Maneja el cierre limpio de la aplicación.
+    from telegram.ext import ApplicationBuilder
+    from bot.persistence import SQLitePersistence
+
+    builder = (
+        ApplicationBuilder()
+        .application_class(tenant_application_class())
+        .token(token)
+        .persistence(
+            SQLitePersistence(update_interval=get_config().persistence_interval, bot_id=bot_id)
+        )
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+    )
+    if base_url:
+        builder = builder.base_url(base_url)
+    application = builder.build()
+    application.bot_data["bot_id"] = bot_id
+
+    # El tráfico se graba solo en el bot principal
+    if bot_id == PRIMARY_BOT:
+        install_traffic_recorder(application)
+    register_handlers(application)
+    return application
+
+
+async def run_bots(applications: List[Application]) -> None:
     """
-    logger.info("Recibida señal de apagado. Cerrando el bot...")
-    close_db()
-    sys.exit(0)
+    Atiende varios bots en el mismo event loop hasta SIGINT/SIGTERM.
+
+    Repite el ciclo de ``run_polling`` (que solo admite una aplicación) para
+    todas a la vez; los servicios compartidos arrancan y se drenan una vez.
+    """
+    from telegram import Update
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+
+    initialized: List[Application] = []
+    services = False
+    try:
+        for application in applications:
+            await application.initialize()
+            initialized.append(application)
+        await start_services(applications)
+        services = True
+        for application in applications:
+            await application.updater.start_polling(
+                drop_pending_updates=False, allowed_updates=Update.ALL_TYPES
+            )
+            await application.start()
+        logger.info("{} bots atendiendo en el mismo proceso", len(applications))
+        await stop.wait()
+    finally:
+        for application in initialized:
+            if application.updater.running:
+                await application.updater.stop()
+            if application.running:
+                await application.stop()
+        if services:
+            await stop_services(applications)
+        for application in initialized:
+            await application.shutdown()
+            await post_shutdown(application)
 
 
 def main() -> None:
@@ -116,28 +429,33 @@ def main() -> None:
     Función principal que inicia y configura el bot.
     """
     try:
-        # Configurar manejo de señales para apagado limpio
-        signal.signal(signal.SIGINT, handle_shutdown)
-        signal.signal(signal.SIGTERM, handle_shutdown)
+        settings = load_config()
 
         # Inicializar base de datos
-        init_db()
+        init_storage()
         logger.info("Base de datos inicializada")
 
-        # Construir y configurar la aplicación
-        application = (
-            ApplicationBuilder().token(TELEGRAM_TOKEN).post_init(post_init).build()
-        )
-
-        # Registrar manejadores
-        register_handlers(application)
+        # Construir y configurar una aplicación por bot
+        applications = [
+            build_application(token, bot_id=bot_id)
+            for bot_id, token in hosted_bots(settings.telegram_token, settings.telegram_tokens)
+        ]
 
         logger.info("🤖 Bot iniciado y listo para recibir mensajes")
         print("Bot iniciado correctamente. Presiona Ctrl+C para detenerlo.")
 
-        # Iniciar el bot - Fixed for python-telegram-bot 20.x compatibility
+        if len(applications) > 1:
+            asyncio.run(run_bots(applications))
+            return
+        application = applications[0]
+
+        # run_polling gestiona SIGINT/SIGTERM y ejecuta post_stop para drenar
+        # los trabajos. Los updates pendientes no se descartan: los que ya
+        # estaban en cola se deduplican por update_id.
+        from telegram import Update
+
         application.run_polling(
-            drop_pending_updates=True,
+            drop_pending_updates=False,
             allowed_updates=Update.ALL_TYPES,
         )
 
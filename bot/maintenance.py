@@ -0,0 +1,339 @@
+"""
+Mantenimiento en segundo plano de ``data/bot.db``.
+
+- Retención: cada tabla tiene un TTL y/o un máximo de filas. Las filas
+  sobrantes se borran en lotes pequeños, cada uno en su propia transacción
+  corta, con una pausa entre lotes para no retener el lock de escritura.
+- Compactación: en la franja de poca actividad (``offpeak_hours``, UTC) se
+  ejecuta ``PRAGMA incremental_vacuum`` por tramos y ``PRAGMA optimize``.
+  Requiere ``auto_vacuum = INCREMENTAL``; las bases nuevas lo activan en
+  ``init_db`` y las existentes se convierten una vez con:
+
+    python -m bot.maintenance --convert
+
+Cada pasada registra el tamaño de la base y las páginas recuperadas.
+"""
+
+import argparse
+import asyncio
+import sqlite3
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from loguru import logger
+
+# Use relative imports when running as module, absolute when running directly
+try:
+    from bot import database
+except ImportError:
+    # Fallback to relative imports when running as module
+    from . import database
+
+DAY = 86400
+
+
+@dataclass(frozen=True)
+class RetentionPolicy:
+    """
+    Args:
+        table: Tabla a podar
+        time_column: Columna con la antigüedad (epoch REAL o ``YYYY-MM-DD``)
+        ttl_seconds: Antigüedad máxima; None = sin TTL
+        max_rows: Máximo de filas; se borran las más antiguas
+        where: Condición extra para el TTL (p. ej. solo trabajos terminados)
+        day_column: True si ``time_column`` es una fecha ``YYYY-MM-DD``
+    """
+
+    table: str
+    time_column: str
+    ttl_seconds: Optional[float] = None
+    max_rows: Optional[int] = None
+    where: str = ""
+    day_column: bool = False
+
+
+def default_policies(
+    jobs_days: float = 7,
+    turns_days: float = 30,
+    turns_max_rows: int = 200_000,
+    usage_days: float = 400,
+) -> List[RetentionPolicy]:
+    """Políticas de las tablas que crecen con el uso."""
+    return [
+        RetentionPolicy(
+            "llm_jobs", "updated_at", jobs_days * DAY, where="status IN ('done', 'failed')"
+        ),
+        # Updates agrupados cuyo trabajo ya se borró
+        RetentionPolicy(
+            "llm_job_updates",
+            "rowid",
+            where="NOT EXISTS (SELECT 1 FROM llm_jobs WHERE llm_jobs.bot_id = llm_job_updates.bot_id "
+            "AND llm_jobs.update_id = llm_job_updates.job_update_id)",
+        ),
+        RetentionPolicy("chat_turns", "created_at", turns_days * DAY, max_rows=turns_max_rows),
+        RetentionPolicy("chat_summaries", "updated_at", turns_days * DAY),
+        RetentionPolicy("usage_daily", "day", usage_days * DAY, day_column=True),
+    ]
+
+
+def _connect() -> sqlite3.Connection:
+    return sqlite3.connect(database.DB_PATH, timeout=30, isolation_level=None)
+
+
+def _table_exists(conn: sqlite3.Connection, table: str) -> bool:
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone()
+    return row is not None
+
+
+def _cutoff(policy: RetentionPolicy, now: float):
+    cutoff = now - policy.ttl_seconds
+    return time.strftime("%Y-%m-%d", time.gmtime(cutoff)) if policy.day_column else cutoff
+
+
+def ensure_indexes(policies: Sequence[RetentionPolicy]) -> None:
+    """Índices sobre las columnas de antigüedad: cada lote cuesta lo mismo con 1k o 10M filas."""
+    conn = _connect()
+    try:
+        for policy in policies:
+            if policy.time_column == "rowid" or not _table_exists(conn, policy.table):
+                continue
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_{policy.table}_{policy.time_column} "
+                f"ON {policy.table} ({policy.time_column})"
+            )
+    finally:
+        conn.close()
+
+
+def _delete_batch(conn: sqlite3.Connection, table: str, condition: str, params: Tuple, order: str, limit: int) -> int:
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        cursor = conn.execute(
+            f"DELETE FROM {table} WHERE rowid IN "
+            f"(SELECT rowid FROM {table} WHERE {condition} ORDER BY {order} LIMIT ?)",
+            (*params, limit),
+        )
+        conn.execute("COMMIT")
+        return cursor.rowcount
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def sweep(
+    policies: Sequence[RetentionPolicy],
+    batch_size: int = 500,
+    pause: float = 0.05,
+    now: Optional[float] = None,
+) -> Dict[str, int]:
+    """
+    Aplica las políticas de retención en lotes.
+
+    Returns:
+        Filas borradas por tabla
+    """
+    now = time.time() if now is None else now
+    deleted: Dict[str, int] = {}
+    conn = _connect()
+    try:
+        for policy in policies:
+            if not _table_exists(conn, policy.table):
+                continue
+            total = 0
+            order = policy.time_column
+
+            conditions: List[Tuple[str, Tuple]] = []
+            if policy.ttl_seconds is not None:
+                condition = f"{policy.time_column} < ?"
+                if policy.where:
+                    condition += f" AND {policy.where}"
+                conditions.append((condition, (_cutoff(policy, now),)))
+            elif policy.where:
+                conditions.append((policy.where, ()))
+
+            for condition, params in conditions:
+                while True:
+                    count = _delete_batch(conn, policy.table, condition, params, order, batch_size)
+                    total += count
+                    if count < batch_size:
+                        break
+                    # Deja pasar a los escritores del bot entre lotes
+                    time.sleep(pause)
+
+            if policy.max_rows is not None:
+                excess = conn.execute(f"SELECT COUNT(*) FROM {policy.table}").fetchone()[0] - policy.max_rows
+                while excess > 0:
+                    count = _delete_batch(conn, policy.table, "1", (), order, min(batch_size, excess))
+                    if count == 0:
+                        break
+                    total += count
+                    excess -= count
+                    time.sleep(pause)
+
+            if total:
+                deleted[policy.table] = total
+    finally:
+        conn.close()
+    return deleted
+
+
+def db_stats() -> Dict[str, int]:
+    conn = _connect()
+    try:
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    finally:
+        conn.close()
+    return {
+        "size_bytes": page_size * page_count,
+        "page_count": page_count,
+        "freelist_pages": freelist,
+        "auto_vacuum": auto_vacuum,
+    }
+
+
+def compact(pages_per_step: int = 256, pause: float = 0.05) -> int:
+    """
+    Devuelve al sistema las páginas libres por tramos y actualiza las
+    estadísticas del planificador.
+
+    Returns:
+        Páginas recuperadas
+    """
+    conn = _connect()
+    reclaimed = 0
+    try:
+        # 2 = INCREMENTAL; con NONE (0) o FULL (1) incremental_vacuum no hace nada
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            while True:
+                before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                if before == 0:
+                    break
+                conn.execute(f"PRAGMA incremental_vacuum({pages_per_step})").fetchall()
+                after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                reclaimed += before - after
+                if after >= before:
+                    break
+                time.sleep(pause)
+        conn.execute("PRAGMA optimize")
+    finally:
+        conn.close()
+    return reclaimed
+
+
+def convert_to_incremental() -> None:
+    """Activa ``auto_vacuum = INCREMENTAL`` en una base existente (VACUUM completo, una vez)."""
+    conn = _connect()
+    try:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+
+def in_offpeak(hours: Tuple[int, int], now: Optional[float] = None) -> bool:
+    """True si la hora UTC está en ``[inicio, fin)``; admite franjas que cruzan medianoche."""
+    start, end = hours
+    hour = time.gmtime(now).tm_hour
+    return start <= hour < end if start <= end else hour >= start or hour < end
+
+
+def parse_hours(value: str) -> Tuple[int, int]:
+    """``"3-5"`` -> ``(3, 5)``."""
+    start, _, end = value.partition("-")
+    return int(start), int(end or int(start) + 1)
+
+
+class MaintenanceTask:
+    """
+    Bucle de mantenimiento.
+
+    Args:
+        policies: Políticas de retención
+        interval: Segundos entre pasadas de retención
+        offpeak_hours: Franja UTC ``(inicio, fin)`` para vacuum/optimize
+        batch_size: Filas por transacción de borrado
+    """
+
+    def __init__(
+        self,
+        policies: Optional[Sequence[RetentionPolicy]] = None,
+        interval: float = 900.0,
+        offpeak_hours: Tuple[int, int] = (3, 5),
+        batch_size: int = 500,
+    ) -> None:
+        self.policies = list(policies if policies is not None else default_policies())
+        self.interval = interval
+        self.offpeak_hours = offpeak_hours
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+        self._last_compaction_day: Optional[str] = None
+
+    async def run_once(self, force_compaction: bool = False) -> Dict:
+        """Una pasada: retención siempre, compactación solo en horario valle (una vez al día)."""
+        deleted = await asyncio.to_thread(sweep, self.policies, self.batch_size)
+        report: Dict = {"deleted": deleted, "reclaimed_pages": 0}
+
+        today = time.strftime("%Y-%m-%d", time.gmtime())
+        if force_compaction or (
+            in_offpeak(self.offpeak_hours) and self._last_compaction_day != today
+        ):
+            report["reclaimed_pages"] = await asyncio.to_thread(compact)
+            self._last_compaction_day = today
+
+        report.update(await asyncio.to_thread(db_stats))
+        if deleted or report["reclaimed_pages"]:
+            logger.info(
+                "Mantenimiento: borradas {}, páginas recuperadas {}, tamaño {:.1f} MB, libres {}",
+                deleted,
+                report["reclaimed_pages"],
+                report["size_bytes"] / 1_048_576,
+                report["freelist_pages"],
+            )
+        return report
+
+    async def start(self) -> None:
+        if self._task is None:
+            await asyncio.to_thread(ensure_indexes, self.policies)
+            self._task = asyncio.create_task(self._run(), name="db-maintenance")
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error("Error en mantenimiento de la base de datos: {}", str(e))
+            await asyncio.sleep(self.interval)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Mantenimiento de data/bot.db")
+    parser.add_argument(
+        "--convert",
+        action="store_true",
+        help="Activa auto_vacuum=INCREMENTAL en una base existente (VACUUM completo)",
+    )
+    args = parser.parse_args(argv)
+
+    if args.convert:
+        convert_to_incremental()
+    task = MaintenanceTask()
+    ensure_indexes(task.policies)
+    report = asyncio.run(task.run_once(force_compaction=True))
+    print(report)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,343 @@
+"""
+Cola de salida hacia Telegram con control de flood.
+
+Todas las respuestas pasan por ``OutboundScheduler``:
+
+- Token buckets global (~30 msg/s) y por chat (~1 msg/s).
+- Prioridad: las respuestas finales salen antes que las ediciones de progreso.
+- Las ediciones pendientes al mismo mensaje se fusionan: solo se envía la última.
+- ``RetryAfter`` pausa el chat afectado y reintenta el mismo envío.
+
+Garantías: un envío aceptado por ``submit`` se ejecuta exactamente una vez
+(o se fusiona con una edición posterior del mismo mensaje). Solo se reintenta
+ante ``RetryAfter``, cuando Telegram confirma que no procesó la petición. Lo
+que siga en cola al agotarse el plazo de ``stop`` no se envía: su future
+falla con ``OutboxStopped`` y el trabajo de ``llm_jobs`` que esperaba el
+envío vuelve a la cola para reintentarse.
+"""
+
+import asyncio
+import bisect
+import itertools
+import time
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Set
+
+from loguru import logger
+from telegram.error import RetryAfter
+
+# Use relative imports when running as module, absolute when running directly
+try:
+    from bot.tenancy import current_bot, scoped_id
+except ImportError:
+    # Fallback to relative imports when running as module
+    from .tenancy import current_bot, scoped_id
+
+FINAL = 0
+PROGRESS = 1
+
+Factory = Callable[[], Awaitable[Any]]
+
+
+class TokenBucket:
+    """Token bucket clásico: ``rate`` tokens/segundo hasta ``capacity``."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Segundos hasta que haya un token disponible (0 si ya lo hay)."""
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, seconds: float) -> None:
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and self.blocked_until <= now
+
+
+@dataclass(order=True)
+class _Job:
+    priority: int
+    seq: int
+    chat_id: Hashable = field(compare=False)
+    factory: Factory = field(compare=False)
+    coalesce_key: Optional[Hashable] = field(compare=False, default=None)
+    futures: List[asyncio.Future] = field(compare=False, default_factory=list)
+    bot_id: int = field(compare=False, default=0)
+
+
+class OutboxStopped(Exception):
+    """El planificador se detuvo antes de enviar; la petición no llegó a Telegram."""
+
+
+def _retry_seconds(error: RetryAfter) -> float:
+    value = error.retry_after
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    return float(value)
+
+
+class OutboundScheduler:
+    """
+    Planificador de envíos a la Bot API.
+
+    Args:
+        global_rate: Mensajes por segundo para todo el bot
+        per_chat_rate: Mensajes por segundo por chat
+        per_chat_burst: Ráfaga máxima permitida por chat
+
+    Los límites de Telegram son por bot: con varios bots en el proceso (ver
+    bot/tenancy.py) cada uno tiene su bucket global y sus chats se
+    distinguen aunque compartan ``chat_id``.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = 30.0,
+        per_chat_rate: float = 1.0,
+        per_chat_burst: float = 3.0,
+    ) -> None:
+        self._global_rate = global_rate
+        self._globals: Dict[int, TokenBucket] = {}
+        self._per_chat_rate = per_chat_rate
+        self._per_chat_burst = per_chat_burst
+        self._chats: Dict[Hashable, TokenBucket] = {}
+        self._pending: List[_Job] = []
+        self._by_key: Dict[Hashable, _Job] = {}
+        self._in_flight: Set[Hashable] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._runner: Optional[asyncio.Task] = None
+        self._dispatched = 0
+
+    @property
+    def running(self) -> bool:
+        return self._runner is not None and not self._runner.done()
+
+    async def start(self) -> None:
+        if self.running:
+            return
+        self._wakeup = asyncio.Event()
+        self._runner = asyncio.create_task(self._run())
+        logger.info("Cola de salida iniciada")
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Envía lo pendiente (hasta ``timeout`` segundos) y detiene el planificador."""
+        if not self.running:
+            return
+        deadline = time.monotonic() + timeout
+        while (self._pending or self._tasks) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        self._runner.cancel()
+        try:
+            await self._runner
+        except asyncio.CancelledError:
+            pass
+        self._runner = None
+        if self._pending:
+            logger.warning("Cola de salida detenida con {} envíos pendientes", len(self._pending))
+        # Nadie debe quedarse esperando un envío que ya no se hará
+        for job in self._pending:
+            for future in job.futures:
+                if not future.done():
+                    future.set_exception(OutboxStopped(f"Envío a {job.chat_id} no realizado"))
+        self._pending.clear()
+        self._by_key.clear()
+
+    def submit(
+        self,
+        chat_id: Hashable,
+        factory: Factory,
+        priority: int = FINAL,
+        coalesce_key: Optional[Hashable] = None,
+    ) -> asyncio.Future:
+        """
+        Encola un envío y devuelve un future con el resultado de la llamada.
+
+        Args:
+            chat_id: Chat destino (para el bucket por chat)
+            factory: Función sin argumentos que crea la corutina de envío
+            priority: ``FINAL`` o ``PROGRESS``
+            coalesce_key: Si hay un envío pendiente con la misma clave, se
+                reemplaza por este y ambos futures reciben el mismo resultado
+        """
+        future = asyncio.get_running_loop().create_future()
+        existing = self._by_key.get(coalesce_key) if coalesce_key is not None else None
+        if existing is not None:
+            existing.factory = factory
+            existing.futures.append(future)
+            if priority < existing.priority:
+                self._pending.remove(existing)
+                existing.priority = priority
+                bisect.insort(self._pending, existing)
+        else:
+            job = _Job(
+                priority, next(self._seq), chat_id, factory, coalesce_key, [future], current_bot.get()
+            )
+            bisect.insort(self._pending, job)
+            if coalesce_key is not None:
+                self._by_key[coalesce_key] = job
+        if self._wakeup:
+            self._wakeup.set()
+        return future
+
+    async def send(
+        self,
+        chat_id: int,
+        factory: Factory,
+        priority: int = FINAL,
+        coalesce_key: Optional[Hashable] = None,
+    ) -> Any:
+        """Como ``submit`` pero espera el resultado; sin planificador envía directo."""
+        if not self.running:
+            return await factory()
+        return await self.submit(scoped_id(chat_id), factory, priority, coalesce_key)
+
+    async def reply_text(self, message, text: str, priority: int = FINAL, **kwargs) -> Any:
+        return await self.send(
+            message.chat_id, lambda: message.reply_text(text, **kwargs), priority
+        )
+
+    async def send_message(
+        self, bot, chat_id: int, text: str, priority: int = FINAL, **kwargs
+    ) -> Any:
+        return await self.send(
+            chat_id, lambda: bot.send_message(chat_id=chat_id, text=text, **kwargs), priority
+        )
+
+    async def edit_message_text(
+        self,
+        bot,
+        chat_id: int,
+        message_id: int,
+        text: str,
+        priority: int = PROGRESS,
+        **kwargs,
+    ) -> Any:
+        return await self.send(
+            chat_id,
+            lambda: bot.edit_message_text(
+                text=text, chat_id=chat_id, message_id=message_id, **kwargs
+            ),
+            priority,
+            coalesce_key=("edit", scoped_id(chat_id), message_id),
+        )
+
+    def _global_bucket(self, bot_id: int) -> TokenBucket:
+        bucket = self._globals.get(bot_id)
+        if bucket is None:
+            bucket = self._globals[bot_id] = TokenBucket(self._global_rate, self._global_rate)
+        return bucket
+
+    def _chat_bucket(self, chat_id: Hashable) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(
+                self._per_chat_rate, self._per_chat_burst
+            )
+        return bucket
+
+    def _next_ready(self, now: float):
+        """Primer trabajo (por prioridad) cuyo chat y bucket global permiten enviar."""
+        global_waits: Dict[int, float] = {}
+        wait = float("inf")
+        for index, job in enumerate(self._pending):
+            if job.chat_id in self._in_flight:
+                continue
+            if job.bot_id not in global_waits:
+                global_waits[job.bot_id] = self._global_bucket(job.bot_id).delay(now)
+            job_wait = max(global_waits[job.bot_id], self._chat_bucket(job.chat_id).delay(now))
+            if job_wait == 0:
+                return index, 0.0
+            wait = min(wait, job_wait)
+        return None, wait
+
+    async def _run(self) -> None:
+        while True:
+            now = time.monotonic()
+            index, wait = self._next_ready(now)
+            if index is None:
+                self._wakeup.clear()
+                try:
+                    timeout = None if wait == float("inf") else wait
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            job = self._pending.pop(index)
+            if job.coalesce_key is not None:
+                self._by_key.pop(job.coalesce_key, None)
+            self._global_bucket(job.bot_id).take(now)
+            self._chat_bucket(job.chat_id).take(now)
+            self._in_flight.add(job.chat_id)
+            task = asyncio.create_task(self._execute(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+            self._dispatched += 1
+            if self._dispatched % 1000 == 0:
+                self._prune(now)
+
+    async def _execute(self, job: _Job) -> None:
+        try:
+            result = await job.factory()
+        except RetryAfter as e:
+            seconds = _retry_seconds(e)
+            logger.warning("RetryAfter de {}s en chat {}; reintentando", seconds, job.chat_id)
+            self._chat_bucket(job.chat_id).block(seconds)
+            self._requeue(job)
+            return
+        except Exception as e:
+            for future in job.futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self._in_flight.discard(job.chat_id)
+            if self._wakeup:
+                self._wakeup.set()
+        for future in job.futures:
+            if not future.done():
+                future.set_result(result)
+
+    def _requeue(self, job: _Job) -> None:
+        newer = self._by_key.get(job.coalesce_key) if job.coalesce_key is not None else None
+        if newer is not None:
+            # Una edición más reciente del mismo mensaje ya está en cola
+            newer.futures.extend(job.futures)
+            return
+        bisect.insort(self._pending, job)
+        if job.coalesce_key is not None:
+            self._by_key[job.coalesce_key] = job
+
+    def _prune(self, now: float) -> None:
+        busy = {job.chat_id for job in self._pending} | self._in_flight
+        for chat_id in [c for c, b in self._chats.items() if c not in busy and b.idle(now)]:
+            del self._chats[chat_id]
+
+
+# Instancia compartida por los handlers; se inicia/detiene en bot/main.py
+outbox = OutboundScheduler()
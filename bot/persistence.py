@@ -0,0 +1,230 @@
+"""
+Persistencia de ``user_data``, ``chat_data`` y conversaciones en SQLite.
+
+``PicklePersistence`` serializa los diccionarios completos en cada volcado;
+con muchos usuarios eso cuesta O(usuarios) aunque solo hayan cambiado unos
+pocos. ``SQLitePersistence`` guarda una fila por clave en ``bot_persistence``
+de ``data/bot.db``:
+
+- Cada entrada se serializa con pickle y se compara con lo último escrito;
+  si no cambió, no se escribe.
+- Las entradas modificadas se acumulan y se escriben juntas en una sola
+  transacción, en un hilo aparte, al terminar cada ronda de
+  ``Application.update_persistence``.
+- ``flush`` (al apagar) espera a que termine la escritura pendiente.
+
+``bot_data`` no se persiste: guarda tareas y objetos de la ejecución actual.
+
+Con varios bots en el proceso (``bot.tenancy``) cada uno tiene su propia
+instancia; los tipos de los bots secundarios llevan el prefijo
+``"<bot_id>:"`` y los del principal conservan su nombre.
+"""
+
+import asyncio
+import json
+import pickle
+import sqlite3
+import time
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from loguru import logger
+from telegram.ext import BasePersistence, PersistenceInput
+
+# Use relative imports when running as module, absolute when running directly
+try:
+    from bot import database
+except ImportError:
+    # Fallback to relative imports when running as module
+    from . import database
+
+USER = "user"
+CHAT = "chat"
+# Las conversaciones se guardan como "conversation:<nombre del handler>"
+CONVERSATION = "conversation:"
+
+Key = Tuple[str, str]
+
+
+def _connect() -> sqlite3.Connection:
+    return sqlite3.connect(database.DB_PATH, timeout=30, isolation_level=None)
+
+
+def init_persistence_table() -> None:
+    """Crea la tabla de persistencia si no existe."""
+    conn = _connect()
+    try:
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS bot_persistence (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            data BLOB NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (kind, key)
+        )
+        """)
+    finally:
+        conn.close()
+
+
+def write_entries(batch: Dict[Key, Optional[bytes]]) -> None:
+    """Escribe (o borra, si el valor es None) un lote de entradas en una transacción."""
+    if not batch:
+        return
+    now = time.time()
+    upserts = [(kind, key, data, now) for (kind, key), data in batch.items() if data is not None]
+    deletes = [(kind, key) for (kind, key), data in batch.items() if data is None]
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany(
+            "INSERT INTO bot_persistence (kind, key, data, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(kind, key) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+            upserts,
+        )
+        conn.executemany("DELETE FROM bot_persistence WHERE kind = ? AND key = ?", deletes)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def read_entries(kind: str) -> Dict[str, bytes]:
+    conn = _connect()
+    try:
+        return dict(conn.execute("SELECT key, data FROM bot_persistence WHERE kind = ?", (kind,)))
+    finally:
+        conn.close()
+
+
+def _conversation_key(key: Tuple[Hashable, ...]) -> str:
+    return json.dumps(list(key))
+
+
+class SQLitePersistence(BasePersistence):
+    """
+    ``BasePersistence`` incremental sobre ``data/bot.db``.
+
+    Args:
+        update_interval: Segundos entre rondas de ``update_persistence``
+        bot_id: Espacio de nombres del bot dueño de los datos
+    """
+
+    def __init__(self, update_interval: float = 60, bot_id: int = 0) -> None:
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, callback_data=False),
+            update_interval=update_interval,
+        )
+        # Huella de lo último escrito por clave, para descartar entradas sin cambios
+        self._digests: Dict[Key, int] = {}
+        self._dirty: Dict[Key, Optional[bytes]] = {}
+        self._writer: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self._namespace = f"{bot_id}:" if bot_id else ""
+
+    # ------------------------------------------------------------------ lectura
+
+    async def _load(self, kind: str) -> Dict[str, Any]:
+        kind = self._namespace + kind
+        rows = await asyncio.to_thread(read_entries, kind)
+        loaded = {}
+        for key, blob in rows.items():
+            try:
+                loaded[key] = pickle.loads(blob)
+            except Exception as e:
+                logger.warning("Entrada de persistencia ilegible {}:{}: {}", kind, key, str(e))
+                continue
+            self._digests[(kind, key)] = hash(blob)
+        return loaded
+
+    async def get_user_data(self) -> Dict[int, Dict]:
+        return {int(key): data for key, data in (await self._load(USER)).items()}
+
+    async def get_chat_data(self) -> Dict[int, Dict]:
+        return {int(key): data for key, data in (await self._load(CHAT)).items()}
+
+    async def get_bot_data(self) -> Dict:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def get_conversations(self, name: str) -> Dict:
+        loaded = await self._load(CONVERSATION + name)
+        return {tuple(json.loads(key)): state for key, state in loaded.items()}
+
+    # ---------------------------------------------------------------- escritura
+
+    def _mark(self, kind: str, key: str, data: Any) -> None:
+        entry = (self._namespace + kind, key)
+        if data is None:
+            if entry in self._digests or entry in self._dirty:
+                self._digests.pop(entry, None)
+                self._dirty[entry] = None
+        else:
+            blob = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+            digest = hash(blob)
+            if self._digests.get(entry) == digest:
+                return
+            self._digests[entry] = digest
+            self._dirty[entry] = blob
+        self._schedule_write()
+
+    def _schedule_write(self) -> None:
+        # update_persistence lanza todas las actualizaciones con gather: la
+        # tarea corre después de ellas y escribe la ronda en un solo lote
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._write_pending())
+
+    async def _write_pending(self) -> None:
+        async with self._lock:
+            while self._dirty:
+                batch, self._dirty = self._dirty, {}
+                try:
+                    await asyncio.to_thread(write_entries, batch)
+                except Exception as e:
+                    logger.error("Error al escribir la persistencia ({} entradas): {}", len(batch), str(e))
+                    # Se reintenta en la siguiente ronda sin pisar cambios más nuevos
+                    for entry, blob in batch.items():
+                        self._dirty.setdefault(entry, blob)
+                        self._digests.pop(entry, None)
+                    return
+                logger.debug("Persistencia: {} entradas escritas", len(batch))
+
+    async def update_user_data(self, user_id: int, data: Dict) -> None:
+        self._mark(USER, str(user_id), data or None)
+
+    async def update_chat_data(self, chat_id: int, data: Dict) -> None:
+        self._mark(CHAT, str(chat_id), data or None)
+
+    async def update_bot_data(self, data: Dict) -> None:
+        pass
+
+    async def update_callback_data(self, data: Any) -> None:
+        pass
+
+    async def update_conversation(
+        self, name: str, key: Tuple[Hashable, ...], new_state: Optional[object]
+    ) -> None:
+        self._mark(CONVERSATION + name, _conversation_key(key), new_state)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._mark(USER, str(user_id), None)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._mark(CHAT, str(chat_id), None)
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: Dict) -> None:
+        pass
+
+    async def flush(self) -> None:
+        if self._writer is not None:
+            await self._writer
+        await self._write_pending()
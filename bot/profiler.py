@@ -0,0 +1,238 @@
+"""
+Perfilado por muestreo del bot en marcha (``/profile``, solo administradores).
+
+- ``SamplingProfiler`` lee cada ``interval`` segundos la pila de todos los
+  hilos con ``sys._current_frames()``: el del event loop y los del executor
+  (``asyncio.to_thread``, llamadas al LLM, SQLite). No instala hooks de
+  traza, así que el coste es proporcional a la frecuencia de muestreo y no
+  al código que se ejecuta, y se puede activar sin reiniciar.
+- El resultado se escribe en formato de pilas colapsadas (``a;b;c 12``), el
+  que aceptan ``flamegraph.pl``, speedscope o inferno. Los hilos de un mismo
+  pool se agrupan bajo un solo nombre.
+- ``describe_tasks`` resume las tareas de asyncio y la cadena de corutinas
+  que cada una está esperando; complementa el muestreo, que solo ve el hilo
+  del loop cuando está ocupado y no lo que está pendiente.
+"""
+
+import asyncio
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from types import CodeType, FrameType
+from typing import Awaitable, Callable, Dict, List, Optional
+
+# Límites de /profile: una ventana más larga no aporta y retiene al hilo
+DEFAULT_SECONDS = 10
+MAX_SECONDS = 120
+
+# "asyncio_3", "ThreadPoolExecutor-0_1" -> un nodo por pool en el flamegraph
+_POOL_SUFFIX = re.compile(r"_\d+$")
+
+
+def _label(code: CodeType, lineno: Optional[int] = None) -> str:
+    name = getattr(code, "co_qualname", code.co_name)
+    where = os.path.basename(code.co_filename)
+    line = code.co_firstlineno if lineno is None else lineno
+    # ";" separa marcos en el formato colapsado
+    return f"{name} ({where}:{line})".replace(";", ":")
+
+
+@dataclass
+class Profile:
+    """Muestras agregadas por pila (raíz primero)."""
+
+    seconds: float
+    interval: float
+    samples: int = 0
+    stacks: Counter = field(default_factory=Counter)
+
+    def collapsed(self) -> str:
+        """Pilas colapsadas, una por línea, de la más frecuente a la menos."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def top_functions(self, limit: int = 10) -> List[tuple]:
+        """``(marco, muestras)`` de las funciones en la cima de la pila."""
+        leaves: Counter = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        return leaves.most_common(limit)
+
+
+class SamplingProfiler:
+    """
+    Args:
+        interval: Segundos entre muestras (5 ms por defecto, ~200 Hz)
+        max_depth: Marcos como máximo por pila, contando desde la cima
+        include_idle: Si False, descarta las muestras de hilos bloqueados
+            esperando trabajo (selector del loop, cola del executor)
+    """
+
+    # Marcos en la cima de la pila de un hilo sin trabajo. Un hilo esperando
+    # la red (llamada al LLM) sí cuenta: es tiempo de respuesta
+    IDLE = ("select", "wait", "_worker", "get")
+
+    def __init__(self, interval: float = 0.005, max_depth: int = 64, include_idle: bool = False) -> None:
+        self.interval = interval
+        self.max_depth = max_depth
+        self.include_idle = include_idle
+
+    def _thread_names(self) -> Dict[int, str]:
+        return {
+            thread.ident: _POOL_SUFFIX.sub("", thread.name)
+            for thread in threading.enumerate()
+            if thread.ident is not None
+        }
+
+    def _stack(self, frame: Optional[FrameType]) -> List[str]:
+        stack = []
+        while frame is not None and len(stack) < self.max_depth:
+            stack.append(_label(frame.f_code))
+            frame = frame.f_back
+        stack.reverse()
+        return stack
+
+    def _idle(self, frame: FrameType) -> bool:
+        # El marco Python de la cima es el que llamó a la función C bloqueante
+        code = frame.f_code
+        return code.co_name in self.IDLE and code.co_filename.endswith(
+            ("selectors.py", "threading.py", "thread.py", "queue.py")
+        )
+
+    def sample(self, profile: Profile, names: Dict[int, str]) -> None:
+        """Añade una muestra de todos los hilos salvo el que perfila."""
+        me = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == me or (not self.include_idle and self._idle(frame)):
+                continue
+            thread = names.get(ident) or f"thread-{ident}"
+            profile.stacks[";".join([thread, *self._stack(frame)])] += 1
+        profile.samples += 1
+
+    def run(self, seconds: float, stop: Optional[threading.Event] = None) -> Profile:
+        """
+        Muestrea durante ``seconds`` en el hilo actual (bloqueante: desde el
+        loop, llamarlo con ``asyncio.to_thread``).
+        """
+        stop = stop or threading.Event()
+        profile = Profile(seconds=seconds, interval=self.interval)
+        names = self._thread_names()
+        deadline = time.monotonic() + seconds
+        next_sample = time.monotonic()
+        while not stop.is_set():
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            if now >= next_sample:
+                self.sample(profile, names)
+                # Los hilos nuevos del executor aparecen con la carga
+                if profile.samples % 100 == 0:
+                    names = self._thread_names()
+                next_sample = now + self.interval
+            stop.wait(max(min(next_sample, deadline) - time.monotonic(), 0.0))
+        return profile
+
+
+# ---------------------------------------------------------------- asyncio
+
+
+def _awaiting(awaitable) -> List[str]:
+    """Cadena de corutinas desde ``awaitable`` hasta lo que está esperando."""
+    chain = []
+    current = awaitable
+    while current is not None and len(chain) < 64:
+        frame = getattr(current, "cr_frame", None) or getattr(current, "gi_frame", None)
+        code = getattr(current, "cr_code", None) or getattr(current, "gi_code", None)
+        if code is None:
+            # Future, Task u otro awaitable de bajo nivel: fin de la cadena
+            if isinstance(current, asyncio.Task):
+                chain.append(f"<Task {current.get_name()}>")
+            else:
+                # Los Future de la extensión C se esperan a través de FutureIter
+                chain.append(f"<{type(current).__name__.replace('FutureIter', 'Future')}>")
+            break
+        chain.append(_label(code, frame.f_lineno if frame is not None else None))
+        current = getattr(current, "cr_await", None) or getattr(current, "gi_yieldfrom", None)
+    return chain
+
+
+def describe_tasks(loop: Optional[asyncio.AbstractEventLoop] = None) -> str:
+    """
+    Instantánea de las tareas del loop: nombre, estado y qué esperan. Debe
+    llamarse desde el hilo del loop.
+    """
+    tasks = sorted(asyncio.all_tasks(loop), key=lambda task: task.get_name())
+    current = asyncio.current_task(loop)
+    lines = [f"{len(tasks)} tareas ({time.strftime('%Y-%m-%d %H:%M:%S')})", ""]
+    for task in tasks:
+        state = "en ejecución" if task is current else "esperando"
+        lines.append(f"{task.get_name()} [{state}]")
+        for depth, step in enumerate(_awaiting(task.get_coro())):
+            lines.append(f"{'  ' * (depth + 1)}{step}")
+        lines.append("")
+    return "\n".join(lines)
+
+
+# ---------------------------------------------------------------- /profile
+
+_running = False
+
+
+@dataclass
+class ProfileReport:
+    profile: Profile
+    tasks: str
+
+    def summary(self) -> str:
+        lines = [
+            f"🔥 Perfil de {self.profile.seconds:g} s: {self.profile.samples} muestras "
+            f"cada {self.profile.interval * 1000:g} ms"
+        ]
+        total = sum(self.profile.stacks.values()) or 1
+        for frame, count in self.profile.top_functions(8):
+            lines.append(f"{count * 100 / total:5.1f}% {frame}")
+        return "\n".join(lines)
+
+
+def is_busy() -> bool:
+    """Si ya hay un perfil en curso (uno a la vez por proceso)."""
+    return _running
+
+
+async def profile_running_bot(
+    seconds: float,
+    profiler: Optional[SamplingProfiler] = None,
+    on_start: Optional[Callable[[], Awaitable]] = None,
+) -> ProfileReport:
+    """
+    Muestrea los hilos del proceso durante ``seconds`` sin detener el loop y
+    toma la instantánea de tareas a mitad de la ventana.
+
+    Args:
+        on_start: Se espera una vez reservado el perfilador, antes de
+            muestrear; si ya había un perfil en curso no se llama
+
+    Raises:
+        RuntimeError: Si ya hay un perfil en curso
+    """
+    global _running
+    if _running:
+        raise RuntimeError("Ya hay un perfil en curso")
+    _running = True
+    profiler = profiler or SamplingProfiler()
+    stop = threading.Event()
+    try:
+        if on_start is not None:
+            await on_start()
+        sampling = asyncio.ensure_future(asyncio.to_thread(profiler.run, seconds, stop))
+        await asyncio.sleep(seconds / 2)
+        tasks = describe_tasks()
+        profile = await sampling
+    finally:
+        # Si /profile se cancela, el hilo de muestreo termina enseguida
+        stop.set()
+        _running = False
+    return ProfileReport(profile=profile, tasks=tasks)
@@ -0,0 +1,261 @@
+"""
+Renderizado de respuestas del modelo para Telegram.
+
+``render_markdown`` convierte el Markdown típico de un LLM a HTML de Telegram
+en una sola pasada y ``split_html`` lo divide en trozos de como máximo 4096
+unidades UTF-16, cortando solo entre líneas y nunca dentro de una entidad.
+Si un bloque de código no cabe en un mensaje se cierra y se reabre el ``<pre>``.
+"""
+
+import html
+import re
+from typing import List, Optional, Tuple
+
+from loguru import logger
+from telegram.error import BadRequest
+
+# Use relative imports when running as module, absolute when running directly
+try:
+    from bot.outbox import outbox, FINAL
+except ImportError:
+    # Fallback to relative imports when running as module
+    from .outbox import outbox, FINAL
+
+TELEGRAM_MAX_CHARS = 4096
+
+_FENCE = re.compile(r"^\s*```\s*([\w+#.-]*)\s*$")
+_HEADING = re.compile(r"^\s{0,3}#{1,6}\s+(.*?)\s*#*\s*$")
+_BULLET = re.compile(r"^(\s*)[-*+]\s+(.*)$")
+_INLINE = re.compile(
+    r"`(?P<code>[^`\n]+)`"
+    r"|\*\*(?P<bold>.+?)\*\*"
+    r"|__(?P<bold2>.+?)__"
+    r"|~~(?P<strike>.+?)~~"
+    r"|\[(?P<label>[^\]\n]+)\]\((?P<url>https?://[^)\s]+)\)"
+    r"|(?<![\w*])\*(?=\S)(?P<italic>.+?)(?<=\S)\*(?![\w*])"
+    r"|(?<![\w_])_(?=\S)(?P<italic2>.+?)(?<=\S)_(?![\w_])"
+)
+_TAG = re.compile(r"<[^>]+>")
+
+# Un bloque es (html, raw, es_código, lenguaje)
+Block = Tuple[str, str, bool, str]
+
+
+def utf16_len(text: str) -> int:
+    """Longitud tal como la cuenta Telegram (unidades UTF-16)."""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def render_inline(text: str) -> str:
+    """Convierte el Markdown en línea a HTML escapando el resto del texto."""
+    out = []
+    pos = 0
+    for match in _INLINE.finditer(text):
+        out.append(html.escape(text[pos : match.start()], quote=False))
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "code":
+            out.append(f"<code>{html.escape(value, quote=False)}</code>")
+        elif kind in ("bold", "bold2"):
+            out.append(f"<b>{render_inline(value)}</b>")
+        elif kind == "strike":
+            out.append(f"<s>{render_inline(value)}</s>")
+        elif kind == "url":
+            label = render_inline(match.group("label"))
+            out.append(f'<a href="{html.escape(value)}">{label}</a>')
+        else:
+            out.append(f"<i>{render_inline(value)}</i>")
+        pos = match.end()
+    out.append(html.escape(text[pos:], quote=False))
+    return "".join(out)
+
+
+def _pre(code: str, language: str) -> str:
+    escaped = html.escape(code, quote=False)
+    if language:
+        return f'<pre><code class="language-{html.escape(language)}">{escaped}</code></pre>'
+    return f"<pre>{escaped}</pre>"
+
+
+def _blocks(markdown: str) -> List[Block]:
+    """Recorre el texto una sola vez y produce bloques indivisibles."""
+    blocks: List[Block] = []
+    code_lines: List[str] = []
+    language = ""
+    in_code = False
+
+    for line in markdown.splitlines():
+        fence = _FENCE.match(line)
+        if fence and not in_code:
+            in_code, language, code_lines = True, fence.group(1), []
+            continue
+        if in_code:
+            if fence and not fence.group(1):
+                code = "\n".join(code_lines)
+                blocks.append((_pre(code, language), code, True, language))
+                in_code = False
+            else:
+                code_lines.append(line)
+            continue
+
+        heading = _HEADING.match(line)
+        bullet = _BULLET.match(line)
+        if heading:
+            rendered = f"<b>{render_inline(heading.group(1))}</b>"
+        elif bullet:
+            rendered = f"{bullet.group(1)}• {render_inline(bullet.group(2))}"
+        else:
+            rendered = render_inline(line)
+        blocks.append((rendered, line, False, ""))
+
+    if in_code:
+        # Bloque sin cerrar: se cierra al final del texto
+        code = "\n".join(code_lines)
+        blocks.append((_pre(code, language), code, True, language))
+    return blocks
+
+
+def render_markdown(markdown: str) -> str:
+    """Convierte Markdown de LLM a HTML de Telegram."""
+    return "\n".join(block[0] for block in _blocks(markdown))
+
+
+def _escaped_len(text: str) -> int:
+    return utf16_len(html.escape(text, quote=False))
+
+
+def _split_raw(raw: str, limit: int, first_limit: Optional[int] = None) -> List[str]:
+    """
+    Divide texto sin formato en trozos cuya versión escapada mide como mucho
+    ``limit`` (``first_limit`` para el primero), prefiriendo cortar en espacios
+    para no partir palabras ni entidades HTML (se corta antes de escapar).
+    """
+    pieces = []
+    budget = limit if first_limit is None else first_limit
+    while raw:
+        if _escaped_len(raw) <= budget:
+            pieces.append(raw)
+            break
+        lo, hi = 0, len(raw)
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if _escaped_len(raw[:mid]) <= budget:
+                lo = mid
+            else:
+                hi = mid - 1
+        cut = lo
+        space = raw.rfind(" ", cut // 2, cut)
+        if space > 0:
+            cut = space + 1
+        if cut:
+            pieces.append(raw[:cut])
+            raw = raw[cut:]
+        else:
+            pieces.append("")
+        budget = limit
+    return pieces
+
+
+def _split_block(block: Block, limit: int, first_room: int) -> List[str]:
+    """
+    Parte un bloque que no cabe en un mensaje. El primer trozo mide como
+    mucho ``first_room`` para aprovechar el hueco del mensaje en curso.
+    """
+    rendered, raw, is_code, language = block
+    if not is_code:
+        # Línea enorme: se sacrifica el formato en línea antes que el límite
+        pieces = _split_raw(raw, limit, first_room)
+        return [html.escape(piece, quote=False) for piece in pieces]
+
+    # Bloque de código enorme: se cierra y reabre <pre> entre mensajes
+    overhead = utf16_len(_pre("", language))
+    room = first_room - overhead
+    parts, current = [], []
+    for line in raw.split("\n"):
+        for piece in _split_raw(line, limit - overhead, max(room, 1)) or [""]:
+            if current and _escaped_len("\n".join(current + [piece])) > room:
+                parts.append(_pre("\n".join(current), language))
+                current = []
+                room = limit - overhead
+            current.append(piece)
+    if current:
+        parts.append(_pre("\n".join(current), language))
+    return parts
+
+
+def split_html(markdown: str, limit: int = TELEGRAM_MAX_CHARS, prefix: str = "") -> List[str]:
+    """
+    Renderiza y empaqueta el texto en el mínimo de mensajes posible.
+
+    Args:
+        markdown: Respuesta del modelo
+        limit: Tamaño máximo de cada mensaje (unidades UTF-16)
+        prefix: Texto HTML que encabeza el primer mensaje
+
+    Returns:
+        Lista de trozos HTML válidos por sí mismos
+    """
+    chunks: List[str] = []
+    current = prefix
+    for block in _blocks(markdown):
+        pieces = [block[0]]
+        if utf16_len(block[0]) > limit:
+            # Se rellena el hueco del mensaje actual antes de abrir otro
+            room = limit - utf16_len(current) - 1 if current else limit
+            pieces = [p for p in _split_block(block, limit, room if room >= 64 else limit) if p]
+        for piece in pieces:
+            candidate = f"{current}\n{piece}" if current else piece
+            if current and utf16_len(candidate) > limit:
+                chunks.append(current)
+                current = piece
+            else:
+                current = candidate
+    if current.strip():
+        chunks.append(current)
+    return chunks or [prefix or "…"]
+
+
+def html_to_plain(text: str) -> str:
+    """Quita las etiquetas HTML para reenviar un trozo sin formato."""
+    return html.unescape(_TAG.sub("", text))
+
+
+async def send_rendered(
+    bot, chat_id: int, message_id: int, output: str, prefix: str = "🤖 Respuesta:\n"
+) -> int:
+    """
+    Envía la respuesta editando el mensaje de progreso con el primer trozo
+    y enviando el resto en orden.
+
+    Si Telegram rechaza el HTML de un trozo, solo ese trozo se reenvía como
+    texto plano; la respuesta del modelo nunca se vuelve a pedir.
+
+    Args:
+        prefix: Encabezado HTML del primer trozo
+
+    Returns:
+        Número de llamadas realizadas a la Bot API
+    """
+    chunks = split_html(output, prefix=prefix)
+    calls = 0
+    for index, chunk in enumerate(chunks):
+
+        async def _send(text: str, parse_mode):
+            if index == 0:
+                return await outbox.edit_message_text(
+                    bot, chat_id, message_id, text, priority=FINAL, parse_mode=parse_mode
+                )
+            return await outbox.send_message(
+                bot, chat_id, text, priority=FINAL, parse_mode=parse_mode
+            )
+
+        try:
+            calls += 1
+            await _send(chunk, "HTML")
+        except BadRequest as e:
+            if "parse" not in str(e).lower():
+                raise
+            logger.warning("HTML rechazado por Telegram, reenviando sin formato: {}", str(e))
+            calls += 1
+            await _send(html_to_plain(chunk), None)
+    return calls
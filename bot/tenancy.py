@@ -0,0 +1,99 @@
+"""
+Varios bots en un mismo proceso.
+
+Cada bot tiene un espacio de nombres (``bot_id``) que separa su estado en
+SQLite: configuración de usuarios, trabajos, ``user_data``/``chat_data``,
+historial de conversación y memoria de documentos. El bot principal
+(``TELEGRAM_TOKEN``) usa el espacio 0 y conserva los datos existentes; los
+demás usan el id numérico de su token (la parte anterior a ``:``).
+
+El bot que atiende la tarea actual viaja en ``current_bot`` (un
+``ContextVar``): ``TenantApplication`` lo fija para cada update y la cola de
+trabajos para cada trabajo, así que las funciones de ``bot.database`` y
+compañía no necesitan recibirlo como argumento. Las tareas creadas durante
+el update heredan el valor.
+
+Los clientes HTTP del LLM, el registro de capacidades y las cachés se
+comparten entre todos los bots.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, List, Optional, Tuple, Type, Union
+
+PRIMARY_BOT = 0
+
+current_bot: ContextVar[int] = ContextVar("current_bot", default=PRIMARY_BOT)
+
+
+def bot_namespace(token: str, primary_token: Optional[str] = None) -> int:
+    """Espacio de nombres de un token: 0 para el principal, su id para el resto."""
+    if primary_token and token == primary_token:
+        return PRIMARY_BOT
+    bot_id, _, secret = token.partition(":")
+    if not bot_id.isdigit() or not secret:
+        raise ValueError("Token de Telegram inválido en TELEGRAM_TOKENS")
+    return int(bot_id)
+
+
+def hosted_bots(primary_token: Optional[str], tokens: Tuple[str, ...] = ()) -> List[Tuple[int, str]]:
+    """
+    ``(bot_id, token)`` de todos los bots a servir, el principal primero y
+    sin repetidos. Sin ``TELEGRAM_TOKEN``, el primero de ``TELEGRAM_TOKENS``
+    hace de principal.
+
+    Raises:
+        ValueError: Si dos tokens comparten espacio de nombres
+    """
+    primary_token = primary_token or (tokens[0] if tokens else None)
+    bots: List[Tuple[int, str]] = []
+    seen = set()
+    for token in ([primary_token] if primary_token else []) + list(tokens):
+        if token in seen:
+            continue
+        seen.add(token)
+        namespace = bot_namespace(token, primary_token)
+        if any(namespace == existing for existing, _ in bots):
+            raise ValueError(f"Bot {namespace} repetido en TELEGRAM_TOKENS")
+        bots.append((namespace, token))
+    return bots
+
+
+def scoped_id(value: int) -> Union[int, str]:
+    """
+    Clave de un chat o usuario en los almacenes compartidos con ``core``: el
+    propio id para el bot principal y ``"<bot_id>_<id>"`` para los demás.
+    """
+    bot_id = current_bot.get()
+    return value if bot_id == PRIMARY_BOT else f"{bot_id}_{value}"
+
+
+@contextmanager
+def use_bot(bot_id: int) -> Iterator[None]:
+    token = current_bot.set(bot_id)
+    try:
+        yield
+    finally:
+        current_bot.reset(token)
+
+
+_application_class: Optional[Type] = None
+
+
+def tenant_application_class() -> Type:
+    """
+    Subclase de ``Application`` que fija ``current_bot`` mientras procesa
+    cada update. Se crea bajo demanda para no importar ``telegram.ext`` al
+    importar este módulo.
+    """
+    global _application_class
+    if _application_class is None:
+        from telegram.ext import Application
+
+        class TenantApplication(Application):
+            async def process_update(self, update: object) -> None:
+                with use_bot(self.bot_data.get("bot_id", PRIMARY_BOT)):
+                    await super().process_update(update)
+
+        _application_class = TenantApplication
+    return _application_class
@@ -0,0 +1,326 @@
+"""
+Grabación anonimizada de tráfico entrante y reproducción para pruebas de carga.
+
+El grabador se registra como ``TypeHandler`` en el grupo -1 (ver ``bot/main.py``)
+y escribe una línea JSON por Update:
+
+    {"t": 1.234, "u": 17, "c": "9f..", "f": "9f..", "k": "text", "x": "xxxx xx"}
+
+- ``t``: segundos desde el inicio de la grabación
+- ``c``/``f``: hash del chat y del usuario (blake2b con sal)
+- ``k``: tipo (``text``, ``command``, ``photo``, ``callback``, ``other``)
+- ``x``: texto reemplazado por un marcador de la misma longitud
+- ``p``: metadatos de la foto (ancho, alto, bytes), nunca el archivo
+- ``g``: hash del ``media_group_id`` para álbumes
+
+Reproducción:
+    python -m bot.traffic replay traffic.jsonl --speed 10
+    python -m bot.traffic replay traffic.jsonl --speed max --webhook-url http://localhost:8443/bot
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Union
+
+from loguru import logger
+
+Event = Dict[str, Any]
+Sink = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+def placeholder(text: str) -> str:
+    """Reemplaza cada carácter no blanco por ``x`` conservando longitud y espacios."""
+    return "".join(ch if ch.isspace() else "x" for ch in text)
+
+
+def anonymize_text(text: str) -> str:
+    """Conserva el nombre del comando (``/set_model``) y oculta sus argumentos."""
+    if text.startswith("/"):
+        command, sep, rest = text.partition(" ")
+        return command + sep + placeholder(rest)
+    return placeholder(text)
+
+
+class TrafficRecorder:
+    """
+    Grabador opt-in de Updates entrantes.
+
+    Args:
+        path: Archivo JSONL de salida (se abre en modo append)
+        salt: Sal para los hashes; si se omite se genera una por ejecución,
+            de modo que los IDs no se pueden correlacionar entre grabaciones
+        flush_every: Número de eventos entre flushes a disco
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        salt: Optional[str] = None,
+        flush_every: int = 50,
+    ) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._salt = (salt or os.urandom(16).hex()).encode("utf-8")
+        self._flush_every = flush_every
+        self._pending = 0
+        self._start = time.monotonic()
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def _hash(self, value: Any) -> str:
+        digest = hashlib.blake2b(
+            str(value).encode("utf-8"), key=self._salt[:64], digest_size=8
+        )
+        return digest.hexdigest()
+
+    def to_event(self, update) -> Event:
+        """Convierte un ``telegram.Update`` en un evento anonimizado."""
+        event: Event = {"t": round(time.monotonic() - self._start, 4), "u": update.update_id}
+        chat = update.effective_chat
+        user = update.effective_user
+        if chat:
+            event["c"] = self._hash(chat.id)
+        if user:
+            event["f"] = self._hash(user.id)
+
+        message = update.effective_message
+        if update.callback_query:
+            event["k"] = "callback"
+            event["x"] = update.callback_query.data or ""
+        elif message and message.photo:
+            largest = message.photo[-1]
+            event["k"] = "photo"
+            event["p"] = [largest.width, largest.height, largest.file_size or 0]
+            if message.caption:
+                event["x"] = placeholder(message.caption)
+            if message.media_group_id:
+                event["g"] = self._hash(message.media_group_id)
+        elif message and message.text:
+            event["k"] = "command" if message.text.startswith("/") else "text"
+            event["x"] = anonymize_text(message.text)
+        else:
+            event["k"] = "other"
+        return event
+
+    async def record(self, update, context) -> None:
+        """Handler de PTB: nunca debe interrumpir el procesamiento normal."""
+        try:
+            self._file.write(json.dumps(self.to_event(update), separators=(",", ":")) + "\n")
+            self._pending += 1
+            if self._pending >= self._flush_every:
+                self._file.flush()
+                self._pending = 0
+        except Exception as e:
+            logger.error("Error al grabar tráfico: {}", str(e))
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self._file.flush()
+            self._file.close()
+
+
+def load_events(path: Union[str, Path]) -> List[Event]:
+    with open(path, encoding="utf-8") as fh:
+        return [json.loads(line) for line in fh if line.strip()]
+
+
+def _hash_to_id(value: str) -> int:
+    # IDs positivos de 47 bits: válidos para Telegram y estables por hash
+    return int(value, 16) & 0x7FFF_FFFF_FFFF
+
+
+def event_to_update(event: Event, update_id: int) -> Dict[str, Any]:
+    """Reconstruye un Update (formato JSON de la Bot API) a partir de un evento."""
+    chat_id = _hash_to_id(event.get("c", "1"))
+    user = {
+        "id": _hash_to_id(event.get("f", "1")),
+        "is_bot": False,
+        "first_name": "replay",
+    }
+    chat = {"id": chat_id, "type": "private"}
+    message: Dict[str, Any] = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": chat,
+        "from": user,
+    }
+    kind = event.get("k")
+    text = event.get("x", "")
+
+    if kind == "callback":
+        return {
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "from": user,
+                "chat_instance": str(chat_id),
+                "data": text,
+                "message": {**message, "text": "replay"},
+            },
+        }
+    if kind == "photo":
+        width, height, size = event.get("p", [0, 0, 0])
+        message["photo"] = [
+            {
+                "file_id": f"replay-{update_id}",
+                "file_unique_id": f"replay-{update_id}",
+                "width": width,
+                "height": height,
+                "file_size": size,
+            }
+        ]
+        if text:
+            message["caption"] = text
+        if event.get("g"):
+            message["media_group_id"] = event["g"]
+    elif kind in ("text", "command"):
+        message["text"] = text
+        if kind == "command":
+            length = len(text.split(" ", 1)[0])
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": length}]
+    return {"update_id": update_id, "message": message}
+
+
+async def replay(
+    events: Iterable[Event],
+    sink: Sink,
+    speed: Optional[float] = 1.0,
+    first_update_id: int = 1,
+) -> int:
+    """
+    Reenvía los eventos a ``sink`` respetando los tiempos entre llegadas.
+
+    Args:
+        events: Eventos en orden de grabación
+        sink: Corutina que recibe el Update en formato JSON
+        speed: Factor de aceleración (1, 10, ...); ``None`` o 0 = máxima velocidad
+        first_update_id: ``update_id`` del primer Update generado
+
+    Returns:
+        Número de Updates enviados
+
+    El orden por chat se preserva siempre: cada chat tiene su propia cola y
+    un único worker, mientras que chats distintos avanzan en paralelo.
+    """
+    queues: Dict[str, asyncio.Queue] = {}
+    workers: List[asyncio.Task] = []
+    sent = 0
+
+    async def _worker(queue: asyncio.Queue) -> None:
+        nonlocal sent
+        while True:
+            payload = await queue.get()
+            try:
+                if payload is None:
+                    return
+                await sink(payload)
+                sent += 1
+            except Exception as e:
+                logger.error("Error al reproducir update: {}", str(e))
+            finally:
+                queue.task_done()
+
+    start = time.monotonic()
+    for offset, event in enumerate(events):
+        if speed:
+            delay = event.get("t", 0) / speed - (time.monotonic() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        chat_key = event.get("c", "")
+        queue = queues.get(chat_key)
+        if queue is None:
+            queue = queues[chat_key] = asyncio.Queue()
+            workers.append(asyncio.create_task(_worker(queue)))
+        queue.put_nowait(event_to_update(event, first_update_id + offset))
+
+    for queue in queues.values():
+        queue.put_nowait(None)
+    await asyncio.gather(*workers)
+    return sent
+
+
+def webhook_sink(url: str, secret_token: Optional[str] = None) -> Sink:
+    """Sink que publica cada Update en el webhook de un bot en ejecución."""
+    import httpx
+
+    client = httpx.AsyncClient(timeout=30)
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret_token} if secret_token else {}
+
+    async def _send(payload: Dict[str, Any]) -> None:
+        response = await client.post(url, json=payload, headers=headers)
+        response.raise_for_status()
+
+    return _send
+
+
+def application_sink(application) -> Sink:
+    """Sink que inyecta los Updates en la cola de una ``Application`` en proceso."""
+    from telegram import Update
+
+    async def _send(payload: Dict[str, Any]) -> None:
+        await application.update_queue.put(Update.de_json(payload, application.bot))
+
+    return _send
+
+
+def _fresh_update_id() -> int:
+    # Los trabajos se deduplican por update_id: cada reproducción usa un rango nuevo
+    return int(time.time() * 1000)
+
+
+async def _replay_in_process(events: List[Event], speed: Optional[float], bot_api_url: Optional[str]) -> int:
+    from bot.config import load_config
+    from bot.main import build_application, init_storage
+
+    settings = load_config()
+    init_storage()
+    application = build_application(settings.telegram_token, base_url=bot_api_url)
+    async with application:
+        await application.start()
+        # run_polling no se usa aquí, así que los hooks se invocan a mano
+        await application.post_init(application)
+        try:
+            sent = await replay(
+                events, application_sink(application), speed, _fresh_update_id()
+            )
+            # Espera a que la aplicación termine de procesar lo encolado
+            while not application.update_queue.empty():
+                await asyncio.sleep(0.1)
+        finally:
+            await application.stop()
+            await application.post_stop(application)
+    return sent
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Reproduce tráfico grabado contra el bot")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rp = sub.add_parser("replay", help="Reproduce un log de tráfico")
+    rp.add_argument("log", type=Path)
+    rp.add_argument("--speed", default="1", help="1, 10, ... o 'max'")
+    rp.add_argument("--webhook-url", help="Envía los Updates a este webhook en lugar de en proceso")
+    rp.add_argument("--secret-token", help="Secret token del webhook, si aplica")
+    rp.add_argument(
+        "--bot-api-url",
+        help="Base URL de un servidor Bot API local/mock para las respuestas (modo en proceso)",
+    )
+    args = parser.parse_args(argv)
+
+    events = load_events(args.log)
+    speed = None if args.speed == "max" else float(args.speed)
+    started = time.monotonic()
+    if args.webhook_url:
+        sink = webhook_sink(args.webhook_url, args.secret_token)
+        sent = asyncio.run(replay(events, sink, speed, _fresh_update_id()))
+    else:
+        sent = asyncio.run(_replay_in_process(events, speed, args.bot_api_url))
+    print(f"{sent}/{len(events)} updates reproducidos en {time.monotonic() - started:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,216 @@
+"""
+Contabilidad de uso por usuario con escritura diferida.
+
+Cada solicitud al LLM suma sus contadores en memoria (solicitudes, errores,
+tokens y latencia) agrupados por ``(user_id, día UTC)``. Un bucle en segundo
+plano los vuelca cada pocos segundos en ``usage_daily`` con un único UPSERT
+por lote, y ``stop`` hace el último volcado al apagar. Así una solicitud no
+añade escrituras propias a SQLite y los totales diarios se leen sin recorrer
+filas individuales.
+"""
+
+import asyncio
+import sqlite3
+import time
+from dataclasses import dataclass, astuple, fields
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+# Use relative imports when running as module, absolute when running directly
+try:
+    from bot import database
+except ImportError:
+    # Fallback to relative imports when running as module
+    from . import database
+
+
+@dataclass
+class UsageCounters:
+    requests: int = 0
+    errors: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    total_tokens: int = 0
+    latency_ms_total: int = 0
+    latency_ms_max: int = 0
+
+    def merge(self, other: "UsageCounters") -> None:
+        for field in fields(self):
+            name = field.name
+            if name == "latency_ms_max":
+                self.latency_ms_max = max(self.latency_ms_max, other.latency_ms_max)
+            else:
+                setattr(self, name, getattr(self, name) + getattr(other, name))
+
+
+Key = Tuple[int, str]
+_COLUMNS = [field.name for field in fields(UsageCounters)]
+
+
+def _connect() -> sqlite3.Connection:
+    return sqlite3.connect(database.DB_PATH, timeout=30, isolation_level=None)
+
+
+def today() -> str:
+    return time.strftime("%Y-%m-%d", time.gmtime())
+
+
+def _first_day(days: int) -> str:
+    return time.strftime("%Y-%m-%d", time.gmtime(time.time() - (days - 1) * 86400))
+
+
+def init_usage_table() -> None:
+    """Crea la tabla de totales diarios si no existe."""
+    conn = _connect()
+    try:
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS usage_daily (
+            user_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            requests INTEGER NOT NULL DEFAULT 0,
+            errors INTEGER NOT NULL DEFAULT 0,
+            prompt_tokens INTEGER NOT NULL DEFAULT 0,
+            completion_tokens INTEGER NOT NULL DEFAULT 0,
+            total_tokens INTEGER NOT NULL DEFAULT 0,
+            latency_ms_total INTEGER NOT NULL DEFAULT 0,
+            latency_ms_max INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day)
+        )
+        """)
+    finally:
+        conn.close()
+
+
+def write_counters(batch: Dict[Key, UsageCounters]) -> None:
+    """Suma un lote de contadores a ``usage_daily`` en una sola transacción."""
+    if not batch:
+        return
+    updates = ", ".join(
+        f"{name} = MAX({name}, excluded.{name})"
+        if name == "latency_ms_max"
+        else f"{name} = {name} + excluded.{name}"
+        for name in _COLUMNS
+    )
+    placeholders = ", ".join("?" for _ in range(len(_COLUMNS) + 2))
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany(
+            f"INSERT INTO usage_daily (user_id, day, {', '.join(_COLUMNS)}) "
+            f"VALUES ({placeholders}) ON CONFLICT(user_id, day) DO UPDATE SET {updates}",
+            [(user_id, day, *astuple(counters)) for (user_id, day), counters in batch.items()],
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def read_daily(user_id: int, days: int = 7) -> Dict[str, UsageCounters]:
+    """Totales persistidos de los últimos ``days`` días, por día."""
+    conn = _connect()
+    try:
+        rows = conn.execute(
+            f"SELECT day, {', '.join(_COLUMNS)} FROM usage_daily "
+            "WHERE user_id = ? AND day >= ? ORDER BY day",
+            (user_id, _first_day(days)),
+        ).fetchall()
+    finally:
+        conn.close()
+    return {row[0]: UsageCounters(*row[1:]) for row in rows}
+
+
+class UsageAccountant:
+    """
+    Agrega el uso en memoria y lo persiste por lotes.
+
+    Args:
+        flush_interval: Segundos entre volcados a SQLite
+    """
+
+    def __init__(self, flush_interval: float = 5.0) -> None:
+        self.flush_interval = flush_interval
+        self._pending: Dict[Key, UsageCounters] = {}
+        # Serializa volcados y consultas para no contar un lote dos veces
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def record(
+        self,
+        user_id: int,
+        usage: Optional[Dict[str, Any]] = None,
+        latency: float = 0.0,
+        error: bool = False,
+    ) -> None:
+        """Suma una solicitud; ``usage`` es el que reporta el pipeline."""
+        usage = usage or {}
+        latency_ms = int(latency * 1000)
+        counters = UsageCounters(
+            requests=1,
+            errors=int(error),
+            prompt_tokens=usage.get("prompt_tokens") or usage.get("estimated_prompt_tokens") or 0,
+            completion_tokens=usage.get("completion_tokens") or 0,
+            total_tokens=usage.get("total_tokens") or 0,
+            latency_ms_total=latency_ms,
+            latency_ms_max=latency_ms,
+        )
+        key = (user_id, today())
+        current = self._pending.get(key)
+        if current is None:
+            self._pending[key] = counters
+        else:
+            current.merge(counters)
+
+    def pending(self) -> Dict[Key, UsageCounters]:
+        return dict(self._pending)
+
+    async def flush(self) -> None:
+        """Vuelca lo acumulado; si falla, lo devuelve a memoria para el próximo intento."""
+        async with self._lock:
+            batch, self._pending = self._pending, {}
+            if not batch:
+                return
+            try:
+                await asyncio.to_thread(write_counters, batch)
+            except Exception as e:
+                logger.error("Error al guardar uso: {}", str(e))
+                for key, counters in batch.items():
+                    current = self._pending.setdefault(key, UsageCounters())
+                    current.merge(counters)
+
+    async def daily(self, user_id: int, days: int = 7) -> List[Tuple[str, UsageCounters]]:
+        """Totales por día, incluyendo lo que aún no se volcó."""
+        async with self._lock:
+            totals = await asyncio.to_thread(read_daily, user_id, days)
+            unflushed = list(self._pending.items())
+        first_day = _first_day(days)
+        for (pending_user, day), counters in unflushed:
+            if pending_user == user_id and day >= first_day:
+                totals.setdefault(day, UsageCounters()).merge(counters)
+        return sorted(totals.items())
+
+    async def start(self, flush_interval: Optional[float] = None) -> None:
+        if flush_interval:
+            self.flush_interval = flush_interval
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="usage-flush")
+
+    async def stop(self) -> None:
+        """Detiene el bucle y hace el volcado final."""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+
+# Instancia compartida; se inicia en post_init y se vacía en post_stop
+accountant = UsageAccountant()
@@ -0,0 +1,197 @@
+"""
+Arranque en caliente entre reinicios.
+
+Mientras el bot funciona, ``WarmSet`` recuerda los usuarios activos más
+recientes de todos los bots del proceso (``bot.tenancy``). Al apagar se
+guarda una instantánea compacta en JSON, con cada usuario como
+``[bot_id, user_id]``:
+
+    {"saved_at": 1700000000.0,
+     "users": [[0, 42], [5551234, 17], ...],
+     "endpoints": [{"base_url": "https://api.openai.com/v1", "models": ["gpt-4o"], "users": 12}]}
+
+Al arrancar, ``warm_start`` precarga sus configuraciones en la caché de
+``bot.database`` con consultas por bloques (una tanda por bot), abre las conexiones a los
+endpoints más usados y carga sus capacidades. Las API keys no se escriben
+en la instantánea: se leen de la base de datos al precargar.
+"""
+
+import asyncio
+import json
+import os
+import time
+from collections import Counter, OrderedDict, defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from loguru import logger
+
+# Use relative imports when running as module, absolute when running directly
+try:
+    from bot.database import get_user_config, prefetch_user_configs
+    from bot.tenancy import PRIMARY_BOT, current_bot, use_bot
+    from core.capabilities import registry
+    from core.llm_clients import warm_endpoint
+except ImportError:
+    # Fallback to relative imports when running as module
+    from .database import get_user_config, prefetch_user_configs
+    from .tenancy import PRIMARY_BOT, current_bot, use_bot
+    from ..core.capabilities import registry
+    from ..core.llm_clients import warm_endpoint
+
+
+# (bot_id, user_id)
+BotUser = Tuple[int, int]
+
+
+class WarmSet:
+    """Usuarios activos recientes, del más reciente al más antiguo (acotado)."""
+
+    def __init__(self, max_users: int = 500) -> None:
+        self.max_users = max_users
+        self._users: "OrderedDict[BotUser, None]" = OrderedDict()
+
+    def touch(self, user_id: int, bot_id: Optional[int] = None) -> None:
+        """Marca al usuario como activo en ``bot_id`` (por defecto, el bot actual)."""
+        key = (current_bot.get() if bot_id is None else bot_id, user_id)
+        self._users[key] = None
+        self._users.move_to_end(key, last=False)
+        while len(self._users) > self.max_users:
+            self._users.popitem()
+
+    def users(self) -> List[BotUser]:
+        return list(self._users)
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+
+def _configs(users: Iterable[BotUser]) -> Iterable[Dict]:
+    """Configuración de cada usuario, leída en el espacio de nombres de su bot."""
+    for bot_id, user_id in users:
+        with use_bot(bot_id):
+            yield get_user_config(user_id)
+
+
+def build_snapshot(users: List[BotUser]) -> Dict:
+    """Instantánea sin secretos: usuarios y endpoints ordenados por uso."""
+    endpoints: Counter = Counter()
+    models: Dict[str, Counter] = defaultdict(Counter)
+    for config in _configs(users):
+        base_url = config.get("base_url")
+        if base_url:
+            endpoints[base_url] += 1
+            if config.get("model_name"):
+                models[base_url][config["model_name"]] += 1
+    return {
+        "saved_at": time.time(),
+        "users": [list(user) for user in users],
+        "endpoints": [
+            {"base_url": url, "models": [m for m, _ in models[url].most_common(5)], "users": count}
+            for url, count in endpoints.most_common()
+        ],
+    }
+
+
+def save_snapshot(path: Union[str, Path], warm_set: WarmSet) -> Optional[Dict]:
+    """Escribe la instantánea de forma atómica (archivo temporal + rename)."""
+    if not len(warm_set):
+        return None
+    path = Path(path)
+    snapshot = build_snapshot(warm_set.users())
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(json.dumps(snapshot, separators=(",", ":")), encoding="utf-8")
+    os.replace(tmp, path)
+    logger.info(
+        "Instantánea de arranque guardada: {} usuarios, {} endpoints",
+        len(snapshot["users"]),
+        len(snapshot["endpoints"]),
+    )
+    return snapshot
+
+
+def load_snapshot(path: Union[str, Path], max_age_seconds: float = 7 * 86400) -> Optional[Dict]:
+    path = Path(path)
+    if not path.exists():
+        return None
+    try:
+        snapshot = json.loads(path.read_text(encoding="utf-8"))
+    except Exception as e:
+        logger.warning("Instantánea de arranque ilegible: {}", str(e))
+        return None
+    if time.time() - snapshot.get("saved_at", 0) > max_age_seconds:
+        return None
+    # Instantáneas anteriores a los espacios por bot: ids sueltos del principal
+    snapshot["users"] = [
+        (PRIMARY_BOT, user) if isinstance(user, int) else tuple(user) for user in snapshot.get("users", [])
+    ]
+    return snapshot
+
+
+def _prefetch(users: List[BotUser]) -> int:
+    by_bot: Dict[int, List[int]] = defaultdict(list)
+    for bot_id, user_id in users:
+        by_bot[bot_id].append(user_id)
+    found = 0
+    for bot_id, user_ids in by_bot.items():
+        # La caché de configuraciones va por bot (ver bot/database.py)
+        with use_bot(bot_id):
+            found += prefetch_user_configs(user_ids)
+    return found
+
+
+def _warm_endpoint(base_url: str, users: List[BotUser]) -> bool:
+    # Cualquier usuario del endpoint sirve para autenticar la conexión
+    api_key = next(
+        (
+            config["api_key"]
+            for config in _configs(users)
+            if config.get("base_url") == base_url and config.get("api_key")
+        ),
+        None,
+    )
+    if not api_key:
+        return False
+    registry.refresh(base_url, api_key)
+    return warm_endpoint(api_key, base_url)
+
+
+async def warm_start(
+    path: Union[str, Path], warm_set: Optional[WarmSet] = None, top_endpoints: int = 3
+) -> Dict:
+    """
+    Precarga configuraciones y conexiones según la instantánea anterior.
+
+    Returns:
+        Resumen: usuarios precargados y endpoints calentados
+    """
+    snapshot = await asyncio.to_thread(load_snapshot, path)
+    if not snapshot:
+        return {"users": 0, "endpoints": 0}
+
+    started = time.monotonic()
+    users = snapshot["users"]
+    if warm_set is not None:
+        # Conserva el orden para que la siguiente instantánea no empiece vacía
+        for bot_id, user_id in reversed(users):
+            warm_set.touch(user_id, bot_id)
+    found = await asyncio.to_thread(_prefetch, users)
+
+    urls = [entry["base_url"] for entry in snapshot.get("endpoints", [])[:top_endpoints]]
+    warmed = await asyncio.gather(
+        *(asyncio.to_thread(_warm_endpoint, url, users) for url in urls)
+    )
+    summary = {"users": found, "endpoints": sum(warmed)}
+    logger.info(
+        "Arranque en caliente: {} configuraciones y {}/{} endpoints en {:.2f}s",
+        found,
+        summary["endpoints"],
+        len(urls),
+        time.monotonic() - started,
+    )
+    return summary
+
+
+# Instancia compartida; process_job la actualiza y post_stop la guarda
+warm_users = WarmSet()
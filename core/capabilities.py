@@ -0,0 +1,305 @@
+from dataclasses import dataclass, asdict, replace
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OVERRIDES_PATH = Path(__file__).with_name("model_overrides.json")
+
+
+@dataclass(frozen=True)
+class ModelCapabilities:
+    """Capacidades conocidas de un modelo en un endpoint concreto."""
+
+    supports_vision: bool = False
+    supports_streaming: bool = True
+    context_tokens: Optional[int] = None
+    max_output_tokens: Optional[int] = None
+    # True si el endpoint lo lista o hay una entrada exacta en overrides
+    known: bool = False
+
+
+def _first_int(data: Dict, *paths: str) -> Optional[int]:
+    for path in paths:
+        value = data
+        for part in path.split("."):
+            value = value.get(part) if isinstance(value, dict) else None
+        if isinstance(value, (int, float)) and value > 0:
+            return int(value)
+    return None
+
+
+def parse_model_entry(entry: Dict) -> Dict:
+    """
+    Extrae capacidades de una entrada de ``/models``.
+
+    OpenAI solo devuelve el ``id``; proveedores como OpenRouter añaden
+    ``context_length``, ``architecture`` y ``top_provider``.
+    """
+    caps: Dict = {}
+    context = _first_int(entry, "context_length", "context_window", "max_context_length")
+    if context:
+        caps["context_tokens"] = context
+    max_output = _first_int(
+        entry, "top_provider.max_completion_tokens", "max_output_tokens", "max_tokens"
+    )
+    if max_output:
+        caps["max_output_tokens"] = max_output
+
+    architecture = entry.get("architecture") or {}
+    modalities = architecture.get("input_modalities") or []
+    modality = architecture.get("modality") or ""
+    capabilities = entry.get("capabilities") or {}
+    if "image" in modalities or "image" in modality.split("->")[0] or capabilities.get("vision"):
+        caps["supports_vision"] = True
+    return caps
+
+
+class CapabilityRegistry:
+    """
+    Registro de capacidades de modelos por ``(base_url, model_name)``.
+
+    - ``refresh`` descarga ``/models`` una vez por endpoint y lo guarda en
+      SQLite con TTL, de modo que los reinicios no vuelven a consultarlo.
+    - ``get`` es una búsqueda O(1) en memoria; la combinación con los
+      overrides (exactos y por patrón) se memoriza junto con ``fetched_at``
+      y se recalcula cuando la lista del endpoint caduca.
+    - ``refresh_in_background`` renueva en un hilo aparte la lista que falta
+      o caducó, sin retrasar la solicitud que lo detecta; mientras tanto se
+      sirve la lista anterior (aunque haya caducado en SQLite).
+
+    Orden de precedencia: valores por defecto < patrones < endpoint < overrides exactos.
+    """
+
+    # Espera entre intentos de renovación en segundo plano de un mismo endpoint
+    RETRY_SECONDS = 300.0
+
+    def __init__(
+        self,
+        db_path: Optional[Union[str, Path]] = None,
+        overrides_path: Optional[Union[str, Path]] = DEFAULT_OVERRIDES_PATH,
+        ttl_seconds: float = 24 * 3600,
+    ) -> None:
+        self._lock = threading.RLock()
+        self.configure(db_path, overrides_path, ttl_seconds)
+
+    def configure(
+        self,
+        db_path: Optional[Union[str, Path]] = None,
+        overrides_path: Optional[Union[str, Path]] = DEFAULT_OVERRIDES_PATH,
+        ttl_seconds: float = 24 * 3600,
+    ) -> None:
+        with self._lock:
+            self.db_path = Path(db_path) if db_path else None
+            self.ttl_seconds = ttl_seconds
+            self._exact: Dict[str, Dict] = {}
+            self._patterns: List[Tuple[str, Dict]] = []
+            self._endpoints: Dict[str, Dict[str, Dict]] = {}
+            self._fetched_at: Dict[str, float] = {}
+            # (base_url, modelo) -> (capacidades, válidas hasta)
+            self._resolved: Dict[Tuple[str, str], Tuple[ModelCapabilities, float]] = {}
+            self._refreshing: Set[str] = set()
+            self._attempted_at: Dict[str, float] = {}
+            if overrides_path:
+                self._load_overrides(Path(overrides_path))
+            if self.db_path:
+                self._init_db()
+
+    @staticmethod
+    def _key(base_url: Optional[str]) -> str:
+        return (base_url or "").rstrip("/")
+
+    def _load_overrides(self, path: Path) -> None:
+        if not path.exists():
+            logger.warning(f"Archivo de overrides no encontrado: {path}")
+            return
+        data = json.loads(path.read_text(encoding="utf-8"))
+        self._exact = {k.lower(): v for k, v in data.get("models", {}).items()}
+        self._patterns = [
+            (item["match"].lower(), {k: v for k, v in item.items() if k != "match"})
+            for item in data.get("patterns", [])
+        ]
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path)
+
+    def _init_db(self) -> None:
+        conn = self._connect()
+        try:
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS model_capabilities (
+                base_url TEXT PRIMARY KEY,
+                models_json TEXT NOT NULL,
+                fetched_at REAL NOT NULL
+            )
+            """)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _load_cached(self, base_url: str, allow_stale: bool = False) -> bool:
+        """Carga desde SQLite la lista del endpoint si sigue vigente (o aunque no, con ``allow_stale``)."""
+        if not self.db_path:
+            return False
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT models_json, fetched_at FROM model_capabilities WHERE base_url = ?",
+                (base_url,),
+            ).fetchone()
+        finally:
+            conn.close()
+        if not row or (not allow_stale and time.time() - row[1] > self.ttl_seconds):
+            return False
+        self._store_in_memory(base_url, json.loads(row[0]), row[1])
+        return True
+
+    def _store_in_memory(self, base_url: str, models: Dict[str, Dict], fetched_at: float) -> None:
+        self._endpoints[base_url] = models
+        self._fetched_at[base_url] = fetched_at
+        self._resolved = {k: v for k, v in self._resolved.items() if k[0] != base_url}
+
+    def _save(self, base_url: str, models: Dict[str, Dict], fetched_at: float) -> None:
+        if not self.db_path:
+            return
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT INTO model_capabilities (base_url, models_json, fetched_at) "
+                "VALUES (?, ?, ?) ON CONFLICT(base_url) DO UPDATE SET "
+                "models_json = excluded.models_json, fetched_at = excluded.fetched_at",
+                (base_url, json.dumps(models), fetched_at),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def fetch_models(self, base_url: str, api_key: Optional[str]) -> Dict[str, Dict]:
+        """Consulta ``GET {base_url}/models`` y devuelve ``{model_id: capacidades}``."""
+        import httpx
+
+        headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        response = httpx.get(f"{base_url}/models", headers=headers, timeout=10)
+        response.raise_for_status()
+        entries = response.json().get("data", [])
+        return {
+            entry["id"].lower(): parse_model_entry(entry)
+            for entry in entries
+            if isinstance(entry, dict) and entry.get("id")
+        }
+
+    def refresh(self, base_url: str, api_key: Optional[str] = None, force: bool = False) -> bool:
+        """
+        Asegura que la lista de modelos del endpoint esté cargada.
+
+        Returns:
+            True si la lista está disponible (memoria, SQLite o red); False si
+            el endpoint no respondió.
+        """
+        base_url = self._key(base_url)
+        with self._lock:
+            fetched_at = self._fetched_at.get(base_url)
+            if not force and fetched_at and time.time() - fetched_at <= self.ttl_seconds:
+                return True
+            if not force and self._load_cached(base_url):
+                return True
+        try:
+            models = self.fetch_models(base_url, api_key)
+        except Exception as e:
+            logger.warning(f"No se pudo obtener /models de {base_url}: {str(e)}")
+            return False
+        now = time.time()
+        with self._lock:
+            self._store_in_memory(base_url, models, now)
+            self._save(base_url, models, now)
+        logger.info(f"{len(models)} modelos registrados para {base_url}")
+        return True
+
+    def refresh_in_background(self, base_url: Optional[str], api_key: Optional[str] = None) -> bool:
+        """
+        Lanza ``refresh`` en un hilo si la lista del endpoint falta o caducó.
+        No bloquea: hay como mucho una renovación en curso por endpoint y, si
+        falla, no se reintenta hasta pasados ``RETRY_SECONDS``.
+
+        Returns:
+            True si se lanzó una renovación
+        """
+        base_url = self._key(base_url)
+        if not base_url:
+            return False
+        now = time.time()
+        with self._lock:
+            fetched_at = self._fetched_at.get(base_url)
+            if fetched_at and now - fetched_at <= self.ttl_seconds:
+                return False
+            if base_url in self._refreshing or now - self._attempted_at.get(base_url, 0.0) < self.RETRY_SECONDS:
+                return False
+            self._refreshing.add(base_url)
+            self._attempted_at[base_url] = now
+
+        def _run() -> None:
+            try:
+                self.refresh(base_url, api_key)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(base_url)
+
+        threading.Thread(target=_run, name="capabilities-refresh", daemon=True).start()
+        return True
+
+    def is_listed(self, base_url: str, model_name: str) -> Optional[bool]:
+        """True/False si se conoce la lista del endpoint, None si no."""
+        models = self._endpoints.get(self._key(base_url))
+        if models is None:
+            return None
+        return model_name.lower() in models
+
+    def models(self, base_url: str) -> Iterable[str]:
+        return list(self._endpoints.get(self._key(base_url), {}))
+
+    def get(self, base_url: Optional[str], model_name: str) -> ModelCapabilities:
+        """
+        Capacidades del modelo; O(1) tras la primera consulta del par mientras
+        la lista del endpoint siga vigente.
+        """
+        key = (self._key(base_url), model_name.lower())
+        now = time.time()
+        entry = self._resolved.get(key)
+        if entry is not None and now < entry[1]:
+            return entry[0]
+
+        with self._lock:
+            if key[0] not in self._endpoints:
+                # Una lista caducada sigue siendo mejor que ninguna hasta renovarla
+                self._load_cached(key[0], allow_stale=True)
+            merged: Dict = {}
+            for pattern, values in self._patterns:
+                if fnmatch(key[1], pattern):
+                    merged.update(values)
+            endpoint_models = self._endpoints.get(key[0], {})
+            known = key[1] in endpoint_models or key[1] in self._exact
+            merged.update(endpoint_models.get(key[1], {}))
+            merged.update(self._exact.get(key[1], {}))
+            fields = set(asdict(ModelCapabilities()))
+            caps = replace(
+                ModelCapabilities(),
+                known=known,
+                **{k: v for k, v in merged.items() if k in fields and k != "known"},
+            )
+            fetched_at = self._fetched_at.get(key[0])
+            # Sin lista del endpoint se vuelve a mirar SQLite pasado RETRY_SECONDS.
+            # Con la lista caducada la entrada ya nace vencida: se recalcula en
+            # cada consulta (sin red) hasta que refresh la renueva
+            expires_at = fetched_at + self.ttl_seconds if fetched_at else now + self.RETRY_SECONDS
+            self._resolved[key] = (caps, expires_at)
+        return caps
+
+
+# Registro compartido; bot/main.py lo configura con la base de datos del bot
+registry = CapabilityRegistry()
@@ -0,0 +1,125 @@
+"""
+Lectura y fragmentación de documentos en streaming.
+
+Los documentos se leen por líneas (texto, Markdown, código) o por páginas
+(PDF), y ``chunk_segments`` agrupa los segmentos en fragmentos de hasta
+``max_tokens``. Todo son generadores: en memoria solo hay un fragmento a la
+vez, así que un documento de 50 páginas no se carga entero para empezar a
+enviarlo al modelo.
+
+El soporte de PDF es opcional y requiere ``pypdf``; sin él, ``is_supported``
+rechaza los PDF para que el bot los descarte antes de encolarlos.
+"""
+
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, Union
+import importlib.util
+import logging
+
+from core.tokens import get_estimator
+
+logger = logging.getLogger(__name__)
+
+TEXT_EXTENSIONS = {
+    ".txt", ".md", ".markdown", ".rst", ".csv", ".tsv", ".log", ".json", ".yaml", ".yml",
+    ".toml", ".ini", ".cfg", ".xml", ".html", ".htm", ".sql", ".sh",
+    ".py", ".js", ".ts", ".tsx", ".jsx", ".java", ".kt", ".go", ".rs", ".c", ".h",
+    ".cpp", ".hpp", ".cs", ".rb", ".php", ".swift", ".scala", ".lua", ".r",
+}
+PDF_EXTENSIONS = {".pdf"}
+
+
+def pdf_available() -> bool:
+    """True si ``pypdf`` está instalado (sin importarlo)."""
+    return importlib.util.find_spec("pypdf") is not None
+
+
+def is_supported(file_name: str, mime_type: Optional[str] = None) -> bool:
+    """True si el documento se puede leer como texto o, con ``pypdf``, como PDF."""
+    suffix = Path(file_name or "").suffix.lower()
+    if suffix in TEXT_EXTENSIONS:
+        return True
+    if suffix in PDF_EXTENSIONS or mime_type == "application/pdf":
+        return pdf_available()
+    return bool(mime_type) and mime_type.startswith("text/")
+
+
+def iter_text_lines(path: Union[str, Path], encoding: str = "utf-8") -> Iterator[str]:
+    """Líneas del archivo sin cargarlo entero; los bytes inválidos se reemplazan."""
+    with open(path, "r", encoding=encoding, errors="replace", newline=None) as handle:
+        yield from handle
+
+
+def iter_pdf_pages(path: Union[str, Path]) -> Iterator[str]:
+    """
+    Texto de cada página del PDF, una a la vez.
+
+    Raises:
+        ValueError: Si ``pypdf`` no está instalado
+    """
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise ValueError("Para leer PDF instala la dependencia opcional pypdf (pip install pypdf).")
+
+    reader = PdfReader(str(path))
+    for number, page in enumerate(reader.pages, start=1):
+        try:
+            text = page.extract_text() or ""
+        except Exception as e:
+            logger.warning(f"No se pudo extraer la página {number}: {str(e)}")
+            continue
+        if text.strip():
+            yield text + "\n\n"
+
+
+def iter_segments(
+    path: Union[str, Path], file_name: Optional[str] = None, mime_type: Optional[str] = None
+) -> Iterator[str]:
+    """Segmentos del documento según su tipo (líneas o páginas)."""
+    suffix = Path(file_name or str(path)).suffix.lower()
+    if suffix in PDF_EXTENSIONS or mime_type == "application/pdf":
+        return iter_pdf_pages(path)
+    return iter_text_lines(path)
+
+
+def chunk_segments(
+    segments: Iterable[str], max_tokens: int, model_name: str = ""
+) -> Iterator[str]:
+    """
+    Agrupa segmentos consecutivos en fragmentos de hasta ``max_tokens``.
+
+    Los cortes se hacen entre segmentos (líneas o páginas). Un segmento que
+    por sí solo supera el límite se parte por caracteres.
+    """
+    # Sin la caché LRU del estimador: las líneas de un documento no se repiten
+    count = get_estimator(model_name).tokenizer.count
+    buffer, used = [], 0
+    for segment in segments:
+        tokens = count(segment)
+        if used and used + tokens > max_tokens:
+            yield "".join(buffer)
+            buffer, used = [], 0
+        if tokens > max_tokens:
+            # Proporción caracteres/token del propio segmento
+            step = max(1, len(segment) * max_tokens // tokens)
+            pieces = [segment[i : i + step] for i in range(0, len(segment), step)]
+            yield from pieces[:-1]
+            segment, tokens = pieces[-1], count(pieces[-1])
+        buffer.append(segment)
+        used += tokens
+    if used and "".join(buffer).strip():
+        yield "".join(buffer)
+
+
+def iter_document_chunks(
+    path: Union[str, Path],
+    max_tokens: int,
+    file_name: Optional[str] = None,
+    mime_type: Optional[str] = None,
+    model_name: str = "",
+) -> Iterator[str]:
+    """Fragmentos no vacíos del documento, en orden."""
+    for chunk in chunk_segments(iter_segments(path, file_name, mime_type), max_tokens, model_name):
+        if chunk.strip():
+            yield chunk
@@ -0,0 +1,311 @@
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Union
+import logging
+import sqlite3
+import time
+
+from core.tokens import MESSAGE_OVERHEAD_TOKENS, get_estimator
+
+logger = logging.getLogger(__name__)
+
+# Resumidor: recibe el resumen anterior y los turnos a absorber, devuelve el nuevo resumen
+Summarizer = Callable[[str, List[Dict]], str]
+
+
+# chat_id admite enteros y claves de texto (p. ej. "<bot_id>_<chat_id>")
+SUMMARIES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS {table} (
+    chat_id NUMERIC PRIMARY KEY,
+    summary TEXT NOT NULL,
+    covered_until INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+
+
+@dataclass
+class CompactionSnapshot:
+    """Estado leído antes de resumir; se valida al guardar por ``version``."""
+
+    chat_id: Union[int, str]
+    version: int
+    summary: str
+    turns: List[Dict]
+    covered_until: int
+
+
+class ConversationStore:
+    """
+    Historial por chat en SQLite con un resumen incremental.
+
+    - ``history`` devuelve el resumen (si existe) y los turnos aún no
+      resumidos, recortados a ``max_history_tokens`` empezando por los más
+      recientes: el prompt queda acotado aunque la compactación vaya atrasada.
+    - ``compact`` resume los turnos antiguos fuera del camino crítico de la
+      respuesta. El resumen lleva ``version`` y se guarda con un UPDATE
+      condicional, de modo que dos compactaciones concurrentes no se pisan:
+      la que llega tarde se descarta y se reintenta en el siguiente turno.
+
+    Sin ``db_path`` el almacén está desactivado y cada solicitud va sin historial.
+    """
+
+    def __init__(
+        self,
+        db_path: Optional[Union[str, Path]] = None,
+        max_history_tokens: int = 2000,
+        compact_threshold_tokens: int = 1500,
+        keep_recent_turns: int = 4,
+        max_summary_tokens: int = 400,
+    ) -> None:
+        self.configure(
+            db_path, max_history_tokens, compact_threshold_tokens, keep_recent_turns, max_summary_tokens
+        )
+
+    def configure(
+        self,
+        db_path: Optional[Union[str, Path]] = None,
+        max_history_tokens: int = 2000,
+        compact_threshold_tokens: int = 1500,
+        keep_recent_turns: int = 4,
+        max_summary_tokens: int = 400,
+    ) -> None:
+        self.db_path = Path(db_path) if db_path else None
+        self.max_history_tokens = max_history_tokens
+        self.compact_threshold_tokens = compact_threshold_tokens
+        self.keep_recent_turns = keep_recent_turns
+        self.max_summary_tokens = max_summary_tokens
+        if self.db_path:
+            self._init_db()
+
+    @property
+    def enabled(self) -> bool:
+        return self.db_path is not None
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    def _init_db(self) -> None:
+        conn = self._connect()
+        try:
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS chat_turns (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                tokens INTEGER NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """)
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_chat_turns_chat ON chat_turns (chat_id, id)"
+            )
+            conn.execute(SUMMARIES_SCHEMA.format(table="chat_summaries"))
+            self._migrate_summaries(conn)
+        finally:
+            conn.close()
+
+    def _migrate_summaries(self, conn: sqlite3.Connection) -> None:
+        """
+        ``chat_id INTEGER PRIMARY KEY`` es un alias de ``rowid`` y solo admite
+        enteros; las claves con espacio de bot (``"<bot_id>_<chat_id>"``)
+        necesitan una columna NUMERIC. Se reconstruye la tabla una vez.
+        """
+        columns = {row[1]: row[2] for row in conn.execute("PRAGMA table_info(chat_summaries)")}
+        if columns.get("chat_id", "").upper() != "INTEGER":
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(SUMMARIES_SCHEMA.format(table="chat_summaries_new"))
+            conn.execute("INSERT INTO chat_summaries_new SELECT * FROM chat_summaries")
+            conn.execute("DROP TABLE chat_summaries")
+            conn.execute("ALTER TABLE chat_summaries_new RENAME TO chat_summaries")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        logger.info("Tabla chat_summaries migrada a claves NUMERIC")
+
+    def append(self, chat_id: Union[int, str], turns: List[Dict]) -> None:
+        """Guarda turnos ``{"role": ..., "content": ...}`` en orden."""
+        if not self.enabled or not turns:
+            return
+        estimator = get_estimator()
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN")
+            conn.executemany(
+                "INSERT INTO chat_turns (chat_id, role, content, tokens, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [
+                    (chat_id, t["role"], t["content"], estimator.count(t["content"]), now)
+                    for t in turns
+                ],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _summary_row(self, conn: sqlite3.Connection, chat_id: Union[int, str]):
+        return conn.execute(
+            "SELECT summary, covered_until, version FROM chat_summaries WHERE chat_id = ?",
+            (chat_id,),
+        ).fetchone()
+
+    def history(self, chat_id: Union[int, str]) -> List[Dict]:
+        """Mensajes previos para el prompt, acotados a ``max_history_tokens``."""
+        if not self.enabled:
+            return []
+        conn = self._connect()
+        try:
+            row = self._summary_row(conn, chat_id)
+            summary, covered = (row[0], row[1]) if row else ("", 0)
+            rows = conn.execute(
+                "SELECT role, content, tokens FROM chat_turns "
+                "WHERE chat_id = ? AND id > ? ORDER BY id DESC",
+                (chat_id, covered),
+            ).fetchall()
+        finally:
+            conn.close()
+
+        budget = self.max_history_tokens
+        messages: List[Dict] = []
+        if summary:
+            summary_tokens = get_estimator().count(summary) + MESSAGE_OVERHEAD_TOKENS
+            budget -= summary_tokens
+        for role, content, tokens in rows:
+            budget -= tokens + MESSAGE_OVERHEAD_TOKENS
+            if budget < 0:
+                break
+            messages.append({"role": role, "content": content})
+        messages.reverse()
+        if summary:
+            messages.insert(
+                0, {"role": "system", "content": f"Resumen de la conversación anterior:\n{summary}"}
+            )
+        return messages
+
+    def compaction_snapshot(self, chat_id: Union[int, str]) -> Optional[CompactionSnapshot]:
+        """Turnos a resumir si los no resumidos superan el umbral; None si no hace falta."""
+        if not self.enabled:
+            return None
+        conn = self._connect()
+        try:
+            row = self._summary_row(conn, chat_id)
+            summary, covered, version = row if row else ("", 0, 0)
+            rows = conn.execute(
+                "SELECT id, role, content, tokens FROM chat_turns "
+                "WHERE chat_id = ? AND id > ? ORDER BY id",
+                (chat_id, covered),
+            ).fetchall()
+        finally:
+            conn.close()
+
+        pending_tokens = sum(r[3] for r in rows)
+        older = rows[: -self.keep_recent_turns] if self.keep_recent_turns else rows
+        if pending_tokens <= self.compact_threshold_tokens or not older:
+            return None
+        return CompactionSnapshot(
+            chat_id=chat_id,
+            version=version,
+            summary=summary,
+            turns=[{"role": r[1], "content": r[2]} for r in older],
+            covered_until=older[-1][0],
+        )
+
+    def apply_summary(self, snapshot: CompactionSnapshot, summary: str) -> bool:
+        """
+        Guarda el resumen solo si nadie lo cambió desde ``snapshot`` y borra
+        los turnos que absorbe.
+
+        Returns:
+            False si otra compactación ganó la carrera o el chat se borró
+            con ``clear`` mientras tanto
+        """
+        summary = get_estimator().truncate(summary.strip(), self.max_summary_tokens)
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            if snapshot.version == 0:
+                # Sin fila que versionar: si un /reset (``clear``) borró los
+                # turnos mientras se resumían, el resumen ya no es de este chat.
+                # Los ids son AUTOINCREMENT, así que un turno borrado no reaparece
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO chat_summaries "
+                    "(chat_id, summary, covered_until, version, updated_at) "
+                    "SELECT ?, ?, ?, 1, ? WHERE EXISTS "
+                    "(SELECT 1 FROM chat_turns WHERE chat_id = ? AND id = ?)",
+                    (
+                        snapshot.chat_id,
+                        summary,
+                        snapshot.covered_until,
+                        now,
+                        snapshot.chat_id,
+                        snapshot.covered_until,
+                    ),
+                )
+            else:
+                cursor = conn.execute(
+                    "UPDATE chat_summaries SET summary = ?, covered_until = ?, "
+                    "version = version + 1, updated_at = ? WHERE chat_id = ? AND version = ?",
+                    (summary, snapshot.covered_until, now, snapshot.chat_id, snapshot.version),
+                )
+            applied = cursor.rowcount == 1
+            if applied:
+                conn.execute(
+                    "DELETE FROM chat_turns WHERE chat_id = ? AND id <= ?",
+                    (snapshot.chat_id, snapshot.covered_until),
+                )
+            conn.execute("COMMIT")
+            return applied
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def compact(self, chat_id: Union[int, str], summarize: Summarizer) -> bool:
+        """
+        Resume los turnos antiguos del chat si superan el umbral.
+
+        La llamada a ``summarize`` (lenta) ocurre fuera de cualquier
+        transacción; solo el guardado final toma el lock de escritura.
+
+        Returns:
+            True si se guardó un resumen nuevo
+        """
+        snapshot = self.compaction_snapshot(chat_id)
+        if snapshot is None:
+            return False
+        summary = summarize(snapshot.summary, snapshot.turns)
+        applied = self.apply_summary(snapshot, summary)
+        if not applied:
+            logger.info(f"Resumen del chat {chat_id} descartado: versión desactualizada")
+        return applied
+
+    def clear(self, chat_id: Union[int, str]) -> None:
+        """Olvida el historial y el resumen del chat."""
+        if not self.enabled:
+            return
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM chat_turns WHERE chat_id = ?", (chat_id,))
+            conn.execute("DELETE FROM chat_summaries WHERE chat_id = ?", (chat_id,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+
+# Almacén compartido; bot/main.py lo configura con la base de datos del bot
+conversations = ConversationStore()
@@ -1,17 +1,103 @@
-from openai import OpenAI
-from typing import Dict, Optional, Union
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Sequence, Tuple, Union
 import base64
 import mimetypes
 from pathlib import Path
 import logging
+import threading
 
-# Configurar logging básico
-logging.basicConfig(level=logging.ERROR)
+# La configuración de logging la decide la aplicación (ver bot/logs.py)
 logger = logging.getLogger(__name__)
 
+# ``openai`` tarda ~0.8 s en importarse: se carga en el primer uso o con
+# ``preload()`` en segundo plano tras arrancar, no al importar este módulo
+OpenAI = None
+
+
+def _openai_class():
+    global OpenAI
+    if OpenAI is None:
+        from openai import OpenAI as _OpenAI
+
+        OpenAI = _OpenAI
+    return OpenAI
+
+
+def preload() -> None:
+    """Importa el SDK de OpenAI por adelantado (pensado para un hilo aparte)."""
+    _openai_class()
+
+
+# Un pool HTTP por base_url, compartido por los clientes de todos los usuarios
+# de ese endpoint: la conexión (y el handshake TLS) que abre uno, o el
+# arranque en caliente, la reutilizan los demás aunque usen otra API key
+_http_clients: "OrderedDict[str, object]" = OrderedDict()
+MAX_ENDPOINTS = 64
+
+# Un cliente por (base_url, api_key): solo guarda la clave y las cabeceras;
+# las conexiones son las del pool de su base_url
+_clients: "OrderedDict[Tuple[str, str], object]" = OrderedDict()
+_clients_lock = threading.Lock()
+MAX_CLIENTS = 256
+
+
+def _http_client(base_url: str):
+    """Pool ``httpx`` compartido por ``base_url`` (llamar con ``_clients_lock``)."""
+    http_client = _http_clients.get(base_url)
+    if http_client is None:
+        from openai import DefaultHttpxClient
+
+        # Los mismos timeouts y límites que el SDK usa para su pool propio
+        http_client = _http_clients[base_url] = DefaultHttpxClient()
+        # Sin close(): un hilo puede seguir usándolo; se libera al recolectarse
+        while len(_http_clients) > MAX_ENDPOINTS:
+            _http_clients.popitem(last=False)
+    _http_clients.move_to_end(base_url)
+    return http_client
+
+
+def get_client(api_key: str, base_url: str):
+    """Cliente OpenAI compartido para el par ``(base_url, api_key)``."""
+    key = (base_url, api_key)
+    openai_class = _openai_class()
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is not None:
+            _clients.move_to_end(key)
+            return client
+        client = _clients[key] = openai_class(
+            api_key=api_key, base_url=base_url, http_client=_http_client(base_url)
+        )
+        # Los clientes expulsados no se cierran: un worker puede estar usándolo
+        # y cerrarlo cerraría además el pool compartido del endpoint
+        while len(_clients) > MAX_CLIENTS:
+            _clients.popitem(last=False)
+    return client
+
+
+def warm_endpoint(api_key: str, base_url: str, timeout: float = 5.0) -> bool:
+    """
+    Abre por adelantado la conexión al endpoint (DNS, TCP y TLS) con una
+    consulta barata a ``/models``. La conexión queda en el pool del
+    endpoint, así que la aprovechan también los clientes de otras API keys.
+
+    Returns:
+        True si el endpoint respondió
+    """
+    try:
+        get_client(api_key, base_url).with_options(timeout=timeout, max_retries=0).models.list()
+        return True
+    except Exception as e:
+        logger.warning(f"No se pudo precalentar {base_url}: {str(e)}")
+        return False
+
 
 def chat_gpt(
-    config: Dict[str, str], user_input: str, system_prompt: Optional[str] = None
+    config: Dict[str, str],
+    user_input: str,
+    system_prompt: Optional[str] = None,
+    on_usage: Optional[Callable[[Dict], None]] = None,
+    history: Optional[Sequence[Dict]] = None,
 ) -> str:
     """
     Cliente para modelos GPT que solo procesan texto (GPT-3.5, GPT-4, etc.).
@@ -23,6 +109,8 @@ def chat_gpt(
             - model_name: Nombre del modelo a usar
         user_input: Texto de entrada del usuario
         system_prompt: Opcional, sobreescribe el config["system_prompt"] si existe
+        on_usage: Opcional, recibe el ``usage`` reportado por el proveedor
+        history: Opcional, mensajes previos del chat (resumen y turnos recientes)
 
     Returns:
         Respuesta del modelo como string
@@ -37,7 +125,7 @@ def chat_gpt(
         if not all(k in config for k in required_keys):
             raise ValueError(f"Configuración incompleta. Se requieren: {required_keys}")
 
-        client = OpenAI(api_key=config["api_key"], base_url=config["base_url"])
+        client = get_client(config["api_key"], config["base_url"])
 
         # Usar system_prompt proporcionado o el de config o uno por defecto
         system_content = system_prompt or config.get(
@@ -48,9 +136,11 @@ def chat_gpt(
             model=config["model_name"],
             messages=[
                 {"role": "system", "content": system_content},
+                *(history or []),
                 {"role": "user", "content": user_input},
             ],
         )
+        _report_usage(response, on_usage)
         return response.choices[0].message.content
 
     except Exception as e:
@@ -64,6 +154,9 @@ def chat_multimodal(
     image_path: Optional[Union[str, Path]] = None,
     image_url: Optional[str] = None,
     system_prompt: Optional[str] = None,
+    image_paths: Optional[Sequence[Union[str, Path]]] = None,
+    on_usage: Optional[Callable[[Dict], None]] = None,
+    history: Optional[Sequence[Dict]] = None,
 ) -> str:
     """
     Cliente para modelos multimodales (GPT-4o, etc.) que soportan imágenes.
@@ -77,6 +170,10 @@ def chat_multimodal(
         image_path: Ruta local a la imagen (opcional, pero se requiere image_path o image_url)
         image_url: URL pública de la imagen (opcional)
         system_prompt: Opcional, sobreescribe el config["system_prompt"] si existe
+        image_paths: Varias rutas locales; cada una se envía como una parte
+            ``image_url`` del mismo mensaje
+        on_usage: Opcional, recibe el ``usage`` reportado por el proveedor
+        history: Opcional, mensajes previos del chat (solo texto)
 
     Returns:
         Respuesta del modelo como string
@@ -87,13 +184,18 @@ def chat_multimodal(
     """
     try:
         # Validar que haya al menos una imagen
-        if not any([image_path, image_url]):
+        paths = list(image_paths or [])
+        if image_path:
+            paths.insert(0, image_path)
+        if not paths and not image_url:
             raise ValueError("Se requiere image_path o image_url para multimodal_chat")
 
-        # Obtener la representación de la imagen (URL o base64)
-        image_content = _prepare_image_content(image_path, image_url)
+        # Obtener la representación de cada imagen (URL o base64)
+        image_contents = [_prepare_image_content(path) for path in paths]
+        if image_url:
+            image_contents.append(_prepare_image_content(image_url=image_url))
 
-        client = OpenAI(api_key=config["api_key"], base_url=config["base_url"])
+        client = get_client(config["api_key"], config["base_url"])
 
         # Usar system_prompt proporcionado o el de config o uno por defecto
         system_content = system_prompt or config.get(
@@ -103,9 +205,10 @@ def chat_multimodal(
         # Construir mensaje multimodal
         messages = [
             {"role": "system", "content": system_content},
+            *(history or []),
             {
                 "role": "user",
-                "content": [{"type": "text", "text": user_input}, image_content],
+                "content": [{"type": "text", "text": user_input}, *image_contents],
             },
         ]
 
@@ -114,6 +217,7 @@ def chat_multimodal(
             messages=messages,
         )
 
+        _report_usage(response, on_usage)
         return response.choices[0].message.content
 
     except Exception as e:
@@ -121,6 +225,20 @@ def chat_multimodal(
         raise
 
 
+def _report_usage(response, on_usage: Optional[Callable[[Dict], None]]) -> None:
+    """Entrega a ``on_usage`` los tokens que reporta el proveedor (si los reporta)."""
+    if on_usage is None:
+        return
+    usage = getattr(response, "usage", None)
+    on_usage(
+        {
+            "prompt_tokens": getattr(usage, "prompt_tokens", None),
+            "completion_tokens": getattr(usage, "completion_tokens", None),
+            "total_tokens": getattr(usage, "total_tokens", None),
+        }
+    )
+
+
 def _prepare_image_content(
     image_path: Optional[Union[str, Path]] = None, image_url: Optional[str] = None
 ) -> Dict:
@@ -1,10 +1,17 @@
 from core.llm_clients import chat_gpt, chat_multimodal
-from typing import Dict, Optional, Union
+from core.capabilities import registry
+from core.context import ConversationStore, conversations
+from core.tokens import plan_prompt
+from core.chunking import chunk_segments
+from core.retrieval import KnowledgeBase, format_passages, knowledge
+from core.semantic_cache import SemanticCache, semantic_cache
+from core.tools import ToolRegistry, chat_with_tools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Union
 from pathlib import Path
 import logging
+import threading
 
-# Configurar logging
-logging.basicConfig(level=logging.ERROR)
 logger = logging.getLogger(__name__)
 
 
@@ -14,6 +21,11 @@ def run_pipeline(
     image_path: Optional[Union[str, Path]] = None,
     image_url: Optional[str] = None,
     system_prompt: Optional[str] = None,
+    image_paths: Optional[Sequence[Union[str, Path]]] = None,
+    on_usage: Optional[Callable[[Dict], None]] = None,
+    history: Optional[Sequence[Dict]] = None,
+    retrieval_user_id: Optional[Union[int, str]] = None,
+    tools: Optional[ToolRegistry] = None,
     **kwargs,
 ) -> str:
     """
@@ -28,7 +40,16 @@ def run_pipeline(
         image_path: Ruta local a imagen (opcional, para modelos multimodales)
         image_url: URL de imagen (opcional, para modelos multimodales)
         system_prompt: Prompt del sistema (opcional, sobreescribe config)
-        **kwargs: Argumentos adicionales para los clientes
+        image_paths: Varias imágenes locales (álbum) en una sola llamada
+        on_usage: Opcional, recibe el uso de tokens de la solicitud (estimado
+            antes del envío y el reportado por el proveedor)
+        history: Mensajes previos del chat (ver ``ConversationStore.history``)
+        retrieval_user_id: Si se indica, antepone los fragmentos más relevantes
+            de los documentos que ese usuario guardó con /remember
+        tools: Si se indica, el modelo de texto puede llamar a estas
+            herramientas (ver ``core.tools.chat_with_tools``)
+        **kwargs: Argumentos adicionales para los clientes (``max_steps`` y
+            ``deadline_seconds`` con herramientas)
 
     Returns:
         Respuesta del modelo como string
@@ -43,11 +64,46 @@ def run_pipeline(
             raise ValueError("Configuración inválida: falta 'model_name'")
 
         model_name = config["model_name"].lower()
+        # Si la lista de modelos del endpoint falta o caducó, se renueva en segundo plano
+        registry.refresh_in_background(config.get("base_url"), config.get("api_key"))
+        capabilities = registry.get(config.get("base_url"), model_name)
 
-        # Determinar si es multimodal basado en el nombre del modelo o en parámetros
-        is_multimodal = any(
-            m in model_name for m in ["multimodal", "4o", "vision", "turbo-vision"]
-        ) or any([image_path, image_url])
+        # El flujo multimodal solo tiene sentido si hay imagen; el registro
+        # permite rechazar antes de la llamada los modelos que no la aceptan
+        is_multimodal = any([image_path, image_url, image_paths])
+        if is_multimodal and capabilities.known and not capabilities.supports_vision:
+            raise ValueError(
+                f"El modelo {config['model_name']} no admite imágenes. "
+                "Usa /set_model con un modelo multimodal."
+            )
+
+        if retrieval_user_id is not None and not is_multimodal:
+            user_input = _with_passages(config, retrieval_user_id, user_input)
+
+        # Presupuesto de tokens antes de enviar: evita errores de contexto
+        # que solo aparecerían tras un viaje completo al proveedor
+        images = len(image_paths or []) + bool(image_path) + bool(image_url)
+        budget = plan_prompt(
+            model_name,
+            system_prompt or config.get("system_prompt") or "You are a helpful assistant.",
+            user_input,
+            images=images,
+            context_tokens=capabilities.context_tokens,
+            max_output_tokens=capabilities.max_output_tokens,
+            history=history or (),
+        )
+        user_input = budget.user_input
+
+        def _record_usage(provider_usage: Dict) -> None:
+            usage = {
+                "model": model_name,
+                "estimated_prompt_tokens": budget.prompt_tokens,
+                "truncated": budget.truncated,
+                **provider_usage,
+            }
+            logger.info(f"Uso de tokens: {usage}")
+            if on_usage:
+                on_usage(usage)
 
         if is_multimodal:
             logger.info(f"Ejecutando modelo multimodal: {model_name}")
@@ -57,6 +113,20 @@ def run_pipeline(
                 image_path=image_path,
                 image_url=image_url,
                 system_prompt=system_prompt,
+                image_paths=image_paths,
+                on_usage=_record_usage,
+                history=history,
+                **kwargs,
+            )
+        elif tools:
+            logger.info(f"Ejecutando modelo de texto con {len(tools)} herramientas: {model_name}")
+            return chat_with_tools(
+                config=config,
+                user_input=user_input,
+                registry=tools,
+                system_prompt=system_prompt,
+                on_usage=_record_usage,
+                history=history,
                 **kwargs,
             )
         else:
@@ -65,6 +135,8 @@ def run_pipeline(
                 config=config,
                 user_input=user_input,
                 system_prompt=system_prompt,
+                on_usage=_record_usage,
+                history=history,
                 **kwargs,
             )
 
@@ -76,6 +148,260 @@ def run_pipeline(
         raise RuntimeError(f"Error al ejecutar el pipeline: {str(e)}")
 
 
+def run_cached_pipeline(
+    config: Dict,
+    user_input: str,
+    cache: Optional[SemanticCache] = None,
+    retrieval_user_id: Optional[Union[int, str]] = None,
+    on_usage: Optional[Callable[[Dict], None]] = None,
+    cache_partition: Optional[Union[int, str]] = None,
+    **kwargs,
+) -> str:
+    """
+    ``run_pipeline`` detrás de la caché semántica (si está activada).
+
+    Las solicitudes sin historial comparten la caché entre usuarios. Las que
+    llevan historial de la conversación solo la comparten dentro de
+    ``cache_partition`` (el chat): una respuesta basada en el historial de
+    uno ("¿cómo me llamo?") no puede servirse a otro. Sin partición van
+    siempre al modelo. Dentro del chat, una pregunta casi igual reutiliza la
+    respuesta anterior hasta que caduca aunque la conversación haya cambiado.
+
+    Tampoco se usa con imágenes, para usuarios con documentos en
+    ``/remember`` ni con herramientas: sus resultados (la hora, consultas
+    internas) cambian.
+    """
+    cache = cache or semantic_cache
+    multimodal = any(kwargs.get(name) for name in ("image_path", "image_url", "image_paths"))
+    with_history = bool(kwargs.get("history"))
+    personal = (with_history and cache_partition is None) or (
+        retrieval_user_id is not None and knowledge.count(retrieval_user_id) > 0
+    )
+    if not cache.enabled or multimodal or personal or kwargs.get("tools"):
+        return run_pipeline(
+            config, user_input, retrieval_user_id=retrieval_user_id, on_usage=on_usage, **kwargs
+        )
+
+    answer, cached = cache.get_or_compute(
+        config,
+        user_input,
+        lambda: run_pipeline(config, user_input, on_usage=on_usage, **kwargs),
+        system_prompt=kwargs.get("system_prompt"),
+        partition=str(cache_partition) if with_history else None,
+    )
+    if cached and on_usage:
+        on_usage({"model": config["model_name"].lower(), "cache_hit": True})
+    return answer
+
+
+def _with_passages(
+    config: Dict, user_id: int, user_input: str, store: Optional[KnowledgeBase] = None
+) -> str:
+    """Añade los fragmentos recuperados; si la búsqueda falla, sigue sin ellos."""
+    store = store or knowledge
+    try:
+        passages = store.search(user_id, config, user_input)
+    except Exception as e:
+        logger.warning(f"No se pudieron recuperar fragmentos para {user_id}: {str(e)}")
+        return user_input
+    if not passages:
+        return user_input
+    logger.info(f"{len(passages)} fragmentos recuperados para el usuario {user_id}")
+    return format_passages(passages, user_input)
+
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a chat between a user and an assistant. "
+    "Merge the previous summary with the new turns into a single concise summary "
+    "that keeps facts, decisions, names and open questions. Reply with the summary only."
+)
+
+
+def _format_turns(previous_summary: str, turns: List[Dict]) -> str:
+    lines = []
+    if previous_summary:
+        lines.append(f"Previous summary:\n{previous_summary}\n")
+    lines.append("New turns:")
+    lines.extend(f"{turn['role']}: {turn['content']}" for turn in turns)
+    return "\n".join(lines)
+
+
+def compact_conversation(
+    config: Dict, chat_id: Union[int, str], store: Optional[ConversationStore] = None
+) -> bool:
+    """
+    Etapa de compactación: resume los turnos antiguos del chat con el modelo
+    del usuario cuando el historial supera el umbral del almacén.
+
+    Pensada para ejecutarse en segundo plano después de responder, nunca en
+    el camino crítico de ``run_pipeline``.
+
+    Returns:
+        True si se guardó un resumen nuevo
+    """
+    store = store or conversations
+
+    def _summarize(previous_summary: str, turns: List[Dict]) -> str:
+        return chat_gpt(
+            config=config,
+            user_input=_format_turns(previous_summary, turns),
+            system_prompt=SUMMARY_PROMPT,
+        )
+
+    try:
+        return store.compact(chat_id, _summarize)
+    except Exception as e:
+        logger.error(f"Error al compactar el chat {chat_id}: {str(e)}")
+        return False
+
+
+MAP_PROMPT = (
+    "You are reading one part of a longer document. Extract everything in this part "
+    "that is relevant to the user's request below: facts, figures, names, code and "
+    "conclusions. Reply with concise notes only. If nothing is relevant, reply with "
+    "an empty message."
+)
+
+REDUCE_PROMPT = (
+    "You are given notes extracted, in order, from the parts of a long document. "
+    "Combine them into a single, coherent answer to the user's request. Do not "
+    "mention the notes or the parts."
+)
+
+
+def _document_request(instruction: str, label: str, text: str) -> str:
+    return f"Request: {instruction}\n\n{label}:\n{text}"
+
+
+def summarize_document(
+    config: Dict,
+    chunks: Iterable[str],
+    instruction: str,
+    max_concurrency: int = 4,
+    max_chunks: int = 100,
+    reduce_tokens: int = 3000,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+    on_usage: Optional[Callable[[Dict], None]] = None,
+) -> str:
+    """
+    Map-reduce sobre un documento fragmentado.
+
+    Cada fragmento se envía al modelo en paralelo (como mucho
+    ``max_concurrency`` a la vez) para extraer notas; las notas se combinan
+    después en una respuesta final, por niveles si no caben en una sola
+    llamada. ``chunks`` se consume a medida que hay hueco, así que el
+    documento nunca está entero en memoria.
+
+    Args:
+        config: Configuración del usuario
+        chunks: Fragmentos del documento (ver ``core.chunking``)
+        instruction: Petición del usuario sobre el documento
+        max_concurrency: Llamadas simultáneas al modelo
+        max_chunks: Fragmentos máximos; el resto del documento se ignora
+        reduce_tokens: Tamaño máximo de cada grupo de notas en la reducción
+        on_progress: Recibe (fragmentos terminados, fragmentos leídos)
+        on_usage: Recibe el uso de tokens de cada llamada
+
+    Returns:
+        Respuesta final del modelo
+
+    Raises:
+        ValueError: Si el documento está vacío
+        RuntimeError: Si falla alguna llamada al modelo
+    """
+    chunks = iter(chunks)
+    first = next(chunks, None)
+    if first is None:
+        raise ValueError("El documento está vacío o no contiene texto legible.")
+    second = next(chunks, None)
+    if second is None:
+        # Documento corto: una sola llamada con el prompt del usuario
+        answer = run_pipeline(
+            config, _document_request(instruction, "Document", first), on_usage=on_usage
+        )
+        if on_progress:
+            on_progress(1, 1)
+        return answer
+
+    def _chunks():
+        yield first
+        yield second
+        yield from chunks
+
+    slots = threading.BoundedSemaphore(max_concurrency)
+    lock = threading.Lock()
+    state = {"done": 0, "read": 0}
+
+    def _finished(_future) -> None:
+        slots.release()
+        with lock:
+            state["done"] += 1
+            done, read = state["done"], state["read"]
+        if on_progress:
+            on_progress(done, read)
+
+    def _map(chunk: str) -> str:
+        return run_pipeline(
+            config,
+            _document_request(instruction, "Document part", chunk),
+            system_prompt=MAP_PROMPT,
+            on_usage=on_usage,
+        ).strip()
+
+    futures = []
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        for chunk in _chunks():
+            if len(futures) >= max_chunks:
+                logger.warning(f"Documento recortado a {max_chunks} fragmentos")
+                break
+            # Solo se lee el siguiente fragmento cuando hay un hueco libre
+            slots.acquire()
+            if any(f.done() and f.exception() for f in futures):
+                slots.release()
+                break
+            with lock:
+                state["read"] += 1
+            future = pool.submit(_map, chunk)
+            future.add_done_callback(_finished)
+            futures.append(future)
+        notes = [future.result() for future in futures]
+
+    notes = [note for note in notes if note]
+    return _reduce(config, instruction, notes, reduce_tokens, max_concurrency, on_usage)
+
+
+def _reduce(
+    config: Dict,
+    instruction: str,
+    notes: List[str],
+    reduce_tokens: int,
+    max_concurrency: int,
+    on_usage: Optional[Callable[[Dict], None]],
+) -> str:
+    """Combina notas por niveles hasta que caben en una sola llamada."""
+    if not notes:
+        return "No encontré información relevante para tu solicitud en el documento."
+
+    def _combine(group: str) -> str:
+        return run_pipeline(
+            config,
+            _document_request(instruction, "Notes", group),
+            system_prompt=REDUCE_PROMPT,
+            on_usage=on_usage,
+        ).strip()
+
+    separated = (note + "\n\n---\n\n" for note in notes)
+    groups = list(chunk_segments(separated, reduce_tokens, config.get("model_name", "")))
+    if len(groups) == 1:
+        return _combine(groups[0])
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        merged = list(pool.map(_combine, groups))
+    if len(merged) >= len(notes):
+        # Notas demasiado largas para agruparse: una última llamada con lo que quepa
+        return _combine("\n\n---\n\n".join(merged))
+    return _reduce(config, instruction, merged, reduce_tokens, max_concurrency, on_usage)
+
+
 # # Ejemplo de uso
 # if __name__ == "__main__":
 #     # Configuración básica
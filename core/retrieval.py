@@ -0,0 +1,450 @@
+"""
+Índice de documentos por usuario para respuestas con recuperación (RAG).
+
+- Los embeddings se piden al endpoint ``/embeddings`` del usuario, en lotes.
+  ``HashingEmbedder`` es un sustituto local sin red (tests y desarrollo).
+- Cada usuario tiene una matriz de vectores normalizados en un archivo
+  mapeado en memoria (``<root>/<user_id>/vectors.<dtype>``) que crece por
+  duplicación, y un ``meta.json`` con dimensión, filas usadas y modelo. El
+  texto de cada fragmento vive en SQLite (``rag_passages``), indexado por fila.
+- La búsqueda es un producto matriz-vector (similitud coseno, ya que los
+  vectores están normalizados) seguido de ``argpartition`` para el top-k.
+- Los embeddings de las consultas se cachean (LRU).
+
+NumPy se importa en el primer uso, no al importar el módulo.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+if TYPE_CHECKING:
+    import numpy
+
+logger = logging.getLogger(__name__)
+
+np = None
+
+
+def load_numpy():
+    global np
+    if np is None:
+        import numpy as _np
+
+        np = _np
+    return np
+
+
+class HashingEmbedder:
+    """
+    Embeddings locales por hashing de palabras (sin red ni modelo). Capturan
+    coincidencias léxicas, suficiente para tests y desarrollo.
+    """
+
+    name = "hashing"
+
+    def __init__(self, dimensions: int = 256) -> None:
+        self.dimensions = dimensions
+
+    def embed(self, texts: List[str]) -> "numpy.ndarray":
+        np = load_numpy()
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in re.findall(r"\w+", text.lower()):
+                digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+                value = int.from_bytes(digest, "little")
+                vectors[row, value % self.dimensions] += 1.0 if value >> 63 else -1.0
+        return vectors
+
+
+class OpenAIEmbedder:
+    """Embeddings del endpoint ``/embeddings`` compatible con OpenAI del usuario."""
+
+    def __init__(
+        self, api_key: str, base_url: str, model: str, dimensions: Optional[int] = None
+    ) -> None:
+        self.api_key = api_key
+        self.base_url = base_url
+        self.name = model
+        self.dimensions = dimensions
+
+    def embed(self, texts: List[str]) -> "numpy.ndarray":
+        from core.llm_clients import get_client
+
+        np = load_numpy()
+        kwargs = {"dimensions": self.dimensions} if self.dimensions else {}
+        response = get_client(self.api_key, self.base_url).embeddings.create(
+            model=self.name, input=texts, **kwargs
+        )
+        data = sorted(response.data, key=lambda item: item.index)
+        return np.asarray([item.embedding for item in data], dtype=np.float32)
+
+
+EmbedderFactory = Callable[[Dict], object]
+
+
+def make_embedder(config: Dict, model: str, dimensions: Optional[int] = None):
+    """Embedder para la configuración del usuario; ``model="hashing"`` usa el local."""
+    if model == HashingEmbedder.name:
+        return HashingEmbedder(dimensions or 256)
+    return OpenAIEmbedder(config["api_key"], config["base_url"], model, dimensions)
+
+
+@dataclass
+class Passage:
+    text: str
+    source: str
+    score: float
+
+
+class VectorFile:
+    """
+    Matriz ``(filas, dimensión)`` en un archivo mapeado en memoria, con
+    capacidad que se duplica al llenarse. ``meta.json`` se reescribe de forma
+    atómica después de cada escritura de vectores.
+    """
+
+    def __init__(self, directory: Path, dimensions: int, model: str, dtype: str = "float32") -> None:
+        self.directory = directory
+        self.meta_path = directory / "meta.json"
+        if self.meta_path.exists():
+            self.meta = json.loads(self.meta_path.read_text(encoding="utf-8"))
+            self.check(dimensions, model)
+        else:
+            self.meta = {"dimensions": dimensions, "model": model, "dtype": dtype, "count": 0, "capacity": 0}
+        self.path = directory / f"vectors.{self.meta['dtype']}"
+        self._matrix = None
+
+    def check(self, dimensions: int, model: str) -> None:
+        """
+        Raises:
+            ValueError: Si el índice se creó con otro modelo o dimensión
+        """
+        if self.meta["dimensions"] != dimensions or self.meta["model"] != model:
+            raise ValueError(
+                "El índice se creó con otro modelo de embeddings "
+                f"({self.meta['model']}, {self.meta['dimensions']} dim). Usa /forget para reiniciarlo."
+            )
+
+    @property
+    def count(self) -> int:
+        return self.meta["count"]
+
+    def _open(self, capacity: int) -> None:
+        np = load_numpy()
+        shape = (max(capacity, 1), self.meta["dimensions"])
+        mode = "r+" if self.path.exists() else "w+"
+        if mode == "r+":
+            needed = shape[0] * shape[1] * np.dtype(self.meta["dtype"]).itemsize
+            if self.path.stat().st_size < needed:
+                with open(self.path, "r+b") as handle:
+                    handle.truncate(needed)
+        self._matrix = np.memmap(self.path, dtype=self.meta["dtype"], mode=mode, shape=shape)
+        self.meta["capacity"] = shape[0]
+
+    def matrix(self) -> "numpy.ndarray":
+        if self._matrix is None:
+            self._open(self.meta["capacity"])
+        return self._matrix[: self.count]
+
+    def append(self, vectors: "numpy.ndarray") -> int:
+        """Añade filas ya normalizadas; devuelve el índice de la primera."""
+        start = self.count
+        needed = start + len(vectors)
+        if self._matrix is None or needed > self.meta["capacity"]:
+            capacity = max(self.meta["capacity"], 1024)
+            while capacity < needed:
+                capacity *= 2
+            self._matrix = None
+            self._open(capacity)
+        self._matrix[start:needed] = vectors
+        self._matrix.flush()
+        self.meta["count"] = needed
+        tmp = self.meta_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.meta), encoding="utf-8")
+        os.replace(tmp, self.meta_path)
+        return start
+
+    def search(self, query: "numpy.ndarray", k: int) -> List[Tuple[int, float]]:
+        np = load_numpy()
+        matrix = self.matrix()
+        if not len(matrix):
+            return []
+        if matrix.dtype == np.float32:
+            scores = matrix @ query
+        else:
+            # float16 ocupa la mitad pero NumPy no lo multiplica con BLAS: por bloques
+            scores = np.empty(len(matrix), dtype=np.float32)
+            for start in range(0, len(matrix), 16384):
+                block = matrix[start : start + 16384].astype(np.float32)
+                np.dot(block, query, out=scores[start : start + len(block)])
+        k = min(k, len(scores))
+        top = np.argpartition(scores, -k)[-k:]
+        top = top[np.argsort(scores[top])[::-1]]
+        return [(int(row), float(scores[row])) for row in top]
+
+
+def normalize(vectors: "numpy.ndarray") -> "numpy.ndarray":
+    """Normaliza cada fila a norma 1: el producto escalar pasa a ser el coseno."""
+    np = load_numpy()
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class KnowledgeBase:
+    """
+    Documentos recordados por cada usuario (``/remember``).
+
+    Sin ``root`` está desactivada y ``search`` no devuelve nada.
+    """
+
+    def __init__(self, root: Optional[Union[str, Path]] = None, db_path=None, **kwargs) -> None:
+        self._indexes: "OrderedDict[int, VectorFile]" = OrderedDict()
+        self._queries: "OrderedDict[Tuple[str, str, str], numpy.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._user_locks: Dict[int, threading.Lock] = {}
+        self.configure(root, db_path, **kwargs)
+
+    def configure(
+        self,
+        root: Optional[Union[str, Path]] = None,
+        db_path: Optional[Union[str, Path]] = None,
+        model: str = "text-embedding-3-small",
+        dimensions: Optional[int] = 256,
+        dtype: str = "float32",
+        batch_size: int = 64,
+        top_k: int = 4,
+        min_score: float = 0.25,
+        query_cache_size: int = 1024,
+        max_open_indexes: int = 64,
+        embedder_factory: Optional[EmbedderFactory] = None,
+    ) -> None:
+        self.root = Path(root) if root else None
+        self.db_path = Path(db_path) if db_path else None
+        self.model = model
+        self.dimensions = dimensions
+        self.dtype = dtype
+        self.batch_size = batch_size
+        self.top_k = top_k
+        self.min_score = min_score
+        self.query_cache_size = query_cache_size
+        self.max_open_indexes = max_open_indexes
+        self.embedder_factory = embedder_factory
+        with self._lock:
+            self._indexes.clear()
+            self._queries.clear()
+        if self.enabled:
+            self._init_db()
+
+    @property
+    def enabled(self) -> bool:
+        return self.root is not None and self.db_path is not None
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    def _init_db(self) -> None:
+        conn = self._connect()
+        try:
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS rag_passages (
+                user_id INTEGER NOT NULL,
+                row INTEGER NOT NULL,
+                source TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (user_id, row)
+            )
+            """)
+        finally:
+            conn.close()
+
+    def embedder(self, config: Dict):
+        if self.embedder_factory:
+            return self.embedder_factory(config)
+        return make_embedder(config, self.model, self.dimensions)
+
+    def _user_lock(self, user_id: Union[int, str]) -> threading.Lock:
+        with self._lock:
+            return self._user_locks.setdefault(user_id, threading.Lock())
+
+    def _index(self, user_id: Union[int, str], dimensions: Optional[int] = None, model: str = "") -> Optional[VectorFile]:
+        """Índice abierto del usuario; con ``dimensions`` lo crea si no existe."""
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None:
+                self._indexes.move_to_end(user_id)
+        if index is not None:
+            if dimensions is not None:
+                index.check(dimensions, model)
+            return index
+        directory = self.root / str(user_id)
+        if not (directory / "meta.json").exists():
+            if dimensions is None:
+                return None
+            directory.mkdir(parents=True, exist_ok=True)
+        if dimensions is None:
+            meta = json.loads((directory / "meta.json").read_text(encoding="utf-8"))
+            dimensions, model = meta["dimensions"], meta["model"]
+        index = VectorFile(directory, dimensions, model, self.dtype)
+        with self._lock:
+            index = self._indexes.setdefault(user_id, index)
+            while len(self._indexes) > self.max_open_indexes:
+                self._indexes.popitem(last=False)
+        return index
+
+    def count(self, user_id: Union[int, str]) -> int:
+        if not self.enabled:
+            return 0
+        index = self._index(user_id)
+        return index.count if index else 0
+
+    def add_document(self, user_id: Union[int, str], config: Dict, source: str, chunks: Iterable[str]) -> int:
+        """
+        Indexa los fragmentos de un documento en lotes de ``batch_size``: una
+        llamada a ``/embeddings`` y una transacción por lote.
+
+        Returns:
+            Número de fragmentos indexados
+        """
+        if not self.enabled:
+            raise ValueError("La memoria de documentos no está activada.")
+        np = load_numpy()
+        embedder = self.embedder(config)
+        added = 0
+        batch: List[str] = []
+
+        def _flush() -> None:
+            nonlocal added
+            vectors = normalize(np.asarray(embedder.embed(batch), dtype=np.float32))
+            with self._user_lock(user_id):
+                index = self._index(user_id, vectors.shape[1], embedder.name)
+                start = index.append(vectors.astype(index.meta["dtype"]))
+                now = time.time()
+                conn = self._connect()
+                try:
+                    conn.execute("BEGIN")
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO rag_passages (user_id, row, source, content, created_at) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        [(user_id, start + i, source, text, now) for i, text in enumerate(batch)],
+                    )
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+                finally:
+                    conn.close()
+            added += len(batch)
+            batch.clear()
+
+        for chunk in chunks:
+            if chunk.strip():
+                batch.append(chunk)
+            if len(batch) >= self.batch_size:
+                _flush()
+        if batch:
+            _flush()
+        logger.info(f"Usuario {user_id}: {added} fragmentos indexados de {source}")
+        return added
+
+    def _query_vector(self, config: Dict, query: str, embedder) -> "numpy.ndarray":
+        key = (embedder.name, config.get("base_url") or "", query)
+        with self._lock:
+            vector = self._queries.get(key)
+            if vector is not None:
+                self._queries.move_to_end(key)
+                return vector
+        np = load_numpy()
+        vector = normalize(np.asarray(embedder.embed([query]), dtype=np.float32))[0]
+        with self._lock:
+            self._queries[key] = vector
+            while len(self._queries) > self.query_cache_size:
+                self._queries.popitem(last=False)
+        return vector
+
+    def search(
+        self,
+        user_id: Union[int, str],
+        config: Dict,
+        query: str,
+        k: Optional[int] = None,
+        min_score: Optional[float] = None,
+    ) -> List[Passage]:
+        """Los ``k`` fragmentos más parecidos a ``query`` con similitud >= ``min_score``."""
+        if not self.enabled or not query.strip():
+            return []
+        k = k or self.top_k
+        min_score = self.min_score if min_score is None else min_score
+        index = self._index(user_id)
+        if index is None or not index.count:
+            return []
+        vector = self._query_vector(config, query, self.embedder(config))
+        # El lock evita leer la matriz mientras un /remember la redimensiona
+        with self._user_lock(user_id):
+            hits = [(row, score) for row, score in index.search(vector, k) if score >= min_score]
+        if not hits:
+            return []
+        conn = self._connect()
+        try:
+            rows = dict(
+                (row, (source, content))
+                for row, source, content in conn.execute(
+                    f"SELECT row, source, content FROM rag_passages WHERE user_id = ? "
+                    f"AND row IN ({', '.join('?' for _ in hits)})",
+                    (user_id, *(row for row, _ in hits)),
+                )
+            )
+        finally:
+            conn.close()
+        return [
+            Passage(text=rows[row][1], source=rows[row][0], score=score)
+            for row, score in hits
+            if row in rows
+        ]
+
+    def clear(self, user_id: Union[int, str]) -> int:
+        """Borra el índice y los fragmentos del usuario; devuelve cuántos había."""
+        if not self.enabled:
+            return 0
+        with self._user_lock(user_id):
+            with self._lock:
+                self._indexes.pop(user_id, None)
+            conn = self._connect()
+            try:
+                removed = conn.execute("DELETE FROM rag_passages WHERE user_id = ?", (user_id,)).rowcount
+            finally:
+                conn.close()
+            directory = self.root / str(user_id)
+            if directory.exists():
+                for path in directory.iterdir():
+                    path.unlink()
+                directory.rmdir()
+        return removed
+
+
+def format_passages(passages: List[Passage], user_input: str) -> str:
+    """Antepone los fragmentos recuperados a la pregunta del usuario."""
+    context = "\n\n".join(
+        f"[{number}] ({passage.source})\n{passage.text.strip()}"
+        for number, passage in enumerate(passages, start=1)
+    )
+    return (
+        "Relevant passages from the user's saved documents (use them if they help, "
+        f"cite them as [n]):\n\n{context}\n\nUser message:\n{user_input}"
+    )
+
+
+# Instancia compartida; bot/main.py la configura con data/index y data/bot.db
+knowledge = KnowledgeBase()
@@ -0,0 +1,310 @@
+"""
+Caché semántica de respuestas (opcional).
+
+Pensada para personas tipo FAQ, donde la mayoría de preguntas son casi
+iguales ("¿qué horario tienen?" / "horario de atención"). Cada respuesta se
+guarda junto al embedding de su pregunta normalizada, en un ámbito
+``(base_url, model_name, system_prompt)``: un mismo texto con otro modelo u
+otro prompt del sistema nunca comparte respuesta. Un ámbito puede llevar
+además una partición (p. ej. el chat) para respuestas que no deben salir de él.
+
+- Búsqueda: una sola matriz en memoria con todas las preguntas; el producto
+  matriz-vector da la similitud coseno y se descartan las filas de otros
+  ámbitos o caducadas. Por encima de ``threshold`` se devuelve la respuesta.
+- Preguntas idénticas tras normalizar se resuelven sin pedir el embedding.
+- Capacidad acotada: al llenarse se reemplaza la fila menos usada
+  recientemente (``lru``) o la de menos aciertos (``lfu``).
+- Auditoría: una fracción ``audit_rate`` de los aciertos se recalcula con el
+  modelo; si la respuesta nueva se parece poco a la guardada se cuenta como
+  falso acierto y se reemplaza. ``stats()`` expone las métricas.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import random
+import re
+import threading
+import time
+import unicodedata
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+
+from core.retrieval import EmbedderFactory, load_numpy, make_embedder, normalize
+
+if TYPE_CHECKING:
+    import numpy
+
+logger = logging.getLogger(__name__)
+
+Scope = Tuple[str, str, str]
+
+
+def normalize_query(text: str) -> str:
+    """Minúsculas, sin acentos, signos ni espacios repetidos."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(re.findall(r"\w+", text))
+
+
+def scope_for(config: Dict, system_prompt: Optional[str] = None) -> Scope:
+    prompt = system_prompt or config.get("system_prompt") or ""
+    return (
+        config.get("base_url") or "",
+        (config.get("model_name") or "").lower(),
+        hashlib.sha1(prompt.encode("utf-8")).hexdigest(),
+    )
+
+
+class SemanticCache:
+    """
+    Args:
+        threshold: Similitud coseno mínima para reutilizar una respuesta;
+            0 desactiva la caché
+        capacity: Respuestas guardadas como máximo (entre todos los ámbitos)
+        ttl_seconds: Antigüedad máxima de una respuesta
+        eviction: ``lru`` o ``lfu``
+        audit_rate: Fracción de aciertos que se recalculan para auditarlos
+        audit_threshold: Similitud mínima entre la respuesta guardada y la
+            recalculada; por debajo es un falso acierto
+        model: Modelo de embeddings (ver ``core.retrieval.make_embedder``)
+        dimensions: Dimensión pedida al endpoint de embeddings
+        embedder_factory: Sustituye a ``make_embedder`` (tests)
+    """
+
+    def __init__(self, threshold: float = 0.0, **kwargs) -> None:
+        self._lock = threading.Lock()
+        self.configure(threshold, **kwargs)
+
+    def configure(
+        self,
+        threshold: float = 0.0,
+        capacity: int = 5000,
+        ttl_seconds: float = 86400,
+        eviction: str = "lru",
+        audit_rate: float = 0.02,
+        audit_threshold: float = 0.8,
+        model: str = "text-embedding-3-small",
+        dimensions: Optional[int] = 256,
+        embedder_factory: Optional[EmbedderFactory] = None,
+        rng: Optional[random.Random] = None,
+    ) -> None:
+        if eviction not in ("lru", "lfu"):
+            raise ValueError(f"Política de desalojo desconocida: {eviction}")
+        self.threshold = threshold
+        self.capacity = capacity
+        self.ttl_seconds = ttl_seconds
+        self.eviction = eviction
+        self.audit_rate = audit_rate
+        self.audit_threshold = audit_threshold
+        self.model = model
+        self.dimensions = dimensions
+        self.embedder_factory = embedder_factory
+        self._rng = rng or random.Random()
+        self.clear()
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0 and self.capacity > 0
+
+    def clear(self) -> None:
+        with self._lock:
+            self._vectors: Optional["numpy.ndarray"] = None
+            self._scope_ids: Optional["numpy.ndarray"] = None
+            self._created: Optional["numpy.ndarray"] = None
+            self._last_used: Optional["numpy.ndarray"] = None
+            self._hits: Optional["numpy.ndarray"] = None
+            self._answers: List[Optional[str]] = []
+            self._keys: List[Optional[Tuple[int, str]]] = []
+            self._exact: Dict[Tuple[int, str], int] = {}
+            self._scopes: Dict[Tuple[Scope, str], int] = {}
+            self._size = 0
+            self._metrics = dict.fromkeys(
+                ("lookups", "hits", "exact_hits", "misses", "bypassed", "inserts",
+                 "evictions", "audits", "false_hits", "errors"),
+                0,
+            )
+
+    def _embedder(self, config: Dict):
+        if self.embedder_factory:
+            return self.embedder_factory(config)
+        return make_embedder(config, self.model, self.dimensions)
+
+    def _embed(self, config: Dict, text: str) -> "numpy.ndarray":
+        np = load_numpy()
+        return normalize(np.asarray(self._embedder(config).embed([text]), dtype=np.float32))[0]
+
+    def _allocate(self, dimensions: int) -> None:
+        np = load_numpy()
+        self._vectors = np.zeros((self.capacity, dimensions), dtype=np.float32)
+        self._scope_ids = np.full(self.capacity, -1, dtype=np.int32)
+        self._created = np.zeros(self.capacity, dtype=np.float64)
+        self._last_used = np.zeros(self.capacity, dtype=np.float64)
+        self._hits = np.zeros(self.capacity, dtype=np.int64)
+        self._answers = [None] * self.capacity
+        self._keys = [None] * self.capacity
+        self._exact.clear()
+        self._size = 0
+
+    def _count(self, name: str) -> None:
+        self._metrics[name] += 1
+
+    # ------------------------------------------------------------- búsqueda
+
+    def _lookup(self, scope_id: int, key: str, vector: Optional["numpy.ndarray"], now: float):
+        """Fila y similitud del mejor candidato vigente, o (None, 0)."""
+        np = load_numpy()
+        if self._vectors is None:
+            return None, 0.0
+        row = self._exact.get((scope_id, key))
+        if row is not None:
+            if now - self._created[row] <= self.ttl_seconds:
+                return row, 1.0
+            return None, 0.0
+        if vector is None or vector.shape[0] != self._vectors.shape[1] or not self._size:
+            return None, 0.0
+        scores = self._vectors[: self._size] @ vector
+        valid = (self._scope_ids[: self._size] == scope_id) & (
+            now - self._created[: self._size] <= self.ttl_seconds
+        )
+        scores = np.where(valid, scores, -1.0)
+        row = int(np.argmax(scores))
+        return row, float(scores[row])
+
+    def _slot(self, now: float) -> int:
+        """Fila libre o la que se desaloja según la política."""
+        np = load_numpy()
+        if self._size < self.capacity:
+            self._size += 1
+            return self._size - 1
+        expired = np.flatnonzero(now - self._created > self.ttl_seconds)
+        if len(expired):
+            row = int(expired[0])
+        elif self.eviction == "lfu":
+            # Menos aciertos; a igualdad, el usado hace más tiempo
+            row = int(np.lexsort((self._last_used, self._hits))[0])
+        else:
+            row = int(np.argmin(self._last_used))
+        self._count("evictions")
+        old_key = self._keys[row]
+        if old_key is not None and self._exact.get(old_key) == row:
+            del self._exact[old_key]
+        return row
+
+    def _store(self, scope_id: int, key: str, vector: "numpy.ndarray", answer: str, now: float) -> None:
+        if self._vectors is None or self._vectors.shape[1] != vector.shape[0]:
+            # Primer uso o cambio de modelo de embeddings
+            self._allocate(vector.shape[0])
+        row = self._slot(now)
+        self._vectors[row] = vector
+        self._scope_ids[row] = scope_id
+        self._created[row] = now
+        self._last_used[row] = now
+        self._hits[row] = 0
+        self._answers[row] = answer
+        self._keys[row] = (scope_id, key)
+        self._exact[(scope_id, key)] = row
+        self._count("inserts")
+
+    # ---------------------------------------------------------------- API
+
+    def get_or_compute(
+        self,
+        config: Dict,
+        query: str,
+        compute: Callable[[], str],
+        system_prompt: Optional[str] = None,
+        partition: Optional[str] = None,
+    ) -> Tuple[str, bool]:
+        """
+        Devuelve la respuesta guardada si hay una pregunta lo bastante parecida
+        en el mismo ámbito; si no, llama a ``compute`` y guarda el resultado.
+        Con ``partition`` solo se comparten respuestas dentro de esa partición.
+
+        Returns:
+            (respuesta, True si salió de la caché)
+        """
+        key = normalize_query(query)
+        if not self.enabled or not key:
+            with self._lock:
+                self._count("bypassed")
+            return compute(), False
+
+        now = time.time()
+        with self._lock:
+            self._count("lookups")
+            report = self._metrics["lookups"] % 500 == 0
+            scope = (scope_for(config, system_prompt), partition or "")
+            scope_id = self._scopes.setdefault(scope, len(self._scopes))
+            row, score = self._lookup(scope_id, key, None, now)
+
+        if report:
+            logger.info(f"Caché semántica: {self.stats()}")
+
+        vector = None
+        if row is None:
+            try:
+                vector = self._embed(config, key)
+            except Exception as e:
+                # Sin embedding no hay caché, pero la solicitud sigue
+                logger.warning(f"Caché semántica sin embedding: {str(e)}")
+                with self._lock:
+                    self._count("errors")
+                return compute(), False
+            with self._lock:
+                row, score = self._lookup(scope_id, key, vector, now)
+
+        with self._lock:
+            hit = row is not None and score >= self.threshold
+            if hit:
+                self._count("exact_hits" if score >= 1.0 and vector is None else "hits")
+                self._hits[row] += 1
+                self._last_used[row] = now
+                answer = self._answers[row]
+                audit = self._rng.random() < self.audit_rate
+            else:
+                self._count("misses")
+
+        if hit and not audit:
+            return answer, True
+        fresh = compute()
+        if hit:
+            self._audit(config, row, answer, fresh)
+            return fresh, False
+        if vector is not None:
+            with self._lock:
+                self._store(scope_id, key, vector, fresh, time.time())
+        return fresh, False
+
+    def _audit(self, config: Dict, row: int, cached: str, fresh: str) -> None:
+        """Compara la respuesta guardada con la recién calculada."""
+        try:
+            similarity = float(self._embed(config, cached) @ self._embed(config, fresh))
+        except Exception as e:
+            logger.warning(f"No se pudo auditar la caché semántica: {str(e)}")
+            return
+        with self._lock:
+            self._count("audits")
+            if similarity < self.audit_threshold:
+                self._count("false_hits")
+                # La respuesta guardada ya no vale: se reemplaza por la nueva
+                if self._answers[row] == cached:
+                    self._answers[row] = fresh
+                    self._created[row] = time.time()
+                logger.info(f"Falso acierto de la caché semántica (similitud {similarity:.2f})")
+
+    def stats(self) -> Dict[str, float]:
+        """Contadores, tamaño y tasas de acierto y de falsos aciertos auditados."""
+        with self._lock:
+            metrics: Dict[str, float] = dict(self._metrics)
+            metrics["size"] = self._size
+        served = metrics["hits"] + metrics["exact_hits"]
+        metrics["hit_rate"] = served / metrics["lookups"] if metrics["lookups"] else 0.0
+        metrics["false_hit_rate"] = (
+            metrics["false_hits"] / metrics["audits"] if metrics["audits"] else 0.0
+        )
+        return metrics
+
+
+# Instancia compartida; bot/main.py la configura (desactivada por defecto)
+semantic_cache = SemanticCache()
@@ -0,0 +1,162 @@
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Optional, Protocol, Sequence
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+# Coste aproximado de una imagen en modo "auto/high" de OpenAI (512px tiles)
+IMAGE_TOKENS = 765
+# Sobrecoste por mensaje del formato chat (rol, separadores) y por respuesta
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_OVERHEAD_TOKENS = 3
+TRUNCATION_MARKER = "\n[...]\n"
+
+
+class Tokenizer(Protocol):
+    def count(self, text: str) -> int: ...
+
+
+class HeuristicTokenizer:
+    """
+    Estimación barata sin dependencias: ~4 caracteres ASCII por token y ~2
+    para el resto (acentos, emojis, CJK). Sobreestima ligeramente, que es lo
+    seguro para no pasarse de la ventana de contexto.
+    """
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        ascii_chars = len(text.encode("ascii", "ignore"))
+        other = len(text) - ascii_chars
+        return math.ceil(ascii_chars / 4 + other / 2)
+
+
+class TiktokenTokenizer:
+    """Tokenizador BPE exacto para modelos OpenAI (requiere ``tiktoken``)."""
+
+    def __init__(self, model_name: str) -> None:
+        import tiktoken
+
+        try:
+            self._encoding = tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            self._encoding = tiktoken.get_encoding("cl100k_base")
+
+    def count(self, text: str) -> int:
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+
+class TokenEstimator:
+    """
+    Cuenta tokens con memoización: los system prompts y textos repetidos
+    solo se tokenizan una vez.
+    """
+
+    def __init__(self, tokenizer: Optional[Tokenizer] = None, cache_size: int = 4096) -> None:
+        self.tokenizer = tokenizer or HeuristicTokenizer()
+        self.count = lru_cache(maxsize=cache_size)(self._count)
+
+    def _count(self, text: str) -> int:
+        return self.tokenizer.count(text)
+
+    def count_messages(self, messages: List[Dict], images: int = 0) -> int:
+        total = REPLY_OVERHEAD_TOKENS + images * IMAGE_TOKENS
+        for message in messages:
+            total += MESSAGE_OVERHEAD_TOKENS
+            content = message.get("content")
+            if isinstance(content, str):
+                total += self.count(content)
+            elif isinstance(content, list):
+                for part in content:
+                    if part.get("type") == "text":
+                        total += self.count(part.get("text", ""))
+                    else:
+                        total += IMAGE_TOKENS
+        return total
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Recorta conservando inicio y final, que suelen llevar la pregunta."""
+        if max_tokens <= 0:
+            return ""
+        if self.count(text) <= max_tokens:
+            return text
+        lo, hi = 0, len(text)
+        while lo < hi:
+            keep = (lo + hi + 1) // 2
+            head, tail = text[: keep // 2], text[len(text) - keep // 2 :]
+            if self.count(head + TRUNCATION_MARKER + tail) <= max_tokens:
+                lo = keep
+            else:
+                hi = keep - 1
+        return text[: lo // 2] + TRUNCATION_MARKER + text[len(text) - lo // 2 :]
+
+
+@lru_cache(maxsize=64)
+def get_estimator(model_name: str = "") -> TokenEstimator:
+    """Estimador por modelo: BPE si ``tiktoken`` está instalado, heurística si no."""
+    try:
+        return TokenEstimator(TiktokenTokenizer(model_name))
+    except ImportError:
+        return TokenEstimator()
+    except Exception as e:
+        logger.warning(f"No se pudo cargar tiktoken para {model_name}: {str(e)}")
+        return TokenEstimator()
+
+
+@dataclass
+class PromptBudget:
+    """Resultado de presupuestar una solicitud antes de enviarla."""
+
+    user_input: str
+    prompt_tokens: int
+    context_tokens: Optional[int]
+    reserved_output_tokens: int
+    truncated: bool = False
+
+
+def plan_prompt(
+    model_name: str,
+    system_prompt: str,
+    user_input: str,
+    images: int = 0,
+    context_tokens: Optional[int] = None,
+    max_output_tokens: Optional[int] = None,
+    history: Sequence[Dict] = (),
+) -> PromptBudget:
+    """
+    Verifica que la solicitud quepa en la ventana de contexto y, si no,
+    recorta el texto del usuario. ``history`` son los mensajes previos del
+    chat que se envían entre el system prompt y la entrada actual.
+
+    Raises:
+        ValueError: Si ni siquiera el system prompt y las imágenes caben
+    """
+    estimator = get_estimator(model_name)
+    fixed = (
+        REPLY_OVERHEAD_TOKENS
+        + 2 * MESSAGE_OVERHEAD_TOKENS
+        + estimator.count(system_prompt or "")
+        + images * IMAGE_TOKENS
+        + sum(MESSAGE_OVERHEAD_TOKENS + estimator.count(m["content"]) for m in history)
+    )
+    user_tokens = estimator.count(user_input)
+    if not context_tokens:
+        return PromptBudget(user_input, fixed + user_tokens, None, 0)
+
+    reserve = min(max_output_tokens or 1024, context_tokens // 4)
+    available = context_tokens - reserve - fixed
+    if available <= 0:
+        raise ValueError(
+            "La solicitud excede la ventana de contexto del modelo "
+            f"({context_tokens} tokens); reduce el system prompt o las imágenes."
+        )
+    if user_tokens <= available:
+        return PromptBudget(user_input, fixed + user_tokens, context_tokens, reserve)
+
+    truncated = estimator.truncate(user_input, available)
+    logger.info(f"Entrada recortada de {user_tokens} a ~{available} tokens para {model_name}")
+    return PromptBudget(
+        truncated, fixed + estimator.count(truncated), context_tokens, reserve, truncated=True
+    )
@@ -0,0 +1,404 @@
+"""
+Llamadas a herramientas (function calling).
+
+``ToolRegistry`` guarda herramientas asíncronas con su esquema JSON y las
+expone al modelo en el formato ``tools`` de la API de chat. ``chat_with_tools``
+ejecuta el bucle:
+
+1. Se llama al modelo con las herramientas disponibles.
+2. Si pide varias herramientas en el mismo turno, se ejecutan a la vez, cada
+   una con su propio tiempo límite. Un fallo o un tiempo agotado se devuelve
+   al modelo como texto de error; no aborta la solicitud.
+3. Los resultados se añaden a los mensajes y se vuelve a llamar al modelo.
+
+El bucle termina cuando el modelo responde sin pedir herramientas, o al
+agotar ``max_steps`` llamadas o ``deadline_seconds``. En ese caso se pide una
+última respuesta sin herramientas si aún queda tiempo.
+
+Las consultas internas se conectan con ``register_lookup`` a través de
+``LookupService`` (clase abstracta), que en los tests se sustituye por un stub.
+"""
+
+import abc
+import ast
+import asyncio
+import json
+import logging
+import math
+import operator
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+from core.llm_clients import get_client
+
+logger = logging.getLogger(__name__)
+
+ToolFunction = Callable[..., Awaitable[Any]]
+
+
+@dataclass(frozen=True)
+class Tool:
+    name: str
+    description: str
+    # Esquema JSON de los argumentos (``type: object``)
+    parameters: Dict
+    func: ToolFunction
+    timeout: float = 5.0
+
+    def schema(self) -> Dict:
+        return {
+            "type": "function",
+            "function": {
+                "name": self.name,
+                "description": self.description,
+                "parameters": self.parameters,
+            },
+        }
+
+
+class ToolRegistry:
+    """Herramientas disponibles para el modelo, por nombre."""
+
+    def __init__(self) -> None:
+        self._tools: Dict[str, Tool] = {}
+
+    def __len__(self) -> int:
+        return len(self._tools)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._tools
+
+    def add(self, tool: Tool) -> Tool:
+        if not asyncio.iscoroutinefunction(tool.func):
+            raise TypeError(f"La herramienta {tool.name} debe ser una corutina")
+        self._tools[tool.name] = tool
+        return tool
+
+    def register(
+        self,
+        description: str,
+        parameters: Optional[Dict] = None,
+        name: Optional[str] = None,
+        timeout: float = 5.0,
+    ) -> Callable[[ToolFunction], ToolFunction]:
+        """Decorador: registra una corutina como herramienta."""
+
+        def _decorator(func: ToolFunction) -> ToolFunction:
+            self.add(
+                Tool(
+                    name=name or func.__name__,
+                    description=description,
+                    parameters=parameters or {"type": "object", "properties": {}},
+                    func=func,
+                    timeout=timeout,
+                )
+            )
+            return func
+
+        return _decorator
+
+    def schemas(self) -> List[Dict]:
+        return [tool.schema() for tool in self._tools.values()]
+
+    async def execute(self, name: str, arguments: str, budget: Optional[float] = None) -> str:
+        """
+        Ejecuta una llamada del modelo y devuelve el contenido del mensaje
+        ``tool``. Nunca lanza: los errores se devuelven como texto.
+
+        Args:
+            name: Herramienta pedida por el modelo
+            arguments: Argumentos en JSON, tal como los envía el modelo
+            budget: Tiempo que queda de la solicitud; acota el de la herramienta
+        """
+        tool = self._tools.get(name)
+        if tool is None:
+            return f"Error: la herramienta {name} no existe"
+        try:
+            kwargs = json.loads(arguments or "{}")
+            if not isinstance(kwargs, dict):
+                raise ValueError("se esperaba un objeto")
+        except ValueError as e:
+            return f"Error: argumentos inválidos para {name}: {str(e)}"
+
+        timeout = tool.timeout if budget is None else max(min(tool.timeout, budget), 0.0)
+        started = time.monotonic()
+        try:
+            result = await asyncio.wait_for(tool.func(**kwargs), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Herramienta {name} sin respuesta en {timeout:.1f}s")
+            return f"Error: la herramienta {name} superó el tiempo límite ({timeout:.1f}s)"
+        except Exception as e:
+            logger.warning(f"Herramienta {name} falló: {str(e)}")
+            return f"Error en {name}: {str(e)}"
+        logger.info(f"Herramienta {name} ejecutada en {time.monotonic() - started:.3f}s")
+        return result if isinstance(result, str) else json.dumps(result, ensure_ascii=False, default=str)
+
+
+# ------------------------------------------------------------- herramientas
+
+_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+}
+
+_FUNCTIONS = {
+    name: getattr(math, name)
+    for name in ("sqrt", "log", "log10", "exp", "sin", "cos", "tan", "floor", "ceil", "factorial")
+}
+_FUNCTIONS.update(abs=abs, round=round)
+_CONSTANTS = {"pi": math.pi, "e": math.e}
+
+
+def evaluate(expression: str) -> float:
+    """
+    Evalúa una expresión aritmética sin ``eval``: solo números, operadores,
+    ``pi``/``e`` y funciones de ``math`` conocidas.
+
+    Raises:
+        ValueError: Si la expresión contiene algo no permitido o es demasiado grande
+    """
+
+    def _eval(node):
+        if isinstance(node, ast.Expression):
+            return _eval(node.body)
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            return node.value
+        if isinstance(node, ast.Name) and node.id in _CONSTANTS:
+            return _CONSTANTS[node.id]
+        if isinstance(node, ast.UnaryOp) and type(node.op) in _OPERATORS:
+            return _OPERATORS[type(node.op)](_eval(node.operand))
+        if isinstance(node, ast.BinOp) and type(node.op) in _OPERATORS:
+            left, right = _eval(node.left), _eval(node.right)
+            if isinstance(node.op, ast.Pow) and (
+                abs(right) > 1000
+                or isinstance(left, int) and left.bit_length() * abs(right) > 10000
+            ):
+                raise ValueError("exponente demasiado grande")
+            return _OPERATORS[type(node.op)](left, right)
+        if (
+            isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Name)
+            and node.func.id in _FUNCTIONS
+            and not node.keywords
+        ):
+            args = [_eval(arg) for arg in node.args]
+            if node.func.id == "factorial" and args and args[0] > 1000:
+                raise ValueError("factorial demasiado grande")
+            return _FUNCTIONS[node.func.id](*args)
+        raise ValueError(f"expresión no permitida: {ast.dump(node)[:40]}")
+
+    if len(expression) > 200:
+        raise ValueError("expresión demasiado larga")
+    try:
+        tree = ast.parse(expression.replace("^", "**"), mode="eval")
+    except SyntaxError as e:
+        raise ValueError(f"expresión inválida: {str(e)}")
+    return _eval(tree)
+
+
+async def calculator(expression: str) -> str:
+    return str(evaluate(expression))
+
+
+async def current_time(timezone: str = "UTC") -> str:
+    from zoneinfo import ZoneInfo
+
+    now = datetime.now(ZoneInfo(timezone))
+    return f"{now.isoformat(timespec='seconds')} ({now.strftime('%A')}, {timezone})"
+
+
+class LookupService(abc.ABC):
+    """
+    Consultas internas (catálogo, pedidos, ...). Las implementaciones reales
+    definen ``lookup``; un servicio sin él no se puede instanciar ni, por
+    tanto, registrar. Los tests usan un stub.
+    """
+
+    @abc.abstractmethod
+    async def lookup(self, query: str) -> Any:
+        """Resultado de ``query``; se devuelve al modelo como texto o JSON."""
+
+
+def register_lookup(
+    registry: "ToolRegistry",
+    service: LookupService,
+    name: str = "internal_lookup",
+    description: str = "Busca información interna de la organización.",
+    timeout: float = 5.0,
+) -> Tool:
+    """Expone ``service.lookup`` como herramienta ``name``."""
+
+    async def _lookup(query: str) -> Any:
+        return await service.lookup(query)
+
+    return registry.add(
+        Tool(
+            name=name,
+            description=description,
+            parameters={
+                "type": "object",
+                "properties": {"query": {"type": "string", "description": "Qué buscar"}},
+                "required": ["query"],
+            },
+            func=_lookup,
+            timeout=timeout,
+        )
+    )
+
+
+def builtin_tools() -> ToolRegistry:
+    """Registro con la calculadora y la hora actual."""
+    registry = ToolRegistry()
+    registry.register(
+        "Evalúa una expresión aritmética, p. ej. '2*(3+4)' o 'sqrt(2)'.",
+        {
+            "type": "object",
+            "properties": {"expression": {"type": "string"}},
+            "required": ["expression"],
+        },
+        timeout=1.0,
+    )(calculator)
+    registry.register(
+        "Fecha y hora actuales en una zona horaria IANA (por defecto UTC).",
+        {
+            "type": "object",
+            "properties": {"timezone": {"type": "string", "description": "p. ej. Europe/Madrid"}},
+        },
+        timeout=1.0,
+    )(current_time)
+    return registry
+
+
+# --------------------------------------------------------------------- bucle
+
+
+def _tool_call_message(message) -> Dict:
+    """Mensaje ``assistant`` con las llamadas pedidas, para reenviarlo al modelo."""
+    return {
+        "role": "assistant",
+        "content": message.content,
+        "tool_calls": [
+            {
+                "id": call.id,
+                "type": "function",
+                "function": {"name": call.function.name, "arguments": call.function.arguments},
+            }
+            for call in message.tool_calls
+        ],
+    }
+
+
+async def _tool_loop(
+    create: Callable[..., Any],
+    messages: List[Dict],
+    registry: ToolRegistry,
+    max_steps: int,
+    deadline: float,
+    usage: Dict,
+) -> str:
+    def _call(remaining: float, **kwargs):
+        response = create(timeout=remaining, messages=messages, **kwargs)
+        provider_usage = getattr(response, "usage", None)
+        for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+            usage[key] = usage.get(key, 0) + (getattr(provider_usage, key, None) or 0)
+        return response.choices[0].message
+
+    tools = registry.schemas()
+    for step in range(max_steps):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        usage["steps"] = step + 1
+        message = await asyncio.to_thread(_call, remaining, tools=tools)
+        if not message.tool_calls:
+            # Algunos proveedores devuelven content=None en vez de ""
+            return message.content or ""
+        messages.append(_tool_call_message(message))
+        usage["tool_calls"] = usage.get("tool_calls", 0) + len(message.tool_calls)
+
+        # Las llamadas de un mismo turno son independientes: se ejecutan a la vez
+        budget = deadline - time.monotonic()
+        results = await asyncio.gather(
+            *(
+                registry.execute(call.function.name, call.function.arguments, budget)
+                for call in message.tool_calls
+            )
+        )
+        for call, result in zip(message.tool_calls, results):
+            messages.append({"role": "tool", "tool_call_id": call.id, "content": result})
+
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutError("Se agotó el tiempo de la solicitud con herramientas")
+    # Presupuesto agotado: respuesta final con lo que ya se obtuvo
+    logger.info(f"Bucle de herramientas agotado tras {usage.get('steps', 0)} pasos")
+    message = await asyncio.to_thread(_call, remaining, tools=tools, tool_choice="none")
+    return message.content or ""
+
+
+def chat_with_tools(
+    config: Dict[str, str],
+    user_input: str,
+    registry: ToolRegistry,
+    system_prompt: Optional[str] = None,
+    on_usage: Optional[Callable[[Dict], None]] = None,
+    history: Optional[Sequence[Dict]] = None,
+    max_steps: int = 4,
+    deadline_seconds: float = 30.0,
+) -> str:
+    """
+    Como ``chat_gpt``, pero el modelo puede llamar a las herramientas de
+    ``registry``. Bloqueante: se llama desde un hilo, como el resto del
+    pipeline; las herramientas corren en un event loop propio de la solicitud.
+
+    Args:
+        max_steps: Llamadas al modelo que pueden pedir herramientas
+        deadline_seconds: Tiempo total de la solicitud, herramientas incluidas
+
+    Returns:
+        Respuesta final del modelo
+
+    Raises:
+        TimeoutError: Si se agota ``deadline_seconds`` sin respuesta
+    """
+    required_keys = ["api_key", "base_url", "model_name"]
+    if not all(k in config for k in required_keys):
+        raise ValueError(f"Configuración incompleta. Se requieren: {required_keys}")
+
+    client = get_client(config["api_key"], config["base_url"])
+    system_content = system_prompt or config.get("system_prompt", "You are a helpful assistant.")
+    messages = [
+        {"role": "system", "content": system_content},
+        *(history or []),
+        {"role": "user", "content": user_input},
+    ]
+
+    def _create(timeout: float, **kwargs):
+        return client.with_options(timeout=timeout).chat.completions.create(
+            model=config["model_name"], **kwargs
+        )
+
+    usage: Dict = {}
+    try:
+        return asyncio.run(
+            _tool_loop(
+                _create, messages, registry, max_steps, time.monotonic() + deadline_seconds, usage
+            )
+        )
+    finally:
+        if on_usage:
+            on_usage(usage)
+
+
+# Herramientas que usa el bot cuando TOOLS_ENABLED está activo; las consultas
+# internas se añaden con ``register_lookup(default_tools, servicio)``
+default_tools = builtin_tools()
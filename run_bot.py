@@ -2,16 +2,82 @@
 """
 Launcher script for the Telegram Bot.
 Run this from the project root directory.
+
+    python run_bot.py                      # inicia el bot
+    python run_bot.py --profile-startup    # desglose del tiempo de importación
 """
 
-import sys
+import argparse
 import os
+import subprocess
+import sys
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
 
 # Add the current directory to Python path
-sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def parse_importtime(output: str) -> List[Tuple[str, int, int, int]]:
+    """
+    Interpreta la salida de ``python -X importtime``.
+
+    Returns:
+        Lista de (módulo, µs propios, µs acumulados, profundidad)
+    """
+    rows = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+def profile_startup(module: str = "bot.main", top: int = 15) -> int:
+    """Importa ``module`` en un proceso nuevo con ``-X importtime`` e imprime el desglose."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+    )
+    rows = parse_importtime(result.stderr)
+    if result.returncode != 0 or not rows:
+        print(result.stderr[-2000:])
+        return result.returncode or 1
+
+    total = sum(self_us for _, self_us, _, _ in rows)
+    by_package: Dict[str, int] = defaultdict(int)
+    for name, self_us, _, _ in rows:
+        by_package[name.split(".")[0]] += self_us
+
+    print(f"Importar {module}: {total / 1000:.1f} ms ({len(rows)} módulos)\n")
+    print(f"{'Paquete':<30} {'ms':>9} {'%':>6}")
+    for package, self_us in sorted(by_package.items(), key=lambda item: -item[1])[:top]:
+        print(f"{package:<30} {self_us / 1000:>9.1f} {100 * self_us / total:>5.1f}%")
+
+    print(f"\n{'Importaciones más lentas (acumulado)':<50} {'ms':>9}")
+    for name, _, cumulative_us, depth in sorted(rows, key=lambda row: -row[2])[:top]:
+        print(f"{'  ' * min(depth, 4) + name:<50} {cumulative_us / 1000:>9.1f}")
+    return 0
 
-# Import and run the bot
-from bot.main import main
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inicia el bot de Telegram")
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="Muestra el tiempo de importación por paquete y termina",
+    )
+    args = parser.parse_args()
+    if args.profile_startup:
+        sys.exit(profile_startup())
+
+    # Import and run the bot
+    from bot.main import main
+
     main()
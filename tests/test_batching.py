@@ -0,0 +1,55 @@
+import asyncio
+
+from bot.batching import KeyedDebouncer
+
+
+def test_items_within_quiet_window_flush_once():
+    flushed = []
+
+    async def on_flush(key, items):
+        flushed.append((key, items))
+
+    async def scenario():
+        debouncer = KeyedDebouncer(0.05, 1.0, on_flush)
+        debouncer.add("album", 1)
+        await asyncio.sleep(0.02)
+        debouncer.add("album", 2)
+        debouncer.add("otro", "x")
+        await asyncio.sleep(0.15)
+
+    asyncio.run(scenario())
+    assert sorted(flushed) == [("album", [1, 2]), ("otro", ["x"])]
+
+
+def test_max_window_caps_continuous_stream():
+    flushed = []
+
+    async def on_flush(key, items):
+        flushed.append(list(items))
+
+    async def scenario():
+        debouncer = KeyedDebouncer(0.05, 0.12, on_flush)
+        for n in range(8):
+            debouncer.add(1, n)
+            await asyncio.sleep(0.03)
+        await asyncio.sleep(0.1)
+
+    asyncio.run(scenario())
+    assert len(flushed) >= 2
+    assert [n for batch in flushed for n in batch] == list(range(8))
+
+
+def test_flush_all_closes_open_batches():
+    flushed = []
+
+    async def on_flush(key, items):
+        flushed.append(items)
+
+    async def scenario():
+        debouncer = KeyedDebouncer(10, 10, on_flush)
+        debouncer.add("a", 1)
+        await debouncer.flush_all()
+        assert len(debouncer) == 0
+
+    asyncio.run(scenario())
+    assert flushed == [[1]]
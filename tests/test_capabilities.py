@@ -0,0 +1,88 @@
+import time
+
+from core.capabilities import CapabilityRegistry, parse_model_entry
+
+
+def _registry(tmp_path, monkeypatch, models, calls):
+    registry = CapabilityRegistry(db_path=tmp_path / "caps.db")
+
+    def fake_fetch(base_url, api_key):
+        calls.append(base_url)
+        return models
+
+    monkeypatch.setattr(registry, "fetch_models", fake_fetch)
+    return registry
+
+
+def test_parse_openrouter_style_entry():
+    caps = parse_model_entry(
+        {
+            "id": "x/vl",
+            "context_length": 32000,
+            "architecture": {"input_modalities": ["text", "image"]},
+            "top_provider": {"max_completion_tokens": 2048},
+        }
+    )
+    assert caps == {"context_tokens": 32000, "max_output_tokens": 2048, "supports_vision": True}
+
+
+def test_overrides_apply_without_endpoint():
+    registry = CapabilityRegistry()
+    assert registry.get("https://api.openai.com/v1", "gpt-4o").supports_vision
+    assert not registry.get("https://api.openai.com/v1", "gpt-3.5-turbo").supports_vision
+    assert not registry.get("https://x/v1", "modelo-raro").known
+
+
+def test_refresh_fetches_once_and_persists(tmp_path, monkeypatch):
+    calls = []
+    models = {"llava-13b": {"context_tokens": 4096}}
+    registry = _registry(tmp_path, monkeypatch, models, calls)
+    assert registry.refresh("http://local/v1/", "k")
+    assert registry.refresh("http://local/v1", "k")
+    assert calls == ["http://local/v1"]
+    assert registry.is_listed("http://local/v1", "LLaVA-13b") is True
+    assert registry.is_listed("http://local/v1", "otro") is False
+
+    caps = registry.get("http://local/v1", "llava-13b")
+    assert caps.known and caps.supports_vision and caps.context_tokens == 4096
+
+    # Una instancia nueva reutiliza el caché de SQLite sin volver a la red
+    second = _registry(tmp_path, monkeypatch, models, calls)
+    assert second.refresh("http://local/v1", "k")
+    assert calls == ["http://local/v1"]
+
+
+def test_refresh_failure_reports_unknown(tmp_path, monkeypatch):
+    registry = CapabilityRegistry(db_path=tmp_path / "caps.db")
+
+    def boom(base_url, api_key):
+        raise ConnectionError("sin red")
+
+    monkeypatch.setattr(registry, "fetch_models", boom)
+    assert registry.refresh("http://down/v1") is False
+    assert registry.is_listed("http://down/v1", "gpt-4o") is None
+
+
+def test_expired_list_is_served_and_renewed_in_background(tmp_path, monkeypatch):
+    calls = []
+    models = {"modelo-a": {"context_tokens": 4096}}
+    registry = _registry(tmp_path, monkeypatch, models, calls)
+    registry.refresh("http://local/v1", "k")
+    assert registry.get("http://local/v1", "modelo-a").context_tokens == 4096
+
+    # Tras el TTL: una instancia nueva sirve la fila caducada de SQLite
+    clock = [time.time() + 2 * 24 * 3600]
+    monkeypatch.setattr("core.capabilities.time.time", lambda: clock[0])
+    second = _registry(tmp_path, monkeypatch, {"modelo-a": {"context_tokens": 8192}}, calls)
+    assert second.get("http://local/v1", "modelo-a").context_tokens == 4096
+    assert second.get("http://local/v1", "modelo-a").known
+
+    # ... y la renueva sin bloquear; la entrada memorizada se recalcula
+    assert second.refresh_in_background("http://local/v1", "k")
+    assert not second.refresh_in_background("http://local/v1", "k")
+    for _ in range(100):
+        if len(calls) == 2 and not second._refreshing:
+            break
+        time.sleep(0.01)
+    assert second.get("http://local/v1", "modelo-a").context_tokens == 8192
+    assert not second.refresh_in_background("http://local/v1", "k")
@@ -0,0 +1,72 @@
+import pytest
+
+from core import chunking
+from core.chunking import chunk_segments, is_supported, iter_document_chunks
+
+
+def _count(text):
+    return chunking.get_estimator("").tokenizer.count(text)
+
+
+def test_chunks_respect_budget_and_keep_order(tmp_path):
+    path = tmp_path / "notes.md"
+    lines = [f"Línea {i}: " + "palabra " * 20 + "\n" for i in range(200)]
+    path.write_text("".join(lines), encoding="utf-8")
+
+    chunks = list(iter_document_chunks(path, max_tokens=200, file_name="notes.md"))
+    assert len(chunks) > 1
+    assert all(_count(chunk) <= 200 for chunk in chunks)
+    # Los cortes caen entre líneas y no se pierde texto
+    assert "".join(chunks) == "".join(lines)
+
+
+def test_chunking_is_lazy():
+    consumed = []
+
+    def segments():
+        for i in range(1000):
+            consumed.append(i)
+            yield "x" * 400 + "\n"
+
+    first = next(chunk_segments(segments(), max_tokens=250))
+    assert first
+    assert len(consumed) < 10
+
+
+def test_oversized_segment_is_split():
+    chunks = list(chunk_segments(["a" * 4000], max_tokens=100))
+    assert len(chunks) > 1
+    assert all(_count(chunk) <= 100 for chunk in chunks)
+    assert "".join(chunks) == "a" * 4000
+
+
+def test_supported_formats(monkeypatch):
+    monkeypatch.setattr(chunking, "pdf_available", lambda: True)
+    assert is_supported("main.py")
+    assert is_supported("informe.PDF")
+    assert is_supported("sin_extension", "text/plain")
+    assert not is_supported("foto.png", "image/png")
+
+
+def test_pdf_is_refused_up_front_without_pypdf(monkeypatch):
+    monkeypatch.setattr(chunking.importlib.util, "find_spec", lambda name: None)
+    assert not is_supported("informe.pdf")
+    assert not is_supported("sin_extension", "application/pdf")
+    assert is_supported("notas.md")
+
+
+def test_pdf_without_pypdf_reports_missing_dependency(tmp_path, monkeypatch):
+    import builtins
+
+    real_import = builtins.__import__
+
+    def _no_pypdf(name, *args, **kwargs):
+        if name == "pypdf":
+            raise ImportError(name)
+        return real_import(name, *args, **kwargs)
+
+    monkeypatch.setattr(builtins, "__import__", _no_pypdf)
+    path = tmp_path / "doc.pdf"
+    path.write_bytes(b"%PDF-1.4")
+    with pytest.raises(ValueError, match="pypdf"):
+        list(iter_document_chunks(path, max_tokens=100, file_name="doc.pdf"))
@@ -0,0 +1,111 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+from bot.handlers import messages
+from bot.handlers.commands import parse_compare, parse_setup
+
+
+def test_parse_setup_accepts_aliases_and_separators():
+    values, errors = parse_setup(
+        "api_key=sk-123\n"
+        "URL: https://api.test/v1\n"
+        "model = gpt-4o\n"
+        "\n"
+        "prompt=Eres conciso: responde en una línea"
+    )
+    assert errors == []
+    assert values == {
+        "api_key": "sk-123",
+        "base_url": "https://api.test/v1",
+        "model_name": "gpt-4o",
+        "system_prompt": "Eres conciso: responde en una línea",
+    }
+
+
+def test_parse_setup_reports_unknown_or_empty_lines():
+    values, errors = parse_setup("temperature=0.2\nmodel=\nbase_url=https://x/v1")
+    assert values == {"base_url": "https://x/v1"}
+    assert errors == ["temperature=0.2", "model="]
+
+
+def test_parse_compare_detects_models_and_separator():
+    assert parse_compare("gpt-4o openai/gpt-4o-mini llama3:8b -- ¿Qué es un monad?") == (
+        ["gpt-4o", "openai/gpt-4o-mini", "llama3:8b"],
+        "¿Qué es un monad?",
+    )
+    assert parse_compare("sonnet haiku -- Resume esto -- ya") == (["sonnet", "haiku"], "Resume esto -- ya")
+    assert parse_compare("sonnet haiku | Resume esto") == (["sonnet", "haiku"], "Resume esto")
+    known = ["Sonnet", "gpt-4o"]
+    assert parse_compare("sonnet gpt-4o Hola", known_models=known) == (["sonnet", "gpt-4o"], "Hola")
+    assert parse_compare("gpt-4o gpt-4o Explica\nesto", known_models=known) == (["gpt-4o"], "Explica\nesto")
+    # Sin separador, lo que no lista el endpoint es parte de la pregunta
+    assert parse_compare("3.5 razones para usar gpt-4o") == ([], "3.5 razones para usar gpt-4o")
+    assert parse_compare("gpt-4o 3.5 razones", known_models=known) == (["gpt-4o"], "3.5 razones")
+
+
+class CompareBot:
+    def __init__(self):
+        self.messages = {}
+
+    async def send_message(self, chat_id, text, parse_mode=None):
+        message_id = len(self.messages) + 1
+        self.messages[message_id] = text
+        return SimpleNamespace(message_id=message_id)
+
+    async def edit_message_text(self, text, chat_id, message_id, parse_mode=None):
+        self.messages[message_id] = text
+
+
+def test_compare_isolates_model_errors(monkeypatch):
+    def fake_pipeline(config, user_input, on_usage=None, **kwargs):
+        if config["model_name"] == "roto-1":
+            raise RuntimeError("404 No endpoints found")
+        on_usage({"model": config["model_name"], "prompt_tokens": 10, "completion_tokens": 5})
+        return f"respuesta de {config['model_name']}"
+
+    monkeypatch.setattr(messages, "run_pipeline", fake_pipeline)
+    job = SimpleNamespace(chat_id=1, user_id=7, payload={"text": "hola"})
+    bot = CompareBot()
+    usage = {}
+    table = asyncio.run(
+        messages.process_compare(job, bot, {"model_name": "x"}, ["gpt-4o", "roto-1", "gpt-4o-mini"], usage)
+    )
+
+    assert "respuesta de gpt-4o" in bot.messages[1]
+    assert bot.messages[2].startswith("❌ roto-1")
+    assert "respuesta de gpt-4o-mini" in bot.messages[3]
+    assert usage["calls"] == 2 and usage["completion_tokens"] == 10
+    assert "roto-1" in table and "error" in table and "10/5" in table
+
+
+def test_document_downloads_do_not_share_a_path():
+    class FakeFile:
+        file_id = "BQAC"
+        file_unique_id = "AgAD"
+        file_path = "documents/informe.TXT"
+
+        async def download_to_drive(self, custom_path):
+            with open(custom_path, "w", encoding="utf-8") as handle:
+                handle.write("contenido")
+
+    async def get_file(file_id):
+        return FakeFile()
+
+    bot = SimpleNamespace(get_file=get_file)
+
+    async def scenario():
+        return await asyncio.gather(*(messages.download_document("BQAC", bot) for _ in range(2)))
+
+    first, second = asyncio.run(scenario())
+    try:
+        assert first != second
+        assert first.endswith(".txt") and second.endswith(".txt")
+        # Borrar la entrada de un trabajo no afecta al otro
+        asyncio.run(messages.cleanup_temp_file(first))
+        with open(second, encoding="utf-8") as handle:
+            assert handle.read() == "contenido"
+    finally:
+        for path in (first, second):
+            if os.path.exists(path):
+                os.remove(path)
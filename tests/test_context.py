@@ -0,0 +1,85 @@
+from core.context import ConversationStore
+
+
+def _store(tmp_path, **kwargs):
+    params = dict(max_history_tokens=200, compact_threshold_tokens=60, keep_recent_turns=2)
+    params.update(kwargs)
+    return ConversationStore(db_path=tmp_path / "ctx.db", **params)
+
+
+def _turns(n, words=10):
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"turno {i} " + "palabra " * words}
+        for i in range(n)
+    ]
+
+
+def test_disabled_store_has_no_history():
+    store = ConversationStore()
+    store.append(1, _turns(2))
+    assert store.history(1) == []
+    assert store.compaction_snapshot(1) is None
+
+
+def test_history_is_bounded_and_keeps_latest_turns(tmp_path):
+    store = _store(tmp_path, max_history_tokens=100)
+    store.append(1, _turns(40))
+    history = store.history(1)
+    assert 0 < len(history) < 40
+    assert history[-1]["content"].startswith("turno 39")
+
+
+def test_compact_replaces_old_turns_with_summary(tmp_path):
+    store = _store(tmp_path)
+    store.append(1, _turns(8))
+    seen = {}
+
+    def summarize(previous, turns):
+        seen["count"] = len(turns)
+        return "resumen v1"
+
+    assert store.compact(1, summarize)
+    assert seen["count"] == 6
+    history = store.history(1)
+    assert history[0]["role"] == "system" and "resumen v1" in history[0]["content"]
+    assert len(history) == 3
+    # Sin turnos nuevos no hay nada que compactar
+    assert not store.compact(1, summarize)
+
+
+def test_stale_summary_is_discarded(tmp_path):
+    store = _store(tmp_path)
+    store.append(1, _turns(8))
+    first = store.compaction_snapshot(1)
+    second = store.compaction_snapshot(1)
+    assert store.apply_summary(first, "ganador")
+    assert not store.apply_summary(second, "perdedor")
+    assert "ganador" in store.history(1)[0]["content"]
+
+
+def test_clear_forgets_chat(tmp_path):
+    store = _store(tmp_path)
+    store.append(1, _turns(8))
+    store.append(2, _turns(2))
+    store.compact(1, lambda previous, turns: "resumen")
+    store.clear(1)
+    assert store.history(1) == []
+    assert len(store.history(2)) == 2
+
+
+def test_reset_during_compaction_discards_summary(tmp_path):
+    store = _store(tmp_path)
+    store.append(1, _turns(8))
+    first = store.compaction_snapshot(1)
+    store.clear(1)
+    assert not store.apply_summary(first, "resumen del chat borrado")
+    assert store.history(1) == []
+
+    # Con un resumen previo (versión > 0) tampoco vuelve
+    store.append(1, _turns(8))
+    store.compact(1, lambda previous, turns: "resumen")
+    store.append(1, _turns(8))
+    second = store.compaction_snapshot(1)
+    store.clear(1)
+    assert not store.apply_summary(second, "resumen del chat borrado")
+    assert store.history(1) == []
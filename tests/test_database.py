@@ -13,3 +13,25 @@ def test_set_and_get_user_config_in_memory(in_memory_db):
     assert cfg["base_url"] == "https://api.test/v1"
     assert cfg["model_name"] == "gpt-4-turbo"
     assert cfg["system_prompt"] == "hola"
+
+
+def test_set_user_config_many_is_single_upsert(in_memory_db):
+    from bot.database import set_user_config_many
+
+    assert set_user_config_many(7, {"api_key": "sk-1", "model_name": "gpt-4o"})
+    # Un segundo upsert solo cambia las claves indicadas
+    assert set_user_config_many(7, {"model_name": "gpt-4-turbo", "system_prompt": "hola"})
+    cfg = get_user_config(7)
+    assert cfg == {
+        "api_key": "sk-1",
+        "base_url": None,
+        "model_name": "gpt-4-turbo",
+        "system_prompt": "hola",
+    }
+
+
+def test_set_user_config_many_rejects_invalid_keys_atomically(in_memory_db):
+    from bot.database import set_user_config_many
+
+    assert not set_user_config_many(8, {"api_key": "sk-1", "user_id": 9})
+    assert get_user_config(8) == {}
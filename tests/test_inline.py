@@ -0,0 +1,118 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+from bot.handlers import inline
+from bot.handlers.inline import SLOW_ANSWER, InlineAnswers
+
+CONFIG = {"api_key": "sk-test", "base_url": "https://api.test/v1", "model_name": "gpt-4o"}
+
+
+class FakeQuery:
+    def __init__(self, text, user_id=1):
+        self.query = text
+        self.from_user = SimpleNamespace(id=user_id)
+        self.answers = []
+
+    async def answer(self, results, cache_time=None, is_personal=None, button=None):
+        self.answers.append((results, cache_time))
+
+
+class Model:
+    def __init__(self, delay=0.0):
+        self.calls = []
+        self.delay = delay
+        self.release = threading.Event()
+
+    def __call__(self, config, user_input, on_usage=None, **kwargs):
+        self.calls.append(user_input)
+        if self.delay:
+            self.release.wait(self.delay)
+        return f"respuesta a {user_input}"
+
+
+def _setup(monkeypatch, model):
+    monkeypatch.setattr(inline, "get_user_config", lambda user_id: dict(CONFIG))
+    monkeypatch.setattr(inline, "run_cached_pipeline", model)
+    return InlineAnswers(quiet_seconds=0.05, max_seconds=1.0, timeout=2.0)
+
+
+def _text(query):
+    results, _ = query.answers[-1]
+    return results[0].input_message_content.message_text
+
+
+def test_keystrokes_are_debounced_into_one_call(monkeypatch):
+    model = Model()
+    answers = _setup(monkeypatch, model)
+
+    async def scenario():
+        queries = [FakeQuery(text) for text in ("capi", "capital", "capital de", "capital de Francia")]
+        for query in queries:
+            await answers.handle(query)
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.2)
+        return queries
+
+    queries = asyncio.run(scenario())
+    assert model.calls == ["capital de Francia"]
+    assert [len(q.answers) for q in queries] == [0, 0, 0, 1]
+    assert "respuesta a capital de Francia" in _text(queries[-1])
+    assert queries[-1].answers[0][1] == 300
+
+
+def test_cached_answer_is_served_without_debounce(monkeypatch):
+    model = Model()
+    answers = _setup(monkeypatch, model)
+
+    async def scenario():
+        await answers.handle(FakeQuery("capital de Francia"))
+        await asyncio.sleep(0.2)
+        again = FakeQuery("Capital de Francia?")
+        await answers.handle(again)
+        # Sin esperar a la ventana de silencio
+        return again
+
+    again = asyncio.run(scenario())
+    assert len(model.calls) == 1
+    assert len(again.answers) == 1
+
+
+def test_superseded_query_is_not_answered_but_cached(monkeypatch):
+    model = Model(delay=5)
+    answers = _setup(monkeypatch, model)
+
+    async def scenario():
+        first = FakeQuery("capital de Francia")
+        await answers.handle(first)
+        await asyncio.sleep(0.1)  # la llamada ya está en curso
+        second = FakeQuery("capital de Francia y de Italia")
+        await answers.handle(second)
+        model.release.set()
+        await asyncio.sleep(0.2)
+        third = FakeQuery("capital de Francia")
+        await answers.handle(third)
+        return first, third
+
+    first, third = asyncio.run(scenario())
+    assert first.answers == []
+    assert len(model.calls) == 2
+    assert "respuesta a capital de Francia" in _text(third)
+
+
+def test_slow_answer_sends_retry_notice(monkeypatch):
+    model = Model(delay=5)
+    answers = _setup(monkeypatch, model)
+    answers.timeout = 0.1
+
+    async def scenario():
+        query = FakeQuery("capital de Francia")
+        await answers.handle(query)
+        await asyncio.sleep(0.3)
+        model.release.set()
+        await asyncio.sleep(0.1)
+        return query
+
+    query = asyncio.run(scenario())
+    assert SLOW_ANSWER in _text(query)
+    assert query.answers[0][1] == 0
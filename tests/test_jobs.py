@@ -0,0 +1,115 @@
+import asyncio
+import time
+
+from bot import jobs
+from bot.outbox import OutboxStopped
+
+
+def test_enqueue_deduplicates_by_update_id(in_memory_db):
+    jobs.init_jobs_table()
+    assert jobs.enqueue_job(10, 1, 1, {"text": "hola"})
+    assert not jobs.enqueue_job(10, 1, 1, {"text": "hola"})
+    assert jobs.job_exists(10)
+    assert jobs.count_jobs(jobs.PENDING) == 1
+
+
+def test_claim_respects_lease_and_resumes_expired(in_memory_db):
+    jobs.init_jobs_table()
+    jobs.enqueue_job(1, 5, 5, {"text": "a"})
+
+    job = jobs.claim_job(lease_seconds=0.2)
+    assert job.update_id == 1 and job.payload == {"text": "a"} and job.attempts == 1
+    # Con el lease vigente nadie más lo reclama
+    assert jobs.claim_job(lease_seconds=0.2) is None
+
+    # Si el worker muere, el lease vence y el trabajo se retoma
+    time.sleep(0.25)
+    again = jobs.claim_job(lease_seconds=10)
+    assert again.update_id == 1 and again.attempts == 2
+
+    jobs.complete_job(1)
+    assert jobs.count_jobs(jobs.DONE) == 1
+    assert jobs.claim_job(lease_seconds=10) is None
+
+
+def test_released_job_is_claimed_again(in_memory_db):
+    jobs.init_jobs_table()
+    jobs.enqueue_job(2, 5, 5, {})
+    jobs.claim_job(lease_seconds=60)
+    jobs.release_job(2)
+    assert jobs.claim_job(lease_seconds=60).update_id == 2
+
+
+def test_worker_pool_processes_in_order_and_drains(in_memory_db):
+    jobs.init_jobs_table()
+    for update_id in (3, 1, 2):
+        jobs.enqueue_job(update_id, 7, 7, {"n": update_id})
+    jobs.enqueue_job(4, 7, 7, {"fail": True})
+    processed = []
+
+    async def processor(job, bot):
+        if job.payload.get("fail"):
+            raise RuntimeError("boom")
+        processed.append(job.update_id)
+
+    async def scenario():
+        queue = jobs.LLMJobQueue(poll_interval=0.05)
+        await queue.start(bot=None, processor=processor, workers=1)
+        for _ in range(100):
+            if jobs.count_jobs(jobs.PENDING) == 0 and jobs.count_jobs(jobs.RUNNING) == 0:
+                break
+            await asyncio.sleep(0.02)
+        await queue.stop(timeout=1)
+
+    asyncio.run(scenario())
+    assert processed == [1, 2, 3]
+    assert jobs.count_jobs(jobs.DONE) == 3
+    assert jobs.count_jobs(jobs.FAILED) == 1
+
+
+def test_stop_releases_unfinished_jobs(in_memory_db):
+    jobs.init_jobs_table()
+    jobs.enqueue_job(9, 1, 1, {})
+
+    async def slow(job, bot):
+        await asyncio.sleep(10)
+
+    async def scenario():
+        queue = jobs.LLMJobQueue(poll_interval=0.05)
+        await queue.start(bot=None, processor=slow, workers=1)
+        while jobs.count_jobs(jobs.RUNNING) == 0:
+            await asyncio.sleep(0.02)
+        await queue.stop(timeout=0.1)
+
+    asyncio.run(scenario())
+    assert jobs.count_jobs(jobs.PENDING) == 1
+
+
+def test_unsent_answer_returns_job_to_queue(in_memory_db):
+    jobs.init_jobs_table()
+    jobs.enqueue_job(9, 1, 1, {})
+
+    calls = []
+
+    async def outbox_stopped(job, bot):
+        calls.append(job.update_id)
+        raise OutboxStopped("Envío a 1 no realizado")
+
+    async def scenario():
+        queue = jobs.LLMJobQueue(poll_interval=0.05)
+        await queue.start(bot=None, processor=outbox_stopped, workers=1)
+        while not calls:
+            await asyncio.sleep(0.01)
+        await queue.stop(timeout=1)
+
+    asyncio.run(scenario())
+    assert jobs.count_jobs(jobs.FAILED) == 0
+    assert jobs.count_jobs(jobs.PENDING) == 1
+
+
+def test_merged_updates_are_deduplicated(in_memory_db):
+    jobs.init_jobs_table()
+    assert jobs.enqueue_job(20, 1, 1, {"text": "a\nb\nc"}, merged_update_ids=[21, 22])
+    assert jobs.job_exists(21) and jobs.job_exists(22)
+    assert not jobs.job_exists(23)
+    assert jobs.count_jobs(jobs.PENDING) == 1
@@ -0,0 +1,95 @@
+import logging
+import sys
+
+from loguru import logger
+
+from bot.logs import LogFilter, configure_logging, parse_levels, redact_text
+
+
+def _record(name="bot.jobs", level="INFO", line=10, message="hola"):
+    return {
+        "name": name,
+        "function": "f",
+        "line": line,
+        "level": logger.level(level),
+        "message": message,
+    }
+
+
+def test_redact_hides_common_secrets():
+    text = redact_text(
+        "config {'api_key': 'sk-or-v1-abcdef123456', 'model_name': 'gpt-4o'} "
+        "token 123456789:AAHdqTcvCH1vGWJxfSeofSAs0K5PALDsaw "
+        "Authorization: Bearer abc.def"
+    )
+    assert "abcdef123456" not in text
+    assert "AAHdqTcvCH1vGWJxfSeofSAs0K5PALDsaw" not in text
+    assert "abc.def" not in text
+    assert "gpt-4o" in text
+
+
+def test_parse_levels():
+    assert parse_levels("bot.jobs=debug, httpx = WARNING,basura") == {
+        "bot.jobs": "DEBUG",
+        "httpx": "WARNING",
+    }
+    assert parse_levels(None) == {}
+
+
+def test_module_levels_use_most_specific_prefix():
+    log_filter = LogFilter("ERROR", {"bot": "INFO", "bot.jobs": "DEBUG"})
+    assert log_filter.min_level == logger.level("DEBUG").no
+    assert log_filter(_record("bot.jobs", "DEBUG"))
+    assert not log_filter(_record("bot.outbox", "DEBUG"))
+    assert log_filter(_record("bot.outbox", "INFO"))
+    assert not log_filter(_record("core.pipeline", "WARNING"))
+
+
+def test_repeated_messages_are_rate_limited_per_call_site(monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr("bot.logs.time.monotonic", lambda: clock[0])
+    log_filter = LogFilter("INFO", max_per_window=2, window_seconds=60)
+
+    allowed = [log_filter(_record()) for _ in range(5)]
+    assert allowed == [True, True, False, False, False]
+    # Otra línea tiene su propia ventana
+    assert log_filter(_record(line=11))
+
+    clock[0] = 61
+    record = _record()
+    assert log_filter(record)
+    assert "+3 repetidos suprimidos" in record["message"]
+
+
+def test_same_record_is_counted_once_across_sinks():
+    log_filter = LogFilter("INFO", max_per_window=1)
+    record = _record()
+    assert log_filter(record) and log_filter(record)
+    assert not log_filter(_record())
+
+
+def test_exception_tracebacks_and_extra_are_redacted(tmp_path):
+    text_path, json_path = tmp_path / "bot.log", tmp_path / "bot.jsonl"
+    root_handlers, root_level = logging.root.handlers[:], logging.root.level
+    configure_logging("INFO", log_file=str(text_path), json_path=str(json_path))
+    try:
+        def call(api_key):
+            raise RuntimeError(f"rechazada {api_key}")
+
+        try:
+            call("sk-secretkey123456")
+        except RuntimeError:
+            logger.bind(request="api_key=sk-otrakey7890").exception("Fallo al llamar al modelo")
+            # Excepciones de core, reenviadas por InterceptHandler
+            logging.getLogger("core.pipeline").error("Fallo en core", exc_info=True)
+        logger.complete()
+    finally:
+        logger.remove()
+        logger.add(sys.stderr)
+        logging.root.handlers[:], logging.root.level = root_handlers, root_level
+
+    for path in (text_path, json_path):
+        content = path.read_text(encoding="utf-8")
+        assert "RuntimeError: rechazada sk-***" in content
+        assert "secretkey123456" not in content
+        assert "otrakey7890" not in content
@@ -0,0 +1,77 @@
+import asyncio
+import calendar
+import sqlite3
+import time
+
+from bot import database
+from bot.jobs import enqueue_job, complete_job, init_jobs_table
+from bot.maintenance import (
+    DAY,
+    MaintenanceTask,
+    RetentionPolicy,
+    compact,
+    db_stats,
+    default_policies,
+    in_offpeak,
+    sweep,
+)
+from core.context import ConversationStore
+
+
+def _count(table):
+    conn = sqlite3.connect(database.DB_PATH)
+    try:
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_new_databases_use_incremental_auto_vacuum(in_memory_db):
+    assert db_stats()["auto_vacuum"] == 2
+
+
+def test_sweep_removes_only_old_finished_jobs(in_memory_db):
+    init_jobs_table()
+    enqueue_job(1, 10, 10, {"text": "a"}, merged_update_ids=[2])
+    enqueue_job(3, 10, 10, {"text": "b"})
+    enqueue_job(4, 10, 10, {"text": "c"})
+    complete_job(1)
+    complete_job(3)
+
+    # Dentro de 8 días: 1 y 3 caducaron, 4 sigue pendiente
+    deleted = sweep(default_policies(jobs_days=7), now=time.time() + 8 * DAY)
+    assert deleted == {"llm_jobs": 2, "llm_job_updates": 1}
+    assert _count("llm_jobs") == 1
+
+
+def test_row_cap_deletes_oldest_in_batches(in_memory_db):
+    store = ConversationStore(database.DB_PATH)
+    store.append(1, [{"role": "user", "content": f"t{i}"} for i in range(25)])
+    policy = RetentionPolicy("chat_turns", "created_at", max_rows=10)
+    assert sweep([policy], batch_size=4, pause=0) == {"chat_turns": 15}
+    assert [m["content"] for m in store.history(1)][0] == "t15"
+
+
+def test_compact_reclaims_free_pages(in_memory_db):
+    store = ConversationStore(database.DB_PATH)
+    store.append(1, [{"role": "user", "content": "x" * 2000} for _ in range(200)])
+    sweep([RetentionPolicy("chat_turns", "created_at", ttl_seconds=0)], now=time.time() + 1, pause=0)
+    before = db_stats()
+    assert before["freelist_pages"] > 0
+    assert compact(pause=0) == before["freelist_pages"]
+    assert db_stats()["size_bytes"] < before["size_bytes"]
+
+
+def test_run_once_reports_size(in_memory_db):
+    report = asyncio.run(MaintenanceTask().run_once(force_compaction=True))
+    assert report["size_bytes"] > 0 and report["deleted"] == {}
+
+
+def test_offpeak_window_wraps_midnight():
+    def at(hour):
+        return calendar.timegm((2024, 1, 1, hour, 0, 0))
+
+    assert in_offpeak((3, 5), at(4))
+    assert not in_offpeak((3, 5), at(5))
+    assert in_offpeak((23, 2), at(1))
+    assert not in_offpeak((23, 2), at(12))
@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+from telegram.error import RetryAfter
+
+from bot.outbox import FINAL, PROGRESS, OutboundScheduler, OutboxStopped, TokenBucket
+
+
+def test_token_bucket_delay():
+    bucket = TokenBucket(rate=1.0, capacity=1.0)
+    now = bucket.updated
+    assert bucket.delay(now) == 0
+    bucket.take(now)
+    assert 0.9 < bucket.delay(now) <= 1.0
+
+
+def test_final_answers_go_before_progress_edits():
+    async def scenario():
+        scheduler = OutboundScheduler(global_rate=1000, per_chat_rate=1000, per_chat_burst=1000)
+        sent = []
+
+        def factory(label):
+            async def _send():
+                sent.append(label)
+                return label
+            return _send
+
+        # Se encolan antes de arrancar para que compitan por el primer turno
+        futures = [
+            scheduler.submit(1, factory("progreso"), PROGRESS),
+            scheduler.submit(2, factory("final"), FINAL),
+        ]
+        await scheduler.start()
+        await asyncio.gather(*futures)
+        await scheduler.stop()
+        return sent
+
+    assert asyncio.run(scenario()) == ["final", "progreso"]
+
+
+def test_superseded_edits_are_coalesced():
+    async def scenario():
+        scheduler = OutboundScheduler(global_rate=1000, per_chat_rate=1000, per_chat_burst=1000)
+        sent = []
+
+        def factory(label):
+            async def _send():
+                sent.append(label)
+                return label
+            return _send
+
+        key = ("edit", 1, 10)
+        first = scheduler.submit(1, factory("25%"), PROGRESS, coalesce_key=key)
+        second = scheduler.submit(1, factory("50%"), PROGRESS, coalesce_key=key)
+        await scheduler.start()
+        results = await asyncio.gather(first, second)
+        await scheduler.stop()
+        return sent, results
+
+    sent, results = asyncio.run(scenario())
+    assert sent == ["50%"]
+    assert results == ["50%", "50%"]
+
+
+def test_retry_after_is_retried_once_accepted():
+    async def scenario():
+        scheduler = OutboundScheduler(global_rate=1000, per_chat_rate=1000, per_chat_burst=1000)
+        attempts = []
+
+        async def _send():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise RetryAfter(0)
+            return "ok"
+
+        await scheduler.start()
+        result = await scheduler.send(1, _send)
+        await scheduler.stop()
+        return result, len(attempts)
+
+    assert asyncio.run(scenario()) == ("ok", 2)
+
+
+def test_per_chat_bucket_spaces_messages():
+    async def scenario():
+        scheduler = OutboundScheduler(global_rate=1000, per_chat_rate=20, per_chat_burst=1)
+        times = []
+
+        async def _send():
+            times.append(asyncio.get_running_loop().time())
+
+        await scheduler.start()
+        await asyncio.gather(*(scheduler.send(1, _send) for _ in range(3)))
+        await scheduler.stop()
+        return times
+
+    times = asyncio.run(scenario())
+    assert times[2] - times[0] >= 0.09
+
+
+def test_stop_fails_unsent_jobs_instead_of_dropping_them():
+    async def scenario():
+        # Un mensaje por chat cada 100 s: solo el primero sale antes del plazo
+        scheduler = OutboundScheduler(global_rate=1000, per_chat_rate=0.01, per_chat_burst=1)
+        sent = []
+
+        async def _send():
+            sent.append(1)
+            return "ok"
+
+        await scheduler.start()
+        futures = [scheduler.submit(1, _send) for _ in range(3)]
+        await asyncio.wait_for(scheduler.stop(timeout=0.1), 1)
+        return sent, futures
+
+    sent, futures = asyncio.run(scenario())
+    assert sent == [1]
+    assert futures[0].result() == "ok"
+    for future in futures[1:]:
+        with pytest.raises(OutboxStopped):
+            future.result()
@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+from bot import persistence
+from bot.persistence import SQLitePersistence, init_persistence_table
+
+
+@pytest.fixture()
+def store(in_memory_db):
+    init_persistence_table()
+    return SQLitePersistence()
+
+
+def _count_writes(monkeypatch):
+    batches = []
+    original = persistence.write_entries
+
+    def _write(batch):
+        batches.append(dict(batch))
+        original(batch)
+
+    monkeypatch.setattr(persistence, "write_entries", _write)
+    return batches
+
+
+async def _round(store, *updates):
+    # Igual que Application.update_persistence: todas las actualizaciones con gather
+    await asyncio.gather(*updates)
+    await store.flush()
+
+
+def test_user_and_chat_data_survive_restart(store):
+    async def scenario():
+        await _round(
+            store,
+            store.update_user_data(1, {"lang": "es"}),
+            store.update_chat_data(-100, {"topic": "python"}),
+            store.update_conversation("setup", (1, 1), "ASK_MODEL"),
+        )
+        restored = SQLitePersistence()
+        return (
+            await restored.get_user_data(),
+            await restored.get_chat_data(),
+            await restored.get_conversations("setup"),
+        )
+
+    users, chats, conversations = asyncio.run(scenario())
+    assert users == {1: {"lang": "es"}}
+    assert chats == {-100: {"topic": "python"}}
+    assert conversations == {(1, 1): "ASK_MODEL"}
+
+
+def test_only_changed_entries_are_written_in_one_batch(store, monkeypatch):
+    batches = _count_writes(monkeypatch)
+
+    async def scenario():
+        await _round(store, *(store.update_user_data(uid, {"n": uid}) for uid in range(50)))
+        # Segunda ronda: solo cambia un usuario
+        await _round(
+            store,
+            *(store.update_user_data(uid, {"n": uid if uid else -1}) for uid in range(50)),
+        )
+
+    asyncio.run(scenario())
+    assert [len(batch) for batch in batches] == [50, 1]
+    assert list(batches[1]) == [("user", "0")]
+
+
+def test_drop_and_ended_conversation_delete_rows(store):
+    async def scenario():
+        await _round(
+            store,
+            store.update_user_data(1, {"a": 1}),
+            store.update_conversation("setup", (1, 1), "STEP"),
+        )
+        await _round(store, store.drop_user_data(1), store.update_conversation("setup", (1, 1), None))
+        restored = SQLitePersistence()
+        return await restored.get_user_data(), await restored.get_conversations("setup")
+
+    assert asyncio.run(scenario()) == ({}, {})
+
+
+def test_show_config_button_reads_database_without_secrets(in_memory_db):
+    from bot.database import get_user_config, set_user_config_many
+    from bot.handlers.callbacks import _format_config
+
+    set_user_config_many(5, {"api_key": "sk-secret", "model_name": "gpt-4o"})
+    text = _format_config(get_user_config(5))
+    assert "gpt-4o" in text and "sk-secret" not in text
+    assert "No hay configuración" in _format_config({})
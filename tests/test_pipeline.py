@@ -43,3 +43,124 @@ def test_pipeline_multimodal_by_model_name():
     cfg = {"model_name": "gpt-4o"}
     out = pipeline.run_pipeline(cfg, "hola")
     assert out.startswith("IMG:") or out.startswith("TEXT:")
+
+
+def test_pipeline_rejects_image_for_text_only_model():
+    cfg = {"model_name": "gpt-3.5-turbo"}
+    with pytest.raises(ValueError):
+        pipeline.run_pipeline(cfg, "describe", image_path="/tmp/fake.jpg")
+
+
+def test_pipeline_album_uses_single_multimodal_call():
+    cfg = {"model_name": "gpt-4o"}
+    out = pipeline.run_pipeline(cfg, "compara", image_paths=["/tmp/a.jpg", "/tmp/b.jpg"])
+    assert out.startswith("IMG:")
+
+
+def test_chat_multimodal_sends_one_part_per_image(monkeypatch, tmp_path):
+    from core import llm_clients
+
+    sent = {}
+
+    class FakeCompletions:
+        def create(self, model, messages):
+            sent["messages"] = messages
+            choice = type("C", (), {"message": type("M", (), {"content": "ok"})()})()
+            return type("R", (), {"choices": [choice]})()
+
+    class FakeOpenAI:
+        def __init__(self, api_key, base_url, http_client=None):
+            self.chat = type("Chat", (), {"completions": FakeCompletions()})()
+
+    monkeypatch.setattr(llm_clients, "OpenAI", FakeOpenAI)
+    paths = []
+    for name in ("a.jpg", "b.png"):
+        path = tmp_path / name
+        path.write_bytes(b"\x00\x01")
+        paths.append(path)
+
+    cfg = {"api_key": "k", "base_url": "http://x", "model_name": "gpt-4o"}
+    assert llm_clients.chat_multimodal(cfg, "compara", image_paths=paths) == "ok"
+    parts = sent["messages"][1]["content"]
+    assert [p["type"] for p in parts] == ["text", "image_url", "image_url"]
+    assert parts[2]["image_url"]["url"].startswith("data:image/png;base64,")
+
+
+def test_pipeline_reports_estimated_usage(monkeypatch):
+    def fake_chat_gpt(config, user_input, system_prompt=None, on_usage=None, **kwargs):
+        on_usage({"prompt_tokens": 9, "completion_tokens": 3})
+        return "ok"
+
+    monkeypatch.setattr(pipeline, "chat_gpt", fake_chat_gpt)
+    usage = {}
+    pipeline.run_pipeline({"model_name": "gpt-4-turbo"}, "hola", on_usage=usage.update)
+    assert usage["prompt_tokens"] == 9
+    assert usage.get("model") == "gpt-4-turbo"
+    assert usage.get("estimated_prompt_tokens", 0) > 0
+
+
+def test_compact_conversation_summarizes_with_previous_summary(monkeypatch, tmp_path):
+    from core.context import ConversationStore
+
+    prompts = []
+
+    def fake_chat_gpt(config, user_input, system_prompt=None, **kwargs):
+        prompts.append(user_input)
+        return f"resumen {len(prompts)}"
+
+    monkeypatch.setattr(pipeline, "chat_gpt", fake_chat_gpt)
+    store = ConversationStore(tmp_path / "ctx.db", compact_threshold_tokens=10, keep_recent_turns=1)
+    store.append(7, [{"role": "user", "content": "hola " * 20}, {"role": "assistant", "content": "ok"}])
+    assert pipeline.compact_conversation({"model_name": "x"}, 7, store=store)
+    store.append(7, [{"role": "user", "content": "adiós " * 20}, {"role": "assistant", "content": "ok"}])
+    assert pipeline.compact_conversation({"model_name": "x"}, 7, store=store)
+    assert "resumen 1" in prompts[-1]
+
+
+def test_summarize_document_maps_concurrently_and_reduces(monkeypatch):
+    import threading
+    import time
+
+    lock = threading.Lock()
+    active = {"now": 0, "max": 0}
+    calls = []
+
+    def _chat(config, user_input, system_prompt=None, **kwargs):
+        with lock:
+            active["now"] += 1
+            active["max"] = max(active["max"], active["now"])
+            calls.append(system_prompt)
+        time.sleep(0.01)
+        with lock:
+            active["now"] -= 1
+        if system_prompt == pipeline.REDUCE_PROMPT:
+            return "FINAL"
+        return "nota " + user_input.rsplit(":", 1)[-1].strip()
+
+    monkeypatch.setattr(pipeline, "chat_gpt", _chat)
+    progress = []
+    out = pipeline.summarize_document(
+        {"model_name": "gpt-4o"},
+        (f"parte {i}" for i in range(10)),
+        "Resume",
+        max_concurrency=3,
+        on_progress=lambda done, read: progress.append(done),
+    )
+    assert out == "FINAL"
+    assert calls.count(pipeline.MAP_PROMPT) == 10
+    assert calls.count(pipeline.REDUCE_PROMPT) == 1
+    assert 1 < active["max"] <= 3
+    assert sorted(progress) == list(range(1, 11))
+
+
+def test_summarize_short_document_uses_single_call(monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        pipeline,
+        "chat_gpt",
+        lambda config, user_input, system_prompt=None, **kwargs: calls.append(system_prompt) or "OK",
+    )
+    assert pipeline.summarize_document({"model_name": "gpt-4o"}, ["texto"], "Resume") == "OK"
+    assert calls == [None]
+    with pytest.raises(ValueError):
+        pipeline.summarize_document({"model_name": "gpt-4o"}, [], "Resume")
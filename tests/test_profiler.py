@@ -0,0 +1,111 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+from bot import profiler
+from bot.handlers import commands
+from bot.profiler import SamplingProfiler, describe_tasks, profile_running_bot
+
+
+def busy_loop(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_sampler_sees_other_threads_in_collapsed_format():
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_loop, args=(stop,), name="pool_3")
+    worker.start()
+    try:
+        profile = SamplingProfiler(interval=0.002).run(0.2)
+    finally:
+        stop.set()
+        worker.join()
+
+    assert profile.samples > 10
+    lines = profile.collapsed().splitlines()
+    stack, count = lines[0].rsplit(" ", 1)
+    assert int(count) > 0
+    busy = [line for line in lines if "busy_loop (test_profiler.py" in line]
+    # Los hilos de un pool se agrupan sin el sufijo numérico
+    assert busy and all(line.startswith("pool;") for line in busy)
+
+
+def test_task_snapshot_shows_what_each_task_awaits():
+    async def inner():
+        await asyncio.sleep(10)
+
+    async def outer():
+        await inner()
+
+    async def scenario():
+        task = asyncio.create_task(outer(), name="esperando-sleep")
+        await asyncio.sleep(0)
+        snapshot = describe_tasks()
+        task.cancel()
+        return snapshot
+
+    snapshot = asyncio.run(scenario())
+    block = snapshot.split("esperando-sleep [esperando]\n", 1)[1].split("\n\n", 1)[0]
+    steps = [line.strip() for line in block.splitlines()]
+    assert steps[0].startswith("test_task_snapshot_shows_what_each_task_awaits.<locals>.outer")
+    assert steps[1].startswith("test_task_snapshot_shows_what_each_task_awaits.<locals>.inner")
+    assert steps[-1] == "<Future>"
+
+
+def test_profile_covers_loop_and_executor_threads():
+    def blocking_call():
+        deadline = time.monotonic() + 0.3
+        while time.monotonic() < deadline:
+            sum(range(1000))
+
+    async def scenario():
+        call = asyncio.create_task(asyncio.to_thread(blocking_call), name="llamada-llm")
+        report = await profile_running_bot(0.2, SamplingProfiler(interval=0.002))
+        assert not profiler.is_busy()
+        await call
+        return report
+
+    report = asyncio.run(scenario())
+    assert "blocking_call" in report.profile.collapsed()
+    assert "llamada-llm" in report.tasks
+    assert report.summary().startswith("🔥 Perfil de 0.2 s")
+
+
+def test_profile_command_is_admin_only(monkeypatch):
+    replies = []
+    message = SimpleNamespace(reply_text=lambda text: replies.append(text) or asyncio.sleep(0))
+    update = SimpleNamespace(effective_user=SimpleNamespace(id=5), message=message)
+    monkeypatch.setattr(commands, "get_config", lambda: SimpleNamespace(admin_ids=(1,)))
+
+    asyncio.run(commands.profile_command(update, SimpleNamespace(args=["5"])))
+    assert replies == ["⛔ Comando reservado a administradores."]
+    assert commands.parse_profile_seconds(["9999"]) == profiler.MAX_SECONDS
+    assert commands.parse_profile_seconds(["x"]) == profiler.DEFAULT_SECONDS
+
+
+def test_profile_command_reports_profile_in_progress(monkeypatch):
+    replies = []
+    message = SimpleNamespace(reply_text=lambda text: replies.append(text) or asyncio.sleep(0))
+    update = SimpleNamespace(effective_user=SimpleNamespace(id=1), message=message)
+    monkeypatch.setattr(commands, "get_config", lambda: SimpleNamespace(admin_ids=(1,)))
+    monkeypatch.setattr(profiler, "_running", True)
+
+    asyncio.run(commands.profile_command(update, SimpleNamespace(args=["5"])))
+    assert replies == ["⏳ Ya hay un perfil en curso."]
+
+
+def test_profile_command_announces_only_a_started_profile(monkeypatch):
+    replies, documents = [], []
+    message = SimpleNamespace(
+        reply_text=lambda text: replies.append(text) or asyncio.sleep(0),
+        reply_document=lambda **kwargs: documents.append(kwargs["filename"]) or asyncio.sleep(0),
+    )
+    update = SimpleNamespace(effective_user=SimpleNamespace(id=1), message=message)
+    monkeypatch.setattr(commands, "get_config", lambda: SimpleNamespace(admin_ids=(1,)))
+    monkeypatch.setattr(commands, "parse_profile_seconds", lambda args: 0.05)
+
+    asyncio.run(commands.profile_command(update, SimpleNamespace(args=[])))
+    assert replies == ["🔥 Perfilando durante 0.05 s..."]
+    assert [name.split("-", 1)[0] for name in documents] == ["profile", "tasks"]
@@ -0,0 +1,75 @@
+import asyncio
+
+from telegram.error import BadRequest
+
+from bot.rendering import (
+    html_to_plain,
+    render_markdown,
+    send_rendered,
+    split_html,
+    utf16_len,
+)
+
+
+def test_render_markdown_formats_and_escapes():
+    out = render_markdown("**hola** a<b & `x<y` [link](https://a.b/?c=1&d=2)")
+    assert out == (
+        "<b>hola</b> a&lt;b &amp; <code>x&lt;y</code> "
+        '<a href="https://a.b/?c=1&amp;d=2">link</a>'
+    )
+
+
+def test_render_markdown_code_block_is_not_formatted():
+    out = render_markdown("```python\nx = a**b**c\n```")
+    assert out == '<pre><code class="language-python">x = a**b**c</code></pre>'
+
+
+def test_snake_case_is_not_italic():
+    assert render_markdown("usa snake_case_names") == "usa snake_case_names"
+
+
+def test_split_respects_limit_and_keeps_code_blocks_closed():
+    code = "\n".join(f"linea {i} <x>" for i in range(600))
+    markdown = f"Intro\n```\n{code}\n```\n" + "palabra " * 1500
+    chunks = split_html(markdown, limit=4096, prefix="🤖 Respuesta:\n")
+    assert len(chunks) > 1
+    assert chunks[0].startswith("🤖 Respuesta:\n")
+    for chunk in chunks:
+        assert utf16_len(chunk) <= 4096
+        assert chunk.count("<pre>") == chunk.count("</pre>")
+    plain = "".join(html_to_plain(c) for c in chunks)
+    assert "linea 599 <x>" in plain
+
+
+def test_short_answer_is_single_chunk():
+    assert split_html("hola", prefix="P:\n") == ["P:\n\nhola"]
+
+
+class FakeBot:
+    def __init__(self, reject_html=False):
+        self.calls = []
+        self.reject_html = reject_html
+
+    async def edit_message_text(self, text, chat_id, message_id, parse_mode=None):
+        return self._record("edit", text, parse_mode)
+
+    async def send_message(self, chat_id, text, parse_mode=None):
+        return self._record("send", text, parse_mode)
+
+    def _record(self, kind, text, parse_mode):
+        if self.reject_html and parse_mode == "HTML":
+            raise BadRequest("Can't parse entities: unsupported start tag")
+        self.calls.append((kind, parse_mode))
+
+
+def test_send_rendered_edits_then_sends_in_order():
+    bot = FakeBot()
+    calls = asyncio.run(send_rendered(bot, 1, 2, "x " * 5000))
+    assert calls == len(bot.calls) == 3
+    assert [kind for kind, _ in bot.calls] == ["edit", "send", "send"]
+
+
+def test_send_rendered_falls_back_to_plain_text():
+    bot = FakeBot(reject_html=True)
+    asyncio.run(send_rendered(bot, 1, 2, "**hola**"))
+    assert bot.calls == [("edit", None)]
@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+
+from core import pipeline
+from core.retrieval import HashingEmbedder, KnowledgeBase, VectorFile
+
+
+class CountingEmbedder(HashingEmbedder):
+    def __init__(self, dimensions=64):
+        super().__init__(dimensions)
+        self.batches = []
+
+    def embed(self, texts):
+        self.batches.append(len(texts))
+        return super().embed(texts)
+
+
+@pytest.fixture()
+def embedder():
+    return CountingEmbedder()
+
+
+@pytest.fixture()
+def kb(tmp_path, embedder):
+    return KnowledgeBase(
+        tmp_path / "index",
+        tmp_path / "bot.db",
+        batch_size=8,
+        min_score=0.1,
+        embedder_factory=lambda config: embedder,
+    )
+
+
+PASSAGES = [
+    "El volcán Teide está en Tenerife y mide 3715 metros.",
+    "La receta de paella lleva arroz, azafrán y caldo.",
+    "Python usa indentación para delimitar bloques de código.",
+]
+
+
+def test_search_returns_relevant_passage(kb):
+    assert kb.add_document(1, {}, "notas.md", PASSAGES * 10) == 30
+    hits = kb.search(1, {}, "¿cuánto mide el Teide en Tenerife?", k=2)
+    assert hits[0].text == PASSAGES[0]
+    assert hits[0].source == "notas.md"
+    assert hits[0].score >= hits[-1].score
+    # Otro usuario no ve los documentos
+    assert kb.search(2, {}, "Teide") == []
+
+
+def test_ingest_is_batched_and_queries_are_cached(kb, embedder):
+    kb.add_document(1, {}, "notas.md", PASSAGES * 7)
+    assert embedder.batches == [8, 8, 5]
+    kb.search(1, {}, "paella")
+    kb.search(1, {}, "paella")
+    assert embedder.batches == [8, 8, 5, 1]
+
+
+def test_index_survives_reopen_and_grows(kb, tmp_path):
+    kb.add_document(1, {}, "a.md", [f"fragmento {i} sobre volcanes" for i in range(1500)])
+    reopened = KnowledgeBase(
+        tmp_path / "index", tmp_path / "bot.db", embedder_factory=lambda config: HashingEmbedder(64)
+    )
+    assert reopened.count(1) == 1500
+    assert reopened.search(1, {}, "fragmento 1499 sobre volcanes", k=1, min_score=0)
+
+
+def test_model_mismatch_and_clear(kb, tmp_path):
+    kb.add_document(1, {}, "a.md", PASSAGES)
+    kb.embedder_factory = lambda config: HashingEmbedder(32)
+    with pytest.raises(ValueError, match="forget"):
+        kb.add_document(1, {}, "b.md", PASSAGES)
+    assert kb.clear(1) == 3
+    assert kb.count(1) == 0
+    assert not (tmp_path / "index" / "1").exists()
+
+
+def test_vector_search_top_k_float16(tmp_path):
+    index = VectorFile(tmp_path, 8, "test", "float16")
+    vectors = np.eye(8, dtype=np.float32)
+    index.append(vectors.astype("float16"))
+    assert [row for row, _ in index.search(vectors[3], 2)][0] == 3
+
+
+def test_run_pipeline_adds_retrieved_passages(kb, monkeypatch):
+    kb.add_document(7, {}, "notas.md", PASSAGES)
+    monkeypatch.setattr(pipeline, "knowledge", kb)
+    seen = {}
+    monkeypatch.setattr(
+        pipeline, "chat_gpt", lambda config, user_input, **kwargs: seen.setdefault("input", user_input)
+    )
+    pipeline.run_pipeline({"model_name": "gpt-4o"}, "¿qué lleva la paella?", retrieval_user_id=7)
+    assert "azafrán" in seen["input"]
+    assert seen["input"].endswith("¿qué lleva la paella?")
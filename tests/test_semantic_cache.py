@@ -0,0 +1,139 @@
+import pytest
+
+from core import pipeline
+from core.retrieval import HashingEmbedder
+from core.semantic_cache import SemanticCache, normalize_query
+
+CONFIG = {"model_name": "gpt-4o", "base_url": "https://api.test/v1", "system_prompt": "FAQ tienda"}
+
+
+def _cache(**kwargs):
+    options = {"threshold": 0.7, "audit_rate": 0.0, "embedder_factory": lambda config: HashingEmbedder(128)}
+    options.update(kwargs)
+    return SemanticCache(**options)
+
+
+class Model:
+    def __init__(self, answer="respuesta"):
+        self.answer = answer
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return f"{self.answer} {self.calls}"
+
+
+def test_normalize_query():
+    assert normalize_query("  ¿Qué   HORARIO tienen? ") == "que horario tienen"
+
+
+def test_paraphrase_hits_and_exact_skips_embedding():
+    cache = _cache()
+    model = Model()
+    assert cache.get_or_compute(CONFIG, "¿Cuál es el horario de atención de la tienda?", model) == (
+        "respuesta 1",
+        False,
+    )
+    answer, cached = cache.get_or_compute(CONFIG, "horario de atención de la tienda", model)
+    assert (answer, cached) == ("respuesta 1", True)
+    answer, cached = cache.get_or_compute(CONFIG, "cual es el HORARIO de atencion de la tienda", model)
+    assert cached and model.calls == 1
+
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["exact_hits"] == 1 and stats["misses"] == 1
+
+
+def test_scope_separates_models_and_system_prompts():
+    cache = _cache()
+    model = Model()
+    cache.get_or_compute(CONFIG, "horario de la tienda", model)
+    cache.get_or_compute({**CONFIG, "system_prompt": "Otro bot"}, "horario de la tienda", model)
+    cache.get_or_compute({**CONFIG, "model_name": "gpt-4o-mini"}, "horario de la tienda", model)
+    assert model.calls == 3
+
+
+def test_unrelated_question_misses():
+    cache = _cache()
+    model = Model()
+    cache.get_or_compute(CONFIG, "horario de la tienda", model)
+    _, cached = cache.get_or_compute(CONFIG, "precio del envío a Canarias", model)
+    assert not cached
+
+
+@pytest.mark.parametrize("eviction, survivor", [("lru", "b"), ("lfu", "a")])
+def test_eviction_policies(eviction, survivor):
+    cache = _cache(capacity=2, eviction=eviction, threshold=0.99)
+    model = Model()
+    cache.get_or_compute(CONFIG, "pregunta a", model)
+    cache.get_or_compute(CONFIG, "pregunta a", model)  # a: 1 acierto
+    cache.get_or_compute(CONFIG, "pregunta b", model)  # b: más reciente
+    cache.get_or_compute(CONFIG, "pregunta c", model)  # desaloja a (lru) o b (lfu)
+
+    assert cache.stats()["evictions"] == 1
+    _, cached = cache.get_or_compute(CONFIG, f"pregunta {survivor}", model)
+    assert cached
+
+
+def test_ttl_expires_entries():
+    cache = _cache(ttl_seconds=0)
+    model = Model()
+    cache.get_or_compute(CONFIG, "horario", model)
+    _, cached = cache.get_or_compute(CONFIG, "horario", model)
+    assert not cached and model.calls == 2
+
+
+def test_audit_counts_false_hits_and_replaces_answer():
+    cache = _cache(audit_rate=1.0)
+    cache.get_or_compute(CONFIG, "horario de la tienda", lambda: "abrimos de nueve a cinco")
+    answer, cached = cache.get_or_compute(
+        CONFIG, "horario de la tienda", lambda: "cerrado por vacaciones en agosto"
+    )
+    assert (answer, cached) == ("cerrado por vacaciones en agosto", False)
+    stats = cache.stats()
+    assert stats["audits"] == 1 and stats["false_hits"] == 1 and stats["false_hit_rate"] == 1.0
+
+    cache.audit_rate = 0.0
+    assert cache.get_or_compute(CONFIG, "horario de la tienda", lambda: "nuevo") == (
+        "cerrado por vacaciones en agosto",
+        True,
+    )
+
+
+def test_cached_pipeline_bypasses_images_and_reports_hits(monkeypatch):
+    cache = _cache()
+    calls = []
+    monkeypatch.setattr(pipeline, "chat_gpt", lambda config, user_input, **kwargs: calls.append(1) or "texto")
+    monkeypatch.setattr(pipeline, "chat_multimodal", lambda config, user_input, **kwargs: calls.append(2) or "imagen")
+
+    usage = []
+    for _ in range(2):
+        pipeline.run_cached_pipeline(CONFIG, "horario", cache=cache, on_usage=usage.append)
+        pipeline.run_cached_pipeline(CONFIG, "horario", cache=cache, image_paths=["/tmp/a.jpg"])
+    assert calls == [1, 2, 2]
+    assert usage[-1] == {"model": "gpt-4o", "cache_hit": True}
+
+
+def test_answers_that_depend_on_history_are_not_shared(monkeypatch):
+    cache = _cache()
+
+    def fake_chat(config, user_input, history=None, **kwargs):
+        names = [turn["content"].split()[-1] for turn in history or []]
+        return f"Te llamas {names[-1]}" if names else "No lo sé"
+
+    monkeypatch.setattr(pipeline, "chat_gpt", fake_chat)
+    juan = [{"role": "user", "content": "Me llamo Juan"}]
+    ana = [{"role": "user", "content": "Me llamo Ana"}]
+    assert pipeline.run_cached_pipeline(CONFIG, "¿cómo me llamo?", cache=cache, history=juan) == "Te llamas Juan"
+    assert pipeline.run_cached_pipeline(CONFIG, "¿cómo me llamo?", cache=cache, history=ana) == "Te llamas Ana"
+    assert pipeline.run_cached_pipeline(CONFIG, "¿cómo me llamo?", cache=cache) == "No lo sé"
+
+    # Con la partición del chat la caché funciona, pero sin salir de él
+    def ask(history, chat):
+        return pipeline.run_cached_pipeline(
+            CONFIG, "¿cómo me llamo?", cache=cache, history=history, cache_partition=chat
+        )
+
+    assert ask(juan, 1) == "Te llamas Juan"
+    assert ask(ana, 2) == "Te llamas Ana"
+    assert ask(juan, 1) == "Te llamas Juan"
+    assert cache.stats()["exact_hits"] == 1
@@ -0,0 +1,42 @@
+import subprocess
+import sys
+
+import pytest
+
+from bot import config
+from run_bot import ROOT, parse_importtime
+
+
+def test_load_config_requires_token(monkeypatch, tmp_path):
+    monkeypatch.delenv("TELEGRAM_TOKEN", raising=False)
+    with pytest.raises(ValueError):
+        config.load_config(env_file=str(tmp_path / "missing.env"))
+
+
+def test_get_config_reads_env_without_validating(monkeypatch):
+    monkeypatch.delenv("TELEGRAM_TOKEN", raising=False)
+    monkeypatch.setenv("JOB_WORKERS", "7")
+    monkeypatch.setattr(config, "_settings", None)
+    settings = config.get_config()
+    assert settings.telegram_token is None
+    assert settings.job_workers == 7
+
+
+def test_heavy_sdks_are_not_imported_eagerly():
+    code = (
+        "import sys, bot.main; "
+        "print(any(name in sys.modules for name in ('openai', 'numpy', 'telegram.ext')))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == "False"
+
+
+def test_parse_importtime():
+    output = (
+        "import time: self [us] | cumulative | imported package\n"
+        "import time:       120 |        120 |     json.decoder\n"
+        "import time:       300 |        420 |   json\n"
+    )
+    assert parse_importtime(output) == [("json.decoder", 120, 120, 2), ("json", 300, 420, 1)]
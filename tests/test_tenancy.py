@@ -0,0 +1,104 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from bot import database as db
+from bot import jobs
+from bot.tenancy import current_bot, hosted_bots, scoped_id, use_bot
+from core.context import ConversationStore
+
+
+def test_hosted_bots_put_primary_first_and_skip_duplicates():
+    bots = hosted_bots("111:aaa", ("222:bbb", "111:aaa", "333:ccc"))
+    assert bots == [(0, "111:aaa"), (222, "222:bbb"), (333, "333:ccc")]
+    # Sin TELEGRAM_TOKEN el primero de la lista hace de principal
+    assert hosted_bots(None, ("222:bbb", "333:ccc"))[0] == (0, "222:bbb")
+    with pytest.raises(ValueError):
+        hosted_bots("111:aaa", ("222:bbb", "222:otro"))
+    with pytest.raises(ValueError):
+        hosted_bots("111:aaa", ("sin-formato",))
+
+
+def test_scoped_id_only_prefixes_secondary_bots():
+    assert scoped_id(42) == 42
+    with use_bot(222):
+        assert scoped_id(42) == "222_42"
+    assert current_bot.get() == 0
+
+
+def test_user_config_is_isolated_per_bot(in_memory_db):
+    db.set_user_config(1, "model_name", "gpt-4o")
+    with use_bot(222):
+        assert db.get_user_config(1).get("model_name") is None
+        db.set_user_config(1, "model_name", "llama3")
+        assert db.get_user_config(1)["model_name"] == "llama3"
+    assert db.get_user_config(1)["model_name"] == "gpt-4o"
+
+
+def test_legacy_user_config_moves_to_primary_bot(monkeypatch, tmp_path):
+    path = tmp_path / "legacy.db"
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE user_config (user_id INTEGER PRIMARY KEY, api_key TEXT, base_url TEXT, "
+        "model_name TEXT, system_prompt TEXT, created_at TIMESTAMP)"
+    )
+    conn.execute("INSERT INTO user_config (user_id, model_name) VALUES (7, 'gpt-4o')")
+    conn.commit()
+    conn.close()
+
+    monkeypatch.setattr(db, "DB_PATH", path)
+    db.init_db()
+    assert db.get_user_config(7)["model_name"] == "gpt-4o"
+    with use_bot(222):
+        assert db.get_user_config(7).get("model_name") is None
+
+
+def test_noisy_bot_does_not_starve_the_others(in_memory_db):
+    jobs.init_jobs_table()
+    with use_bot(222):
+        for update_id in range(1, 6):
+            jobs.enqueue_job(update_id, 1, 1, {})
+    # Mismo update_id en otro bot: espacios de nombres distintos
+    assert jobs.enqueue_job(1, 2, 2, {})
+    peak = {}
+    order = []
+
+    async def processor(job, bot):
+        order.append((job.bot_id, bot))
+        peak[job.bot_id] = max(peak.get(job.bot_id, 0), queue._active[job.bot_id])
+        await asyncio.sleep(0.05)
+
+    async def scenario():
+        await queue.start(bot="principal", processor=processor, workers=3, bots={222: "marca"}, per_bot_limit=1)
+        for _ in range(100):
+            if jobs.count_jobs(jobs.DONE) == 6:
+                break
+            await asyncio.sleep(0.02)
+        await queue.stop()
+
+    queue = jobs.LLMJobQueue(poll_interval=0.02)
+    asyncio.run(scenario())
+    assert jobs.count_jobs(jobs.DONE) == 6
+    assert peak == {222: 1, 0: 1}
+    # El trabajo del bot principal no espera a que se vacíe la cola del otro
+    assert order.index((0, "principal")) < 2
+
+
+def test_conversation_keys_with_bot_namespace(tmp_path):
+    path = tmp_path / "ctx.db"
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE chat_summaries (chat_id INTEGER PRIMARY KEY, summary TEXT NOT NULL, "
+        "covered_until INTEGER NOT NULL, version INTEGER NOT NULL, updated_at REAL NOT NULL)"
+    )
+    conn.execute("INSERT INTO chat_summaries VALUES (5, 'resumen previo', 0, 1, 0)")
+    conn.commit()
+    conn.close()
+
+    store = ConversationStore(db_path=path, compact_threshold_tokens=1, keep_recent_turns=0)
+    turns = [{"role": "user", "content": "hola"}, {"role": "assistant", "content": "qué tal"}]
+    store.append("222_5", turns)
+    assert store.compact("222_5", lambda previous, old: "resumen del otro bot")
+    assert store.history(5)[0]["content"].endswith("resumen previo")
+    assert store.history("222_5")[0]["content"].endswith("resumen del otro bot")
@@ -0,0 +1,63 @@
+import pytest
+
+from core.tokens import (
+    IMAGE_TOKENS,
+    HeuristicTokenizer,
+    TokenEstimator,
+    TRUNCATION_MARKER,
+    plan_prompt,
+)
+
+
+class CountingTokenizer:
+    def __init__(self):
+        self.calls = 0
+
+    def count(self, text):
+        self.calls += 1
+        return len(text.split())
+
+
+def test_heuristic_tokenizer_is_monotonic():
+    tok = HeuristicTokenizer()
+    assert tok.count("") == 0
+    assert tok.count("hola") == 1
+    assert tok.count("hola mundo " * 100) > tok.count("hola mundo")
+    # Caracteres no ASCII cuentan más por carácter
+    assert tok.count("ñ" * 8) > tok.count("n" * 8)
+
+
+def test_estimator_memoizes_repeated_strings():
+    tokenizer = CountingTokenizer()
+    estimator = TokenEstimator(tokenizer)
+    assert estimator.count("a b c") == 3
+    assert estimator.count("a b c") == 3
+    assert tokenizer.calls == 1
+
+
+def test_count_messages_includes_images():
+    estimator = TokenEstimator(CountingTokenizer())
+    messages = [
+        {"role": "system", "content": "uno dos"},
+        {"role": "user", "content": [{"type": "text", "text": "tres"}, {"type": "image_url"}]},
+    ]
+    assert estimator.count_messages(messages) >= 3 + IMAGE_TOKENS
+
+
+def test_plan_prompt_without_context_does_not_truncate():
+    budget = plan_prompt("modelo-x", "sys", "hola " * 1000)
+    assert not budget.truncated and budget.context_tokens is None
+
+
+def test_plan_prompt_truncates_keeping_head_and_tail():
+    text = "INICIO " + "relleno " * 5000 + " FINAL"
+    budget = plan_prompt("modelo-x", "sys", text, context_tokens=2000, max_output_tokens=500)
+    assert budget.truncated
+    assert budget.prompt_tokens <= 2000 - 500
+    assert budget.user_input.startswith("INICIO") and budget.user_input.endswith("FINAL")
+    assert TRUNCATION_MARKER in budget.user_input
+
+
+def test_plan_prompt_rejects_when_images_do_not_fit():
+    with pytest.raises(ValueError):
+        plan_prompt("modelo-x", "sys", "hola", images=4, context_tokens=2048)
@@ -0,0 +1,156 @@
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from core import pipeline, tools
+from core.tools import LookupService, ToolRegistry, builtin_tools, chat_with_tools, evaluate, register_lookup
+
+CONFIG = {"api_key": "sk-test", "base_url": "https://api.test/v1", "model_name": "gpt-4o"}
+
+
+def _call(call_id, name, **arguments):
+    return SimpleNamespace(
+        id=call_id, function=SimpleNamespace(name=name, arguments=json.dumps(arguments))
+    )
+
+
+def _response(content=None, calls=None):
+    usage = SimpleNamespace(prompt_tokens=10, completion_tokens=2, total_tokens=12)
+    message = SimpleNamespace(content=content, tool_calls=calls)
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+
+
+class ScriptedClient:
+    """Devuelve las respuestas en orden y guarda los argumentos de cada llamada."""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def with_options(self, timeout):
+        return self
+
+    def _create(self, **kwargs):
+        self.requests.append({**kwargs, "messages": list(kwargs["messages"])})
+        return self.responses.pop(0)
+
+
+@pytest.fixture()
+def client(monkeypatch):
+    def _install(*responses):
+        scripted = ScriptedClient(responses)
+        monkeypatch.setattr(tools, "get_client", lambda api_key, base_url: scripted)
+        return scripted
+
+    return _install
+
+
+def test_tool_calls_in_one_turn_run_concurrently(client):
+    registry = ToolRegistry()
+
+    @registry.register("Espera y devuelve la ciudad", {"type": "object", "properties": {}})
+    async def weather(city):
+        await asyncio.sleep(0.2)
+        return {"city": city, "temp": 20}
+
+    scripted = client(
+        _response(calls=[_call("a", "weather", city="Madrid"), _call("b", "weather", city="Lima")]),
+        _response("Hace 20 grados en las dos"),
+    )
+    usage = {}
+    started = time.monotonic()
+    answer = chat_with_tools(CONFIG, "¿Qué tiempo hace?", registry, on_usage=usage.update)
+
+    assert answer == "Hace 20 grados en las dos"
+    assert time.monotonic() - started < 0.35
+    tool_messages = [m for m in scripted.requests[1]["messages"] if m["role"] == "tool"]
+    assert [m["tool_call_id"] for m in tool_messages] == ["a", "b"]
+    assert json.loads(tool_messages[1]["content"])["city"] == "Lima"
+    assert usage == {"prompt_tokens": 20, "completion_tokens": 4, "total_tokens": 24, "steps": 2, "tool_calls": 2}
+
+
+def test_tool_errors_and_timeouts_are_fed_back(client):
+    registry = ToolRegistry()
+
+    @registry.register("Lenta", timeout=0.05)
+    async def slow():
+        await asyncio.sleep(1)
+
+    @registry.register("Rota")
+    async def broken():
+        raise RuntimeError("sin conexión")
+
+    scripted = client(
+        _response(calls=[_call("a", "slow"), _call("b", "broken"), _call("c", "missing")]),
+        _response("Lo siento"),
+    )
+    assert chat_with_tools(CONFIG, "hola", registry) == "Lo siento"
+    contents = [m["content"] for m in scripted.requests[1]["messages"] if m["role"] == "tool"]
+    assert "tiempo límite" in contents[0]
+    assert "sin conexión" in contents[1]
+    assert "no existe" in contents[2]
+
+
+def test_loop_is_bounded_by_max_steps(client):
+    scripted = client(
+        *[_response(calls=[_call(str(i), "calculator", expression="1+1")]) for i in range(2)],
+        _response("2"),
+    )
+    assert chat_with_tools(CONFIG, "1+1", builtin_tools(), max_steps=2) == "2"
+    assert len(scripted.requests) == 3
+    assert scripted.requests[-1]["tool_choice"] == "none"
+
+
+def test_empty_content_is_returned_as_text(client):
+    client(_response(calls=[_call("a", "calculator", expression="1")]), _response(None))
+    assert chat_with_tools(CONFIG, "1", builtin_tools(), max_steps=1) == ""
+    client(_response(None))
+    assert chat_with_tools(CONFIG, "hola", builtin_tools()) == ""
+
+
+def test_deadline_exhausted_raises(client):
+    client(_response(calls=[_call("a", "calculator", expression="1")]))
+    with pytest.raises(TimeoutError):
+        chat_with_tools(CONFIG, "hola", builtin_tools(), deadline_seconds=0)
+
+
+def test_calculator_is_safe():
+    assert evaluate("2^10 + sqrt(16)") == 1028
+    for expression in ("__import__('os')", "9**9**9", "(10**1000)**1000"):
+        with pytest.raises(ValueError):
+            evaluate(expression)
+
+
+def test_lookup_service_can_be_stubbed():
+    class StubLookup(LookupService):
+        async def lookup(self, query):
+            return f"pedido {query}: enviado"
+
+    registry = ToolRegistry()
+    register_lookup(registry, StubLookup(), name="orders")
+    result = asyncio.run(registry.execute("orders", json.dumps({"query": "A-17"})))
+    assert result == "pedido A-17: enviado"
+    assert registry.schemas()[0]["function"]["parameters"]["required"] == ["query"]
+
+    class Unimplemented(LookupService):
+        pass
+
+    with pytest.raises(TypeError):
+        register_lookup(registry, Unimplemented())
+
+
+def test_pipeline_uses_tool_loop_when_tools_are_given(monkeypatch):
+    seen = {}
+
+    def fake_chat_with_tools(config, user_input, registry, on_usage=None, max_steps=4, **kwargs):
+        seen.update(registry=registry, max_steps=max_steps)
+        return "con herramientas"
+
+    monkeypatch.setattr(pipeline, "chat_with_tools", fake_chat_with_tools)
+    registry = builtin_tools()
+    assert pipeline.run_pipeline(CONFIG, "hora", tools=registry, max_steps=2) == "con herramientas"
+    assert seen == {"registry": registry, "max_steps": 2}
@@ -0,0 +1,73 @@
+import asyncio
+
+from telegram import Update
+
+from bot.traffic import (
+    TrafficRecorder,
+    anonymize_text,
+    event_to_update,
+    load_events,
+    replay,
+)
+
+
+def _update(update_id, chat_id, text=None, photo=None):
+    message = {
+        "message_id": update_id,
+        "date": 0,
+        "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": "u"},
+    }
+    if text is not None:
+        message["text"] = text
+    if photo is not None:
+        message["photo"] = [photo]
+    return Update.de_json({"update_id": update_id, "message": message}, None)
+
+
+def test_anonymize_text_preserves_length_and_command():
+    assert anonymize_text("hola mundo") == "xxxx xxxxx"
+    assert anonymize_text("/set_api_key sk-123") == "/set_api_key xxxxxx"
+
+
+def test_recorder_hashes_ids_and_hides_content(tmp_path):
+    path = tmp_path / "traffic.jsonl"
+    recorder = TrafficRecorder(path, salt="fijo")
+    photo = {"file_id": "a", "file_unique_id": "a", "width": 800, "height": 600, "file_size": 12345}
+    asyncio.run(recorder.record(_update(1, 42, text="secreto"), None))
+    asyncio.run(recorder.record(_update(2, 42, photo=photo), None))
+    recorder.close()
+
+    raw = path.read_text(encoding="utf-8")
+    text_event, photo_event = load_events(path)
+    assert "secreto" not in raw
+    assert text_event["c"] != "42" and len(text_event["c"]) == 16
+    assert text_event["k"] == "text" and text_event["x"] == "xxxxxxx"
+    assert photo_event["k"] == "photo" and photo_event["p"] == [800, 600, 12345]
+    assert text_event["c"] == photo_event["c"]
+
+
+def test_event_to_update_is_valid_telegram_update():
+    data = event_to_update({"t": 0, "c": "ab", "f": "cd", "k": "command", "x": "/start"}, 7)
+    update = Update.de_json(data, None)
+    assert update.update_id == 7
+    assert update.message.text == "/start"
+
+
+def test_replay_preserves_per_chat_order():
+    events = [
+        {"t": 0.0, "c": "a", "k": "text", "x": "1"},
+        {"t": 0.0, "c": "b", "k": "text", "x": "1"},
+        {"t": 0.01, "c": "a", "k": "text", "x": "2"},
+        {"t": 0.02, "c": "a", "k": "text", "x": "3"},
+    ]
+    received = []
+
+    async def sink(payload):
+        await asyncio.sleep(0)
+        received.append((payload["message"]["chat"]["id"], payload["message"]["text"]))
+
+    sent = asyncio.run(replay(events, sink, speed=None))
+    assert sent == 4
+    chat_a = [text for chat, text in received if chat == received[0][0]]
+    assert chat_a == ["1", "2", "3"]
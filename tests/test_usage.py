@@ -0,0 +1,66 @@
+import asyncio
+
+from bot import usage as usage_module
+from bot.usage import UsageAccountant, init_usage_table, read_daily, today
+
+
+def test_counters_aggregate_in_memory_until_flush(in_memory_db):
+    init_usage_table()
+    accountant = UsageAccountant()
+    accountant.record(1, {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15}, latency=0.5)
+    accountant.record(1, {"prompt_tokens": 20, "completion_tokens": 1, "total_tokens": 21}, latency=1.5)
+    accountant.record(1, latency=0.2, error=True)
+    assert read_daily(1) == {}
+
+    asyncio.run(accountant.flush())
+    stored = read_daily(1)[today()]
+    assert stored.requests == 3 and stored.errors == 1
+    assert stored.prompt_tokens == 30 and stored.completion_tokens == 6
+    assert stored.latency_ms_total == 2200 and stored.latency_ms_max == 1500
+    assert accountant.pending() == {}
+
+
+def test_flushes_upsert_into_daily_rollup(in_memory_db):
+    init_usage_table()
+    accountant = UsageAccountant()
+
+    async def scenario():
+        accountant.record(1, {"prompt_tokens": 10}, latency=0.1)
+        await accountant.flush()
+        accountant.record(1, {"prompt_tokens": 5}, latency=0.3)
+        accountant.record(2, {"prompt_tokens": 7}, latency=0.1)
+        # La consulta combina lo persistido con lo pendiente
+        return await accountant.daily(1)
+
+    days = asyncio.run(scenario())
+    assert [(day, c.requests, c.prompt_tokens) for day, c in days] == [(today(), 2, 15)]
+
+    asyncio.run(accountant.flush())
+    assert read_daily(1)[today()].latency_ms_max == 300
+    assert read_daily(2)[today()].requests == 1
+
+
+def test_failed_flush_keeps_counters(in_memory_db, monkeypatch):
+    init_usage_table()
+    accountant = UsageAccountant()
+    accountant.record(1, {"prompt_tokens": 10})
+
+    def broken(batch):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(usage_module, "write_counters", broken)
+    asyncio.run(accountant.flush())
+    assert accountant.pending()[(1, today())].prompt_tokens == 10
+
+
+def test_stop_flushes_pending_counters(in_memory_db):
+    init_usage_table()
+    accountant = UsageAccountant(flush_interval=60)
+
+    async def scenario():
+        await accountant.start()
+        accountant.record(3, {"prompt_tokens": 4})
+        await accountant.stop()
+
+    asyncio.run(scenario())
+    assert read_daily(3)[today()].prompt_tokens == 4
@@ -0,0 +1,145 @@
+import asyncio
+import json
+import sqlite3
+
+from bot import database as db
+from bot import warmstart
+from bot.tenancy import use_bot
+from bot.warmstart import WarmSet, save_snapshot, load_snapshot, warm_start
+from core import llm_clients
+
+
+def _seed(users):
+    for user_id, base_url in users:
+        db.set_user_config_many(
+            user_id,
+            {"api_key": f"sk-secret{user_id:08d}", "base_url": base_url, "model_name": "gpt-4o"},
+        )
+
+
+def test_warm_set_keeps_most_recent_first():
+    warm = WarmSet(max_users=3)
+    for user_id in (1, 2, 3, 1, 4):
+        warm.touch(user_id)
+    assert warm.users() == [(0, 4), (0, 1), (0, 3)]
+
+
+def test_snapshot_roundtrip_has_no_secrets(in_memory_db, tmp_path):
+    _seed([(1, "https://a.test/v1"), (2, "https://a.test/v1"), (3, "https://b.test/v1")])
+    warm = WarmSet()
+    for user_id in (3, 2, 1):
+        warm.touch(user_id)
+
+    path = tmp_path / "warm.json"
+    save_snapshot(path, warm)
+    raw = path.read_text(encoding="utf-8")
+    assert "sk-secret" not in raw
+
+    snapshot = load_snapshot(path)
+    assert snapshot["users"] == [(0, 1), (0, 2), (0, 3)]
+    assert snapshot["endpoints"][0] == {"base_url": "https://a.test/v1", "models": ["gpt-4o"], "users": 2}
+
+
+def test_stale_snapshot_is_ignored(tmp_path):
+    path = tmp_path / "warm.json"
+    path.write_text(json.dumps({"saved_at": 0, "users": [1], "endpoints": []}), encoding="utf-8")
+    assert load_snapshot(path) is None
+
+
+def test_legacy_snapshot_users_belong_to_primary_bot(tmp_path):
+    path = tmp_path / "warm.json"
+    path.write_text(json.dumps({"saved_at": 9e12, "users": [1, [222, 2]], "endpoints": []}), encoding="utf-8")
+    assert load_snapshot(path)["users"] == [(0, 1), (222, 2)]
+
+
+def test_prefetch_fills_cache_and_set_invalidates(in_memory_db, monkeypatch):
+    _seed([(1, "https://a.test/v1"), (2, "https://a.test/v1")])
+    db.clear_config_cache()
+    assert db.prefetch_user_configs([1, 2, 99]) == 2
+
+    # Con la caché llena no se abre ninguna conexión
+    connect, opened = sqlite3.connect, []
+    monkeypatch.setattr(db.sqlite3, "connect", lambda *a, **k: opened.append(a) or connect(*a, **k))
+    assert db.get_user_config(1)["model_name"] == "gpt-4o"
+    assert db.get_user_config(99) == {}
+    assert opened == []
+
+    db.set_user_config(1, "model_name", "gpt-4-turbo")
+    assert db.get_user_config(1)["model_name"] == "gpt-4-turbo"
+
+
+def test_warm_start_prefetches_and_warms_endpoints(in_memory_db, tmp_path, monkeypatch):
+    _seed([(1, "https://a.test/v1"), (2, "https://b.test/v1")])
+    warm = WarmSet()
+    warm.touch(2)
+    warm.touch(1)
+    path = tmp_path / "warm.json"
+    save_snapshot(path, warm)
+    db.clear_config_cache()
+
+    warmed = []
+    monkeypatch.setattr(warmstart.registry, "refresh", lambda base_url, api_key: None)
+    monkeypatch.setattr(
+        warmstart, "warm_endpoint", lambda api_key, base_url: warmed.append((base_url, api_key)) or True
+    )
+
+    restored = WarmSet()
+    summary = asyncio.run(warm_start(path, restored, top_endpoints=1))
+    assert summary == {"users": 2, "endpoints": 1}
+    assert warmed == [("https://a.test/v1", "sk-secret00000001")]
+    assert restored.users() == [(0, 1), (0, 2)]
+
+
+def test_warm_start_covers_secondary_bots(in_memory_db, tmp_path, monkeypatch):
+    with use_bot(222):
+        _seed([(5, "https://c.test/v1")])
+        warm = WarmSet()
+        warm.touch(5)
+    path = tmp_path / "warm.json"
+    snapshot = save_snapshot(path, warm)
+    assert snapshot["endpoints"] == [{"base_url": "https://c.test/v1", "models": ["gpt-4o"], "users": 1}]
+    db.clear_config_cache()
+
+    warmed = []
+    monkeypatch.setattr(warmstart.registry, "refresh", lambda base_url, api_key: None)
+    monkeypatch.setattr(
+        warmstart, "warm_endpoint", lambda api_key, base_url: warmed.append((base_url, api_key)) or True
+    )
+    restored = WarmSet()
+    assert asyncio.run(warm_start(path, restored)) == {"users": 1, "endpoints": 1}
+    assert warmed == [("https://c.test/v1", "sk-secret00000005")]
+    assert restored.users() == [(222, 5)]
+
+    # La configuración quedó en la caché del bot 222, no en la del principal
+    connect, opened = sqlite3.connect, []
+    monkeypatch.setattr(db.sqlite3, "connect", lambda *a, **k: opened.append(a) or connect(*a, **k))
+    with use_bot(222):
+        assert db.get_user_config(5)["model_name"] == "gpt-4o"
+    assert opened == []
+
+
+def test_client_pool_reuses_clients(monkeypatch):
+    created = []
+
+    class FakeOpenAI:
+        def __init__(self, **kwargs):
+            created.append(kwargs)
+
+        def close(self):
+            raise AssertionError("un cliente expulsado no se cierra")
+
+    monkeypatch.setattr(llm_clients, "OpenAI", FakeOpenAI)
+    monkeypatch.setattr(llm_clients, "_clients", type(llm_clients._clients)())
+    monkeypatch.setattr(llm_clients, "_http_clients", type(llm_clients._http_clients)())
+    monkeypatch.setattr(llm_clients, "MAX_CLIENTS", 2)
+    first = llm_clients.get_client("sk-1", "https://a.test/v1")
+    assert llm_clients.get_client("sk-1", "https://a.test/v1") is first
+    assert llm_clients.get_client("sk-2", "https://a.test/v1") is not first
+    assert len(created) == 2
+    # Las conexiones (y el calentamiento) se comparten entre API keys del endpoint
+    assert created[0]["http_client"] is created[1]["http_client"]
+
+    llm_clients.get_client("sk-1", "https://b.test/v1")
+    assert created[2]["http_client"] is not created[0]["http_client"]
+    assert len(llm_clients._clients) == 2
+    assert not created[0]["http_client"].is_closed